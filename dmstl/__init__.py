@@ -22,13 +22,25 @@
 
 from .logging import get_logger
 from .dbi import DatabaseInterface
+from .dbim import DatabaseInterfaceInMemory
+from .dispatch import OverloadPolicy
 from .insulation import TwitterCredentialsLoadFromMemory, TwitterCredentialsLoadFromDatabase
 from .map import *
+from .metrics import MetricsServer
 from .opcruncher import OctoPrintRawDataCruncher
+from .opcadence import OctoPrintPollCadence
 from .oplog import OctoPrintRawDataLogger
 from .opprattler import OctoPrintIdlePrattler, OctoPrintSuccessPrattler, OctoPrintGetBusyPrattler, OctoPrintInoperablePrattler, OctoPrintPausedPrattler
-from .opraw import OctoPrintRawDataCollectors
+from .opraw import OctoPrintRawDataCollectors, OctoPrintRawDataBatchAdapter
+from .opaio import OctoPrintAsyncRawDataCollectors
+from .oppush import OctoPrintPushRawDataCollectors
+from .opshard import OctoPrintShardedRawDataCollectors
+from .oprecord import OctoPrintRawDataRecorder, OctoPrintRawDataReplay
+from .profiler import OnDemandProfiler
 from .rs import RedundantStrings
-from .scheduler import ToolLogsScheduler
-from .twitter import TwitterCredentials, TwitterThread, TwitterNull
+from .scheduler import ToolLogsScheduler, DispatchingToolLogsScheduler, OverrunPolicy
+from .timing import enable_stage_timing, stage_statistics, stage_summary, log_stage_summary, log_stage_summary_on_signal
+from .trace import enable_tracing, disable_tracing
+from .twitter import TwitterCredentials, TwitterCredentialsLoadNone, TwitterThread, TwitterNull
+from .unrecognized import load_ignore_list, unrecognized_summary, log_unrecognized_summary, log_unrecognized_summary_every
 
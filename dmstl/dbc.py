@@ -23,14 +23,22 @@
 # rmv https://github.com/niklasf/indexed.py
 # rmv import indexed
 
+# alive and commit are given the sample's FieldValues when the logger maps
+# into a value buffer (see FieldMapSchema); otherwise the field maps hold the
+# values.
+
 class DeadbandCheckerBase:
     def __init__(self):
         super().__init__()
-    def alive(self):
+    def alive(self, values=None):
+        return False
+    def alive_when_unchanged(self):
+        # True if the checker could fire even though the raw data has not
+        # changed (e.g. a heartbeat).
         return False
-    def commit(self):
+    def commit(self, values=None):
         pass
-    def set_field_map(self, new_field_map):
+    def set_field_map(self, new_field_map, index=None):
         pass
 
 class DeadbandCheckerAlwaysDead(DeadbandCheckerBase):
@@ -43,9 +51,9 @@ class DeadbandCheckerDoOnce(DeadbandCheckerBase):
         self._count = 1
     def __str__(self):
         return "Do Once"
-    def alive(self):
+    def alive(self, values=None):
         return self._count > 0
-    def commit(self):
+    def commit(self, values=None):
         if self._count > 0:
             self._count -= 1
 
@@ -58,14 +66,19 @@ class DeadbandChecker(DeadbandCheckerBase):
         return "Any Change"
     def values_significantly_different(self, lft, rgt):
         return lft != rgt
-    def alive(self):
-        self._current_value = self._field_map.get_value()
+    def _get_value(self, values):
+        if values is None:
+            return self._field_map.get_value()
+        return values[self._index]
+    def alive(self, values=None):
+        self._current_value = self._get_value(values)
         return self.values_significantly_different(self._current_value, self._previous_value)
-    def commit(self):
+    def commit(self, values=None):
         # rmv self._previous_value = self._current_value
-        self._previous_value = self._field_map.get_value()
-    def set_field_map(self, new_field_map):
+        self._previous_value = self._get_value(values)
+    def set_field_map(self, new_field_map, index=None):
         self._field_map = new_field_map
+        self._index = index
 
 def is_float(v):
     try:
@@ -111,14 +124,14 @@ class DeadbandCheckers:
         for dbc in self._fixed:
             self._active.append(dbc)
         self._fixed = list()
-        for fm in self._maps:
+        for index, fm in enumerate(self._maps):
             fn = fm.field_name()
             dbc = self._bindable.get(fn, None)
             if dbc is None:
                 dbc = DeadbandChecker()
             else:
                 del self._bindable[fn]
-            dbc.set_field_map(fm)
+            dbc.set_field_map(fm, index)
             self._active.append(dbc)
         self._need_to_activate_checkers = False
     def add_checker(self, name, checker):
@@ -126,13 +139,18 @@ class DeadbandCheckers:
             self._bindable[name] = checker
         else:
             self._fixed.append(checker)
-    def alive(self):
+    def alive(self, values=None):
+        for i1 in self:
+            if i1.alive(values):
+                return True
+        return False
+    def alive_when_unchanged(self):
         for i1 in self:
-            if i1.alive():
+            if i1.alive_when_unchanged():
                 return True
         return False
-    def commit(self):
+    def commit(self, values=None):
         for i1 in self:
-            i1.commit()
+            i1.commit(values)
 
 
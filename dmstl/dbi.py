@@ -24,6 +24,7 @@ import MySQLdb
 import MySQLdb.constants.ER as MySQLErrorCodes
 import _mysql_exceptions as MySQLExceptions
 import time
+from .metrics import increment
 # from .singleton import Singleton
 
 def get_DatabaseInterfaceServerInformation():
@@ -55,6 +56,7 @@ def automatic_retry(call_me):
                 self.reset()
                 tries -= 1
                 if tries > 0:
+                    increment('dmstl_database_retries_total')
                     time.sleep(0.5)
                 else:
                     raise
@@ -63,6 +65,8 @@ def automatic_retry(call_me):
 
 # class DatabaseInterface(metaclass=Singleton):
 class DatabaseInterface:
+    # Errors that mean the server is unavailable rather than the request bad.
+    retryable_errors = (MySQLExceptions.OperationalError,)
     def __init__(self):
         # The following 'if' is only required if this class is a Singleton.  If
         # this class is not a Singleton the 'if' does no harm.
@@ -93,6 +97,15 @@ class DatabaseInterface:
                 raise
         return success
     @automatic_retry
+    def executemany(self, query, args):
+        c1 = self.connection
+        c2 = self._execute_cursor
+        if c2 is None:
+            c2 = c1.cursor()
+            self._execute_cursor = c2
+        c2.executemany(query, args)
+        self.lastrowid = c2.lastrowid
+    @automatic_retry
     def singleton(self, query, args=None):
         c1 = self.connection
         c2 = self._singleton_cursor
@@ -119,6 +132,7 @@ class DatabaseInterface:
         self.connection.rollback()
     def reset(self):
         if self._connection is not None:
+            increment('dmstl_database_resets_total')
             self._connection.close()
             self._connection = None
         self._execute_cursor = None
@@ -0,0 +1,80 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import re
+
+# Stands in for DatabaseInterface without a MySQL server.  Inserted rows are
+# kept per table; REDUNDANT_STRINGS behaves like the real table (a unique
+# STRING, an auto increment STRING_ID) so RedundantStrings works unchanged.
+# Meant for benchmarks and trying things out, not for production.
+
+_insert = re.compile(r'\s*insert\s+into\s+(\w+)', re.IGNORECASE)
+
+class DatabaseInterfaceInMemory:
+    retryable_errors = ()
+    def __init__(self, foreach_rows=None):
+        super().__init__()
+        self.tables = dict()
+        self.strings = dict()
+        self.foreach_rows = foreach_rows if foreach_rows is not None else dict()
+        self.commits = 0
+        self.rollbacks = 0
+        self.lastrowid = None
+    def _insert(self, query, args):
+        m1 = _insert.match(query)
+        if m1 is None:
+            return True
+        table = m1.group(1).upper()
+        if table == 'REDUNDANT_STRINGS':
+            if args[0] in self.strings:
+                return False
+            self.lastrowid = len(self.strings) + 1
+            self.strings[args[0]] = self.lastrowid
+            return True
+        rows = self.tables.setdefault(table, list())
+        rows.append(args)
+        self.lastrowid = len(rows)
+        return True
+    def execute(self, query, args=None, raise_dup_entry=False):
+        success = self._insert(query, args)
+        if (not success) and raise_dup_entry:
+            raise KeyError(args)
+        return success
+    def executemany(self, query, args):
+        for a1 in args:
+            self._insert(query, a1)
+    def singleton(self, query, args=None):
+        if 'REDUNDANT_STRINGS' in query:
+            id1 = self.strings.get(args[0], None)
+            return (id1,) if id1 is not None else None
+        return None
+    def foreach(self, method, query, args=None):
+        # Rows for a query can be supplied up front (e.g. the printers).
+        for row in self.foreach_rows.get(query, ()):
+            method(row)
+    def commit(self):
+        self.commits += 1
+    def rollback(self):
+        self.rollbacks += 1
+    def reset(self):
+        self.lastrowid = None
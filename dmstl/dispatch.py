@@ -0,0 +1,236 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+from .logging import get_logger
+from pubsub import pub
+import collections
+import enum
+import functools
+import threading
+import time
+import weakref
+
+_queued_subscribers = weakref.WeakSet()
+
+def queued_subscribers():
+    return list(_queued_subscribers)
+
+class OverloadPolicy(enum.Enum):
+    # What a QueuedSubscriber does with a message when its queue is full.
+    BLOCK = 'block'             # The publisher waits for room.
+    DROP_OLDEST = 'drop oldest' # The oldest queued message is discarded.
+    COALESCE = 'coalesce'       # Only the latest message per key is kept (see QueuedSubscriber).
+
+class QueuedSubscriber():
+    # Stands between a topic and a listener.  Messages are queued (at most
+    # maxsize of them) and the listener is called from a thread of its own,
+    # so a slow listener does not hold up the publisher.  A listener that
+    # raises is logged and carries on with the next message.
+    #
+    # policy decides what happens when the queue is full.  For COALESCE,
+    # coalesce is called with the message's arguments and returns a
+    # (key, signature) pair.  A queued message is replaced by a newer one
+    # with the same key and signature; a message whose signature differs
+    # from the previous one for its key is a transition and is always
+    # queued.  When the queue is full anyway the oldest message that is not
+    # a transition is discarded.  replaces, if given, is called with the
+    # newer message's arguments; when it returns False the queued message is
+    # kept instead (the newer one adds nothing to it).  COALESCE without a
+    # coalesce function is an error.  discarded, if given, is called with the
+    # arguments of each message discarded to make room.
+    #
+    # A listener that raises one of the retry_on exceptions (a database that
+    # has gone away, say) is given the same message again every retry_delay
+    # seconds until it succeeds; meanwhile the queue fills and policy
+    # applies.
+    def __init__(self, listener, topic, maxsize=1000, name=None, policy=OverloadPolicy.BLOCK, coalesce=None, replaces=None, discarded=None, retry_on=(), retry_delay=5.0):
+        super().__init__()
+        if (policy == OverloadPolicy.COALESCE) and (coalesce is None):
+            raise ValueError('{0} messages cannot be coalesced.'.format(topic))
+        self._listener = listener
+        self._topic = topic
+        self._maxsize = maxsize
+        self._policy = policy
+        self._coalesce = coalesce if policy == OverloadPolicy.COALESCE else None
+        self._replaces = replaces
+        self._discarded = discarded
+        self._retry_on = tuple(retry_on)
+        self._retry_delay = retry_delay
+        self._items = collections.deque()
+        self._pending = dict()
+        self._signatures = dict()
+        self._unfinished = 0
+        self._stopping = False
+        self._condition = threading.Condition()
+        self._logger = get_logger(__name__)
+        self.name = name if name is not None else getattr(listener, '__qualname__', topic)
+        self.high_water = 0
+        self.handled = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.coalesced = 0
+        # pubsub checks a listener's arguments against the topic; the wrapper
+        # presents the listener's.
+        @functools.wraps(listener)
+        def enqueue(*args, **kwargs):
+            self._put(args, kwargs)
+        self._enqueue = enqueue
+        self._thread = threading.Thread(target=self._run, name='queued {0}'.format(self.name), daemon=True)
+        self._thread.start()
+        pub.subscribe(self._enqueue, topic)
+        _queued_subscribers.add(self)
+    @property
+    def depth(self):
+        return len(self._items)
+    @property
+    def maxsize(self):
+        return self._maxsize
+    @property
+    def policy(self):
+        return self._policy
+    def __str__(self):
+        return '{0}: depth={1}/{2} high_water={3} handled={4} failed={5} retried={6} dropped={7} coalesced={8}'.format(
+                self.name, self.depth, self.maxsize, self.high_water, self.handled, self.failed,
+                self.retried, self.dropped, self.coalesced)
+    def _put(self, args, kwargs):
+        with self._condition:
+            key = None
+            transition = True
+            if self._coalesce is not None:
+                key, signature = self._coalesce(*args, **kwargs)
+                transition = (key not in self._signatures) or (self._signatures[key] != signature)
+                self._signatures[key] = signature
+                if not transition:
+                    entry = self._pending.get(key, None)
+                    if entry is not None:
+                        if (self._replaces is None) or self._replaces(*args, **kwargs):
+                            entry[1] = (args, kwargs)
+                        self.coalesced += 1
+                        return
+            while (len(self._items) >= self._maxsize) and (not self._stopping):
+                if self._policy == OverloadPolicy.BLOCK:
+                    self._condition.wait()
+                else:
+                    self._discard()
+            entry = [key, (args, kwargs), transition]
+            self._items.append(entry)
+            self._unfinished += 1
+            # Newer samples must not be folded into a message queued ahead of
+            # a transition.
+            if transition:
+                self._pending.pop(key, None)
+            else:
+                self._pending[key] = entry
+            depth = len(self._items)
+            if depth > self.high_water:
+                self.high_water = depth
+            self._condition.notify_all()
+    def _discard(self):
+        # Make room by discarding the oldest message that is not a
+        # transition; failing that, the oldest message.
+        victim = None
+        for entry in self._items:
+            if not entry[2]:
+                victim = entry
+                break
+        if victim is None:
+            victim = self._items[0]
+        self._items.remove(victim)
+        self._forget(victim)
+        self._unfinished -= 1
+        self.dropped += 1
+        if self._discarded is not None:
+            args, kwargs = victim[1]
+            self._discarded(*args, **kwargs)
+    def _forget(self, entry):
+        if self._pending.get(entry[0], None) is entry:
+            del self._pending[entry[0]]
+    def _get(self):
+        with self._condition:
+            while (len(self._items) == 0) and (not self._stopping):
+                self._condition.wait()
+            if len(self._items) == 0:
+                return None
+            entry = self._items.popleft()
+            self._forget(entry)
+            self._condition.notify_all()
+            return entry[1]
+    def _task_done(self):
+        with self._condition:
+            self._unfinished -= 1
+            self._condition.notify_all()
+    def _run(self):
+        while True:
+            item = self._get()
+            if item is None:
+                break
+            args, kwargs = item
+            try:
+                self._deliver(args, kwargs)
+            finally:
+                self._task_done()
+    def _deliver(self, args, kwargs):
+        complained = False
+        while True:
+            try:
+                self._listener(*args, **kwargs)
+                self.handled += 1
+                if complained:
+                    self._logger.warning('%s recovered.', self.name)
+                return
+            except self._retry_on as exc:
+                self.retried += 1
+                if not complained:
+                    self._logger.warning('%s failed to handle a %s message (%s); retrying every %s seconds.',
+                            self.name, self._topic, exc.__class__.__name__, self._retry_delay)
+                    complained = True
+                if self._stopping:
+                    self.failed += 1
+                    return
+                time.sleep(self._retry_delay)
+            except Exception:
+                self.failed += 1
+                self._logger.error('%s failed to handle a %s message.', self.name, self._topic, exc_info=True)
+                return
+    def join(self):
+        # Wait for everything queued so far to be handled.
+        with self._condition:
+            while self._unfinished > 0:
+                self._condition.wait()
+    def shutdown(self, timeout=5.0):
+        pub.unsubscribe(self._enqueue, self._topic)
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+def subscribe(listener, topic, queue_size=None, **kwargs):
+    # queue_size None subscribes the listener directly.  Otherwise the
+    # listener gets a QueuedSubscriber with room for queue_size messages;
+    # kwargs (policy, coalesce, replaces, discarded, retry_on, retry_delay)
+    # are passed along.
+    if queue_size is None:
+        pub.subscribe(listener, topic)
+        return None
+    return QueuedSubscriber(listener, topic, queue_size, **kwargs)
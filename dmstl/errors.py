@@ -28,3 +28,31 @@ class InsertSelectError(RawDataProcessorError):
         the select."""
     pass
 
+
+# The following are named after their requests counterparts because
+# OctoPrintRawDataCruncher and the RAW_DATA logger work with the class name.
+
+class ConnectTimeout(RawDataProcessorError):
+    pass
+
+class ReadTimeout(RawDataProcessorError):
+    pass
+
+class InvalidResponse(RawDataProcessorError):
+    """Exception raised if an OctoPrint server sends something that is not a
+        valid HTTP response."""
+    pass
+
+class RemoteError(RawDataProcessorError):
+    """Base class for stand-ins of exceptions that were raised in another
+        process.  Only the class name survives the trip."""
+    pass
+
+_remote_error_classes = dict()
+
+def remote_exception(class_name, *args):
+    cls = _remote_error_classes.get(class_name)
+    if cls is None:
+        cls = type(class_name, (RemoteError,), {})
+        _remote_error_classes[class_name] = cls
+    return cls(*args)
@@ -22,14 +22,21 @@
 
 from .rs import RedundantStrings
 from .logging import get_logger
+from .unrecognized import note_unrecognized_path
+import array
+import threading
 
 class DatabaseFieldMap:
     def __init__(self, field_name):
         super().__init__()
         self._field_name = field_name
         self._value = None
+    def convert(self, value):
+        # The value to store for a raw value.  Must not change the map so
+        # a FieldMapSchema can share it between threads.
+        return value
     def extract_value(self, value):
-        self._value = value
+        self._value = self.convert(value)
     def field_name(self):
         return self._field_name
     def get_raw_value(self):
@@ -54,6 +61,10 @@ class DatabaseFieldMap:
         self._value = None
     def provides_sql_value(self):
         return True
+    def column_typecode(self):
+        # The array typecode of the field's column in FieldColumns; None
+        # keeps the values in a list.
+        return None
 
 class JsonValueToDatabaseFieldMap(DatabaseFieldMap):
     def __init__(self, path):
@@ -65,25 +76,31 @@ class JsonValueToDatabaseFieldMap(DatabaseFieldMap):
         return self._value
 
 class JsonValueToBooleanFieldMap(JsonValueToDatabaseFieldMap):
-    def extract_value(self, value):
+    def column_typecode(self):
+        return 'b'
+    def convert(self, value):
         if value is None:
-            self._value = None
+            return None
         else:
-            self._value = bool(value)
+            return bool(value)
 
 class JsonValueToIntFieldMap(JsonValueToDatabaseFieldMap):
-    def extract_value(self, value):
+    def column_typecode(self):
+        return 'q'
+    def convert(self, value):
         if value is None:
-            self._value = None
+            return None
         else:
-            self._value = int(value)
+            return int(value)
 
 class JsonValueToFloatFieldMap(JsonValueToDatabaseFieldMap):
-    def extract_value(self, value):
+    def column_typecode(self):
+        return 'd'
+    def convert(self, value):
         if value is None:
-            self._value = None
+            return None
         else:
-            self._value = float(value)
+            return float(value)
 
 class JsonValueToStringIdFieldMap(JsonValueToDatabaseFieldMap):
     def __init__(self, path, redundant_strings):
@@ -91,11 +108,13 @@ class JsonValueToStringIdFieldMap(JsonValueToDatabaseFieldMap):
         self._field_name += '_ID'
         assert redundant_strings is not None
         self._redundant_strings = redundant_strings
-    def extract_value(self, value):
+    def column_typecode(self):
+        return 'q'
+    def convert(self, value):
         if value is None:
-            self._value = None
+            return None
         else:
-            self._value = self._redundant_strings.get_id(str(value))
+            return self._redundant_strings.get_id(str(value))
 
 class PrinterIdFieldMap(DatabaseFieldMap):
     def __init__(self):
@@ -105,7 +124,11 @@ class PrinterIdFieldMap(DatabaseFieldMap):
         return self._value
     @id.setter
     def id(self, value):
-        self._value = int(value)
+        self._value = self.convert(value)
+    def column_typecode(self):
+        return 'q'
+    def convert(self, value):
+        return int(value)
     def always_include(self):
         return True
     def get_raw_value(self):
@@ -140,7 +163,11 @@ class HttpStatusFieldMap(DatabaseFieldMap):
         return self._value
     @status.setter
     def status(self, value):
-        self._value = int(value)
+        self._value = self.convert(value)
+    def column_typecode(self):
+        return 'q'
+    def convert(self, value):
+        return int(value)
     def always_include(self):
         return True
     def get_raw_value(self):
@@ -190,6 +217,12 @@ class JsonValueToDatabaseFieldMaps:
         self._sql_insert = None
         self._table_name = table_name
         self._provides_value = None
+        self._schema = None
+        # True passes every occurrence of an unrecognized path to
+        # unrecognized_path, as walking the whole object always did.  False
+        # passes only the first, so keys known to be of no interest cost
+        # nothing after that.
+        self.report_unrecognized = True
         self._logger = get_logger(__name__)
     def __iter__(self):
         return iter(self._by_list)
@@ -201,9 +234,13 @@ class JsonValueToDatabaseFieldMaps:
         return whatever
     def add_fixed(self, fixed):
         self._sql_insert = None
+        self._provides_value = None
+        self._schema = None
         self._by_list.append(fixed)
     def add_map(self, map):
         self._sql_insert = None
+        self._provides_value = None
+        self._schema = None
         self._by_json_path[map.json_path()] = map
         self._by_list.append(map)
     def generate_field_name_list(self):
@@ -224,23 +261,233 @@ class JsonValueToDatabaseFieldMaps:
         for f in self._by_list:
             f.reset()
     def unrecognized_path(self, path, value):
-        self._logger.warning('Unrecognized path %s with value %s', path, value)
-    def _update_traverse(self, left, node):
-        for key, value in node.items():
-            k2 = key.upper()
-            if left != '':
-                path = left + '_' + k2
-            else:
-                path = k2
-            if isinstance(value, dict):
-                self._update_traverse(path, value)
-            else:
-                map = self._by_json_path.get(path, None)
-                if map is None:
-                    self.unrecognized_path(path, value)
-                else:
-                    map.extract_value(value)
+        # Logged once per path; see unrecognized.py.
+        note_unrecognized_path(path, value)
+    def schema(self):
+        # The maps as a FieldMapSchema, built once.  Adding a map builds a
+        # new one.
+        schema = self._schema
+        if schema is None:
+            schema = FieldMapSchema(self)
+            self._schema = schema
+        return schema
+    def _extract_at(self, index, value):
+        self._by_list[index].extract_value(value)
     def update(self, prefix, json):
-        self._update_traverse(prefix, json)
+        self.schema().walk(self._extract_at, prefix, json)
+
+class _PathNode:
+    # One JSON object in the compiled path tree.  leaves and branches hold
+    # the keys some map cares about, unrecognized the keys no map does;
+    # known is all of them, so only objects with a key not seen before are
+    # sorted again.  The tuples are replaced, never changed, so threads
+    # walking the tree need no lock.
+    __slots__ = ('leaves', 'branches', 'unrecognized', 'known')
+    def __init__(self):
+        self.leaves = ()        # (key, path, field index)
+        self.branches = ()      # (key, path, _PathNode)
+        self.unrecognized = ()  # (key, path)
+        self.known = frozenset()
+
+_missing = object()
 
+class FieldMapSchema:
+    # What does not change from one sample to the next: the fields, the
+    # INSERT statement, each field's converter and the compiled path tree.
+    # Built from a JsonValueToDatabaseFieldMaps; the maps themselves are only
+    # asked to convert values and report unrecognized paths, neither of which
+    # changes them, so one schema can map samples on several threads at once
+    # into FieldValues of their own.
+    def __init__(self, maps):
+        super().__init__()
+        self._maps = maps
+        self.fields = tuple(maps)
+        self.insert = maps.generate_insert()
+        self._by_map = {id(f1): i1 for i1, f1 in enumerate(self.fields)}
+        self._by_json_path = {f1.json_path(): i1 for i1, f1 in enumerate(self.fields) if not f1.always_include()}
+        self._converters = tuple(f1.convert for f1 in self.fields)
+        self._sql_indexes = tuple(i1 for i1, f1 in enumerate(self.fields) if f1.provides_sql_value())
+        prefixes = set()
+        for p1 in self._by_json_path:
+            i1 = p1.find('_')
+            while i1 >= 0:
+                prefixes.add(p1[:i1])
+                i1 = p1.find('_', i1+1)
+        self._prefixes = frozenset(prefixes)
+        self._compiled = dict()
+        self._lock = threading.Lock()
+    def __len__(self):
+        return len(self.fields)
+    def index(self, field_map):
+        return self._by_map[id(field_map)]
+    def new_values(self):
+        return FieldValues(self)
+    def new_columns(self):
+        return FieldColumns(self)
+    def _report(self, path, value):
+        if isinstance(value, dict):
+            for key, v1 in value.items():
+                self._report(path + '_' + key.upper(), v1)
+        else:
+            self._maps.unrecognized_path(path, value)
+    def _learn(self, left, node, json):
+        # Sort the object's keys we have not seen before into the node.
+        # Returns the new unrecognized ones.
+        with self._lock:
+            leaves = list(node.leaves)
+            branches = list(node.branches)
+            unrecognized = list(node.unrecognized)
+            new = list()
+            known = set(node.known)
+            for key, value in json.items():
+                if key not in known:
+                    known.add(key)
+                    k2 = key.upper()
+                    path = left + '_' + k2 if left != '' else k2
+                    index = self._by_json_path.get(path, None)
+                    if index is not None:
+                        leaves.append((key, path, index))
+                    elif path in self._prefixes:
+                        branches.append((key, path, _PathNode()))
+                    else:
+                        unrecognized.append((key, path))
+                        new.append((key, path))
+            node.leaves = tuple(leaves)
+            node.branches = tuple(branches)
+            node.unrecognized = tuple(unrecognized)
+            node.known = frozenset(known)
+        return new
+    def _walk(self, assign, left, node, json):
+        # Visits the keys some map cares about and, when reporting
+        # unrecognized paths on every sample, the keys none does.
+        new = ()
+        if not node.known.issuperset(json):
+            new = self._learn(left, node, json)
+        for key, path in (node.unrecognized if self._maps.report_unrecognized else new):
+            value = json.get(key, _missing)
+            if value is not _missing:
+                self._report(path, value)
+        for key, path, index in node.leaves:
+            value = json.get(key, _missing)
+            if value is not _missing:
+                if isinstance(value, dict):
+                    self._report(path, value)
+                else:
+                    assign(index, value)
+        for key, path, child in node.branches:
+            value = json.get(key, _missing)
+            if value is not _missing:
+                if isinstance(value, dict):
+                    self._walk(assign, path, child, value)
+                else:
+                    self._maps.unrecognized_path(path, value)
+    def walk(self, assign, prefix, json):
+        # Calls assign(field index, raw value) for each mapped value.
+        node = self._compiled.get(prefix, None)
+        if node is None:
+            with self._lock:
+                node = self._compiled.setdefault(prefix, _PathNode())
+        self._walk(assign, prefix, node, json)
+    def update(self, values, prefix, json):
+        self.walk(values.assign, prefix, json)
+
+class FieldValues:
+    # The values of one sample, in schema order.
+    __slots__ = ('_schema', '_values')
+    def __init__(self, schema):
+        self._schema = schema
+        self._values = [None] * len(schema)
+    @property
+    def schema(self):
+        return self._schema
+    def __getitem__(self, index):
+        return self._values[index]
+    def assign(self, index, value):
+        self._values[index] = self._schema._converters[index](value)
+    def set(self, field_map, value):
+        self.assign(self._schema.index(field_map), value)
+    def get(self, field_map):
+        return self._values[self._schema.index(field_map)]
+    def update(self, prefix, json):
+        self._schema.walk(self.assign, prefix, json)
+    def generate_value_tuple(self):
+        values = self._values
+        return tuple([values[i1] for i1 in self._schema._sql_indexes])
 
+class FieldColumns:
+    # The values of many samples, one typed array per field (see
+    # column_typecode) plus a null mask.  Rows are added with new_row and
+    # filled in place; row is the one assign, set and [] work on, so a
+    # FieldColumns can stand in for FieldValues while a sample is mapped.
+    # rows() hands the batch out for executemany; column() hands out a
+    # field's array for analysis.
+    def __init__(self, schema):
+        super().__init__()
+        self._schema = schema
+        self._columns = tuple(array.array(f1.column_typecode()) if f1.column_typecode() is not None else list() for f1 in schema.fields)
+        self._nulls = tuple(bytearray() for f1 in schema.fields)
+        self._bools = frozenset(i1 for i1, f1 in enumerate(schema.fields) if f1.column_typecode() == 'b')
+        self.row = -1
+    @property
+    def schema(self):
+        return self._schema
+    def __len__(self):
+        return len(self._nulls[0]) if len(self._nulls) > 0 else 0
+    def new_row(self):
+        # Adds a row of nulls and makes it the current row.
+        for c1 in self._columns:
+            c1.append(0)
+        for n1 in self._nulls:
+            n1.append(1)
+        self.row = len(self) - 1
+        return self.row
+    def drop_row(self):
+        # Removes the last row.
+        for c1 in self._columns:
+            c1.pop()
+        for n1 in self._nulls:
+            n1.pop()
+        self.row = len(self) - 1
+    def clear(self):
+        for c1 in self._columns:
+            del c1[:]
+        for n1 in self._nulls:
+            del n1[:]
+        self.row = -1
+    def __getitem__(self, index):
+        if self._nulls[index][self.row]:
+            return None
+        value = self._columns[index][self.row]
+        if index in self._bools:
+            return bool(value)
+        return value
+    def assign(self, index, value):
+        value = self._schema._converters[index](value)
+        if value is None:
+            self._nulls[index][self.row] = 1
+        else:
+            self._columns[index][self.row] = value
+            self._nulls[index][self.row] = 0
+    def set(self, field_map, value):
+        self.assign(self._schema.index(field_map), value)
+    def get(self, field_map):
+        return self[self._schema.index(field_map)]
+    def update(self, prefix, json):
+        self._schema.walk(self.assign, prefix, json)
+    def column(self, field):
+        # (values, nulls) for a field given by map or field name.  The
+        # arrays are the buffer's own; they change with it.
+        if isinstance(field, str):
+            index = [f1.field_name() for f1 in self._schema.fields].index(field)
+        else:
+            index = self._schema.index(field)
+        return (self._columns[index], self._nulls[index])
+    def _column_values(self, index):
+        values = self._columns[index]
+        if index in self._bools:
+            values = map(bool, values)
+        return [None if n1 else v1 for v1, n1 in zip(values, self._nulls[index])]
+    def rows(self):
+        # A list of value tuples, as FieldValues.generate_value_tuple gives
+        # for each row.
+        return list(zip(*[self._column_values(i1) for i1 in self._schema._sql_indexes]))
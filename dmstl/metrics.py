@@ -0,0 +1,162 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+from .dispatch import queued_subscribers
+from .logging import get_logger
+from .timing import stage_statistics
+import http.server
+import threading
+import weakref
+
+# Counters are kept here by name and labels; everything else (queue depths,
+# scheduler lateness, stage latencies) is read when the metrics are scraped.
+
+_lock = threading.Lock()
+_counters = dict()
+_twitter_threads = weakref.WeakSet()
+
+def increment(name, amount=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def counter_value(name, **labels):
+    with _lock:
+        return _counters.get((name, tuple(sorted(labels.items()))), 0)
+
+def reset_counters():
+    with _lock:
+        _counters.clear()
+
+def watch_twitter_thread(thread):
+    _twitter_threads.add(thread)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels):
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(k1, _escape(v1)) for k1, v1 in labels) + '}'
+
+def _format_bound(bound):
+    return repr(float(bound))
+
+class PrometheusText():
+    # Accumulates metrics in the Prometheus text exposition format.  The
+    # format wants every sample of a family together, so samples are kept
+    # per family (in the order the families first appear) whatever order
+    # they are added in.
+    def __init__(self):
+        super().__init__()
+        self._families = dict()
+    def _family(self, name, kind, help):
+        lines = self._families.get(name, None)
+        if lines is None:
+            lines = ['# HELP {0} {1}'.format(name, help), '# TYPE {0} {1}'.format(name, kind)]
+            self._families[name] = lines
+        return lines
+    def sample(self, name, kind, help, labels, value):
+        lines = self._family(name, kind, help)
+        lines.append('{0}{1} {2}'.format(name, _format_labels(labels), value))
+    def histogram(self, name, help, labels, histogram):
+        lines = self._family(name, 'histogram', help)
+        running = 0
+        for bound, count in zip(histogram.bounds, histogram.counts):
+            running += count
+            lines.append('{0}_bucket{1} {2}'.format(name, _format_labels(labels + (('le', _format_bound(bound)),)), running))
+        lines.append('{0}_bucket{1} {2}'.format(name, _format_labels(labels + (('le', '+Inf'),)), histogram.count))
+        lines.append('{0}_sum{1} {2}'.format(name, _format_labels(labels), repr(histogram.sum)))
+        lines.append('{0}_count{1} {2}'.format(name, _format_labels(labels), histogram.count))
+    def __str__(self):
+        return ''.join('\n'.join(lines) + '\n' for lines in self._families.values())
+
+_Help = {
+    'dmstl_polls_total': 'Samples collected per printer by outcome (success, timeout, error).',
+    'dmstl_http_responses_total': 'OctoPrint responses by HTTP status.',
+    'dmstl_rows_total': 'RAW_DATA rows inserted or suppressed by the deadband checkers.',
+    'dmstl_redundant_strings_total': 'RedundantStrings lookups by result (hit, miss).',
+    'dmstl_database_retries_total': 'DatabaseInterface calls retried after an OperationalError.',
+    'dmstl_database_resets_total': 'DatabaseInterface connections closed by reset.',
+}
+
+def render(scheduler=None):
+    text = PrometheusText()
+    with _lock:
+        counters = sorted(_counters.items(), key=lambda i1: (i1[0][0], str(i1[0][1])))
+    for (name, labels), value in counters:
+        text.sample(name, 'counter', _Help.get(name, name), labels, value)
+    for t1 in list(_twitter_threads):
+        text.sample('dmstl_twitter_queue_depth', 'gauge', 'Work waiting for a TwitterThread.',
+                (('thread', t1.name),), t1.depth)
+    subscribers = queued_subscribers()
+    for s1 in subscribers:
+        text.sample('dmstl_subscriber_queue_depth', 'gauge', 'Messages waiting for a queued subscriber.', (('subscriber', s1.name),), s1.depth)
+    for s1 in subscribers:
+        text.sample('dmstl_subscriber_dropped_total', 'counter', 'Messages discarded by a queued subscriber.', (('subscriber', s1.name),), s1.dropped)
+    for s1 in subscribers:
+        text.sample('dmstl_subscriber_coalesced_total', 'counter', 'Messages coalesced by a queued subscriber.', (('subscriber', s1.name),), s1.coalesced)
+    if scheduler is not None:
+        statistics = scheduler.statistics()
+        for r1 in statistics:
+            text.histogram('dmstl_scheduler_lateness_seconds', 'How late repeating events started.', (('event', r1.name),), r1.lateness)
+        for r1 in statistics:
+            text.sample('dmstl_scheduler_overruns_total', 'counter', 'Repeating events still running when next due.', (('event', r1.name),), r1.overruns)
+    for (stage, printer_id), h1 in sorted(stage_statistics().items(), key=lambda i1: (i1[0][0], str(i1[0][1]))):
+        labels = (('stage', stage),) if printer_id is None else (('stage', stage), ('printer', printer_id))
+        text.histogram('dmstl_stage_seconds', 'Latency of each pipeline stage.', labels, h1)
+    return str(text)
+
+class MetricsServer():
+    # Serves the metrics at http://address:port/metrics from a daemon thread.
+    # Bound to the loopback interface by default.
+    def __init__(self, port=9464, address='127.0.0.1', scheduler=None):
+        super().__init__()
+        self._scheduler = scheduler
+        self._logger = get_logger(__name__)
+        owner = self
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = render(owner._scheduler).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, format, *args):
+                pass
+        self._server = http.server.ThreadingHTTPServer((address, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True)
+        self._thread.start()
+        self._logger.info('Serving metrics on %s:%s.', address, self.port)
+    @property
+    def port(self):
+        return self._server.server_address[1]
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join(5.0)
@@ -0,0 +1,233 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+from .errors import ConnectTimeout, ReadTimeout, InvalidResponse
+from .opraw import *
+from .timing import stage_timer
+from .trace import sample_id
+import asyncio
+import json
+
+class OctoPrintAsyncResponse:
+    def __init__(self, status_code, content, keep_alive=True):
+        super().__init__()
+        self.status_code = status_code
+        self.content = content
+        self.keep_alive = keep_alive
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+    def json(self):
+        return json.loads(self.text)
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    parts = status_line.split(None, 2)
+    if (len(parts) < 2) or (not parts[0].startswith(b'HTTP/')):
+        raise InvalidResponse('Bad status line.', status_line)
+    status_code = int(parts[1])
+    length = None
+    chunked = False
+    keep_alive = not parts[0].startswith(b'HTTP/1.0')
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'content-length':
+            length = int(value)
+        elif name == b'transfer-encoding':
+            chunked = b'chunked' in value.lower()
+        elif name == b'connection':
+            keep_alive = b'close' not in value.lower()
+    if chunked:
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b';', 1)[0], 16)
+            if size == 0:
+                await reader.readline()
+                break
+            body += await reader.readexactly(size)
+            await reader.readline()
+        content = bytes(body)
+    elif length is not None:
+        content = await reader.readexactly(length)
+    else:
+        content = await reader.read()
+        keep_alive = False
+    return OctoPrintAsyncResponse(status_code, content, keep_alive)
+
+class OctoPrintAsyncRawDataCollector(OctoPrintRawDataCollector):
+    def __init__(self, configuration, timeout=0.5):
+        super().__init__(configuration)
+        self._timeout = timeout
+        c1 = self._configuration
+        host, _, port = (c1.ip_address or '').partition(':')
+        self._host = host
+        self._port = int(port) if port else 80
+        self._requests = list()
+        self._connections = dict()
+        for detail in OctoPrintRawDataCollector.REQUEST_DETAILS:
+            request = (
+                    'GET /api/{0} HTTP/1.1\r\n'
+                    'Host: {1}\r\n'
+                    'User-Agent: Raw Data Logger/1\r\n'
+                    'X-Api-Key: {2}\r\n'
+                    'Content-Type: application/json\r\n'
+                    '\r\n').format(detail.verb, c1.ip_address, c1.api_key)
+            self._requests.append((detail.prefix, request.encode('latin-1')))
+    async def _connect(self):
+        try:
+            return await asyncio.wait_for(
+                    asyncio.open_connection(self._host, self._port), self._timeout)
+        except asyncio.TimeoutError:
+            raise ConnectTimeout(self._host, self._port)
+    def _disconnect(self, prefix):
+        connection = self._connections.pop(prefix, None)
+        if connection is not None:
+            connection[1].close()
+    async def _exchange(self, prefix, request):
+        reader, writer = self._connections[prefix]
+        writer.write(request)
+        try:
+            response = await asyncio.wait_for(_read_response(reader), self._timeout)
+        except asyncio.TimeoutError:
+            raise ReadTimeout(self._host, self._port)
+        if not response.keep_alive:
+            self._disconnect(prefix)
+        return response
+    async def _get(self, prefix, request):
+        # Each endpoint keeps its own connection open between polls.  If the
+        # printer has dropped a kept-alive connection it is replaced once.
+        try:
+            reused = prefix in self._connections
+            if not reused:
+                self._connections[prefix] = await self._connect()
+            try:
+                return await self._exchange(prefix, request)
+            except (ConnectionError, asyncio.IncompleteReadError, InvalidResponse):
+                if not reused:
+                    raise
+                self._disconnect(prefix)
+                self._connections[prefix] = await self._connect()
+                return await self._exchange(prefix, request)
+        except BaseException:
+            self._disconnect(prefix)
+            raise
+    def disconnect(self):
+        for prefix in list(self._connections):
+            self._disconnect(prefix)
+    def shutdown(self):
+        super().shutdown()
+        self.disconnect()
+    async def collect_async(self, limit, collected=None):
+        if collected is None:
+            collected = OctoPrintRawDataCollected()
+        collected.reset()
+        collected.trace_id = sample_id(self.trace_cycle, self.id)
+        if self.active and self._configuration.active:
+            breaker = self._breaker
+            if not breaker.allow():
+                collected.set_exception(self._requests[0][0], breaker.last_exception, quiet=True)
+                return collected
+            async with limit:
+                with stage_timer('http', self.id, collected.trace_id):
+                    if breaker.state == CircuitState.CLOSED:
+                        # Both endpoints are requested at the same time but the
+                        # results are applied in the same order as the blocking
+                        # collector.
+                        outcomes = await asyncio.gather(
+                                *[self._get(prefix, request) for prefix, request in self._requests],
+                                return_exceptions=True)
+                    else:
+                        # Probing; the second endpoint only if the first answers.
+                        outcomes = list()
+                        for prefix, request in self._requests:
+                            try:
+                                outcomes.append(await self._get(prefix, request))
+                            except Exception as exc:
+                                outcomes.append(exc)
+                                break
+            unreachable = None
+            for (prefix, request), outcome in zip(self._requests, outcomes):
+                if isinstance(outcome, Exception):
+                    collected.set_exception(prefix, outcome)
+                    if (unreachable is None) and is_unreachable(outcome):
+                        unreachable = outcome
+                else:
+                    try:
+                        with stage_timer('decode', self.id, collected.trace_id):
+                            collected.set_request(prefix, outcome, self._previous)
+                    except Exception as exc:
+                        # e.g. a 200 whose body is not JSON; as the blocking
+                        # collector, the sample carries the exception.
+                        collected.set_exception(prefix, exc)
+            if unreachable is not None:
+                breaker.failure(unreachable)
+            elif len(collected._requests) > 0:
+                breaker.success()
+        else:
+            collected.active = False
+        return collected
+
+class OctoPrintAsyncRawDataCollectors(OctoPrintRawDataCollectors):
+    # One event loop collects from every printer.  max_connections bounds the
+    # number of printers being talked to at once (two sockets each).
+    def __init__(self, dbi, max_connections=512, deadline=4.0, batch=False):
+        super().__init__(dbi, deadline=deadline, batch=batch)
+        self._max_connections = max_connections
+        self._loop = None
+    def _create_collector_from_row(self, row):
+        configuration = OctoPrintRawDataCollectorConfiguration(row)
+        collector = OctoPrintAsyncRawDataCollector(configuration)
+        return collector
+    async def _collect_all(self, collectors):
+        limit = asyncio.Semaphore(self._max_connections)
+        tasks = [asyncio.ensure_future(c1.collect_async(limit)) for c1 in collectors]
+        if len(tasks) > 0:
+            done, pending = await asyncio.wait(tasks, timeout=self._deadline)
+            for task in pending:
+                task.cancel()
+            if len(pending) > 0:
+                await asyncio.wait(pending)
+        results = list()
+        for c1, task in zip(collectors, tasks):
+            if task.cancelled():
+                self._logger.warning(
+                        'Collecting raw data from %s missed the %.1f second deadline.',
+                        c1.name, self._deadline)
+                results.append((c1, c1.timed_out('Missed the {0:.1f} second deadline.'.format(self._deadline))))
+            else:
+                results.append((c1, task.result()))
+        return results
+    def _collect(self):
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        collectors = [c1 for c1 in self if c1.active]
+        return self._loop.run_until_complete(self._collect_all(collectors))
+    def shutdown(self):
+        super().shutdown()
+        if self._loop is not None:
+            self._loop.close()
+            self._loop = None
@@ -0,0 +1,55 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+from .opcruncher import NetworkState, DeviceState
+from pubsub import pub
+import time
+
+class OctoPrintPollCadence():
+    # Seconds between polls of a printer based on the state
+    # OctoPrintRawDataCruncher last derived for it.  A printer is polled
+    # quickly for settle seconds after any state change.
+    def __init__(self, fast=5, slow=30, offline=60, settle=60):
+        super().__init__()
+        self._fast = fast
+        self._slow = slow
+        self._offline = offline
+        self._settle = settle
+        self._states = dict()
+        pub.subscribe(self.state_changed, 'state.octoprint')
+    def state_changed(self, id, network_state, device_state):
+        self._states[id] = (network_state, device_state, time.monotonic())
+    def interval(self, id):
+        state = self._states.get(id, None)
+        if state is None:
+            return self._fast
+        network_state, device_state, changed = state
+        if time.monotonic() - changed < self._settle:
+            return self._fast
+        if network_state == NetworkState.GOOD:
+            if device_state in (DeviceState.IDLE, DeviceState.INOPERABLE):
+                return self._slow
+            return self._fast
+        elif network_state in (NetworkState.OFFLINE, NetworkState.UNREACHABLE, NetworkState.BAD_PASSWORD):
+            return self._offline
+        return self._fast
@@ -21,6 +21,10 @@
 #
 
 import dmstl
+from .dispatch import subscribe, OverloadPolicy
+from .opraw import DiscardedRawData, coalesce_raw_data, replaces_raw_data
+from .timing import stage_timer
+from .trace import traced
 import enum
 from pubsub import pub
 
@@ -116,6 +120,7 @@ class OctoPrintModel():
                     pass # here! Walkabout?
                 self._network_state_previous = nsc
                 self._device_state_previous = dsc
+                pub.sendMessage('state.octoprint', id=self._id, network_state=nsc, device_state=dsc)
     def update_network_state(self, new_state):
         self._network_state_current = new_state
         self.update_if_not_frozen()
@@ -162,18 +167,36 @@ def get_leaf(dictionary, *args):
     return current
 
 class OctoPrintRawDataCruncher():
-    def __init__(self, dbi, scheduler):
+    # See OctoPrintRawDataLogger for queue_size, batched and policy.
+    # credentials_loader, if given, is used instead of the Twitter
+    # credentials loader that goes with dbi (TwitterCredentialsLoadNone keeps
+    # every printer off Twitter).
+    def __init__(self, dbi, scheduler, queue_size=None, batched=False, policy=OverloadPolicy.BLOCK, credentials_loader=None):
         super().__init__()
-        if dbi is None:
+        if credentials_loader is not None:
+            self._tcl = credentials_loader
+        elif dbi is None:
             self._tcl = dmstl.TwitterCredentialsLoadFromMemory()
         else:
             self._tcl = dmstl.TwitterCredentialsLoadFromDatabase(dbi)
         # rmv self._dbi = dbi
         self._models = dict()
         self._scheduler = scheduler
-        pub.subscribe(self.crunch_the_data, 'raw_data.octoprint')
+        self._discarded = DiscardedRawData()
+        if batched:
+            self._subscriber = subscribe(self.crunch_the_batch, 'raw_data.octoprint_batch', queue_size,
+                    policy=policy, discarded=self._discarded.discarded_batch)
+        else:
+            self._subscriber = subscribe(self.crunch_the_data, 'raw_data.octoprint', queue_size,
+                    policy=policy, coalesce=coalesce_raw_data, replaces=replaces_raw_data,
+                    discarded=self._discarded.discarded)
     def crunch_the_data(self, sender, collected):
+        with traced(collected.trace_id), stage_timer('crunch', sender.id):
+            self._crunch_the_data(sender, collected)
+    def _crunch_the_data(self, sender, collected):
         model = self._models.get(sender.id, None)
+        if self._discarded.unchanged(sender, collected) and (model is not None):
+            return
         if model is None:
             twitter_credentials = self._tcl.get_credentials(sender.id)
             # rmv print(twitter_credentials)
@@ -211,7 +234,12 @@ class OctoPrintRawDataCruncher():
                     model.update_network_state(NetworkState.OFFLINE)
                 else:
                     model.update_network_state(NetworkState.UNREACHABLE)
+    def crunch_the_batch(self, sender, batch):
+        for c1, collected in batch:
+            self.crunch_the_data(c1, collected)
     def shutdown(self):
+        if self._subscriber is not None:
+            self._subscriber.shutdown()
         for model in self._models.values():
             model.shutdown()
 
@@ -20,9 +20,15 @@
 # SOFTWARE.
 #
 
+import threading
+
 import dmstl
-from pubsub import pub
 from .dbc import *
+from .dispatch import subscribe, OverloadPolicy
+from .opraw import DiscardedRawData, coalesce_raw_data, replaces_raw_data
+from .metrics import increment
+from .timing import stage_timer
+from .trace import traced
 
 class OctoPrintRawDataMaps(dmstl.JsonValueToDatabaseFieldMaps):
     def __init__(self, redundant_strings):
@@ -63,18 +69,30 @@ class OctoPrintRawDataMaps(dmstl.JsonValueToDatabaseFieldMaps):
         self.add(dmstl.JsonValueToIntFieldMap('JOB_PROGRESS_PRINTTIMELEFT'))
         self.add(dmstl.JsonValueToStringIdFieldMap('JOB_PROGRESS_PRINTTIMELEFTORIGIN', redundant_strings))
         self.add(dmstl.JsonValueToStringIdFieldMap('JOB_STATE', redundant_strings))
-    def set_printer_id(self, printer_id):
-        self._printer_id_map.id = printer_id
-    def set_exception(self, exception):
+    # The set_ methods change the maps or, given values (FieldValues from
+    # schema()), only the values.
+    def set_printer_id(self, printer_id, values=None):
+        if values is None:
+            self._printer_id_map.id = printer_id
+        else:
+            values.set(self._printer_id_map, printer_id)
+    def set_exception(self, exception, values=None):
         if exception is not None:
-            self._exception_map.class_name = exception.__class__.__name__
+            if values is None:
+                self._exception_map.class_name = exception.__class__.__name__
+            else:
+                values.set(self._exception_map, str(exception.__class__.__name__))
             return True
         else:
             return False
-    def set_http_status(self, http_status, http_message):
+    def set_http_status(self, http_status, http_message, values=None):
         if http_status is not None:
-            self._http_status_map.status = http_status
-            self._http_message_map.message = http_message
+            if values is None:
+                self._http_status_map.status = http_status
+                self._http_message_map.message = http_message
+            else:
+                values.set(self._http_status_map, http_status)
+                values.set(self._http_message_map, str(http_message))
             if http_status == 200:
                 return False
             return True
@@ -96,37 +114,109 @@ class OctoPrintDeadbandCheckers(DeadbandCheckers):
         self.add_checker('PRINTER_TEMPERATURE_TOOL0_ACTUAL', DeadbandCheckerAlwaysDead() )
 
 class OctoPrintRawDataLogger:
-    def __init__(self, database_interface, redundant_strings):
+    # With a queue_size, samples are logged from a thread of the logger's own
+    # so a slow database does not stall data collection.  The database
+    # interface must then not be shared with anything else.  With
+    # batched=True the logger handles raw_data.octoprint_batch and inserts a
+    # whole cycle with one round trip.  policy decides what happens to
+    # samples when the queue is full (COALESCE keeps the latest sample per
+    # printer plus every state transition; it cannot be used batched).  While the database is
+    # unavailable the queued sample is retried every retry_delay seconds.
+    # report_unrecognized=False only notes the first time a path no column
+    # is mapped from is seen, which keeps mapping fast when the printers
+    # send a lot of them (plugins); the unrecognized path counts then stay
+    # at one.
+    def __init__(self, database_interface, redundant_strings, queue_size=None, batched=False, policy=OverloadPolicy.BLOCK, retry_delay=5.0, report_unrecognized=True):
         super().__init__()
         self._dbi = database_interface
         self._rs = redundant_strings
         self._maps = OctoPrintRawDataMaps(self._rs)
+        self._maps.report_unrecognized = report_unrecognized
+        # The maps are only used through the schema, so samples can be
+        # mapped on several threads at once; each gets its own FieldValues
+        # (or, batched, each batch its own FieldColumns).  The deadband
+        # checkers are per printer and not thread-safe, so one printer's
+        # samples must still be handled by one thread at a time.
+        self._schema = self._maps.schema()
+        self._sql = self._schema.insert
         self._dbcs = dict()
-        self._sql = None
-        pub.subscribe(self.map_then_log, 'raw_data.octoprint')
-    def map_then_log(self, sender, collected):
-        # Map the raw data to database fields
+        self._dbcs_lock = threading.Lock()
+        self._discarded = DiscardedRawData()
+        retry_on = getattr(database_interface, 'retryable_errors', ())
+        if batched:
+            self._subscriber = subscribe(self.map_then_log_batch, 'raw_data.octoprint_batch', queue_size,
+                    policy=policy, discarded=self._discarded.discarded_batch, retry_on=retry_on, retry_delay=retry_delay)
+        else:
+            self._subscriber = subscribe(self.map_then_log, 'raw_data.octoprint', queue_size,
+                    policy=policy, coalesce=coalesce_raw_data, replaces=replaces_raw_data,
+                    discarded=self._discarded.discarded, retry_on=retry_on, retry_delay=retry_delay)
+    def _map(self, sender, collected, values):
+        # Map the raw data into values.  Returns the deadband checkers, or
+        # None if there is nothing to insert.
         maps = self._maps
         dbcs = self._dbcs.get(sender.id, None)
+        unchanged = self._discarded.unchanged(sender, collected)
+        if unchanged and (dbcs is not None) and (not dbcs.alive_when_unchanged()):
+            increment('dmstl_rows_total', outcome='suppressed')
+            return None
         if dbcs is None:
-            dbcs = OctoPrintDeadbandCheckers(maps)
-            self._dbcs[sender.id] = dbcs
-        maps.reset()
-        maps.set_printer_id(sender.id)
+            with self._dbcs_lock:
+                dbcs = self._dbcs.get(sender.id, None)
+                if dbcs is None:
+                    dbcs = OctoPrintDeadbandCheckers(maps)
+                    self._dbcs[sender.id] = dbcs
+        maps.set_printer_id(sender.id, values)
         got_json = True
-        if maps.set_exception(collected._first_exception):
+        if maps.set_exception(collected._first_exception, values):
             got_json = False
-        if maps.set_http_status(collected._http_status, collected._http_message):
+        if maps.set_http_status(collected._http_status, collected._http_message, values):
             # rmv got_json = False
             pass
         if got_json:
-            for prefix, json in collected._jsons.items():
-                maps.update(prefix, json)
-        if dbcs.alive():
-            values = maps.generate_value_tuple()
-            if self._sql is None:
-                self._sql = maps.generate_insert()
-            self._dbi.execute(self._sql, values, True)
-            self._dbi.commit()
-            dbcs.commit()
-
+            with stage_timer('map', sender.id):
+                for prefix, json in collected._jsons.items():
+                    values.update(prefix, json)
+        with stage_timer('deadband', sender.id):
+            alive = dbcs.alive(values)
+        if alive:
+            return dbcs
+        increment('dmstl_rows_total', outcome='suppressed')
+        return None
+    def map_then_log(self, sender, collected):
+        with traced(collected.trace_id):
+            values = self._schema.new_values()
+            dbcs = self._map(sender, collected, values)
+            if dbcs is not None:
+                with stage_timer('insert', sender.id):
+                    self._dbi.execute(self._sql, values.generate_value_tuple(), True)
+                with stage_timer('commit', sender.id):
+                    self._dbi.commit()
+                increment('dmstl_rows_total', outcome='inserted')
+                dbcs.commit(values)
+    def map_then_log_batch(self, sender, batch):
+        # The batch is mapped into one FieldColumns, a row per sample that
+        # gets past the deadband.
+        columns = self._schema.new_columns()
+        mapped = list()
+        for c1, collected in batch:
+            columns.new_row()
+            with traced(collected.trace_id):
+                dbcs = self._map(c1, collected, columns)
+            if dbcs is None:
+                columns.drop_row()
+            else:
+                mapped.append((dbcs, columns.row))
+        if len(mapped) > 0:
+            rows = columns.rows()
+            with traced(batch.trace_id):
+                with stage_timer('insert'):
+                    self._dbi.executemany(self._sql, rows)
+                with stage_timer('commit'):
+                    self._dbi.commit()
+            increment('dmstl_rows_total', len(rows), outcome='inserted')
+            for dbcs, row in mapped:
+                columns.row = row
+                dbcs.commit(columns)
+    def shutdown(self):
+        if self._subscriber is not None:
+            self._subscriber.shutdown()
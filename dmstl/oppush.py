@@ -0,0 +1,215 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+# Push ingestion.  Each printer gets a thread holding OctoPrint's push socket
+# (/sockjs/websocket) open.  The "current" messages are turned into
+# OctoPrintRawDataCollected samples that are handed to the scheduling thread
+# and published on raw_data.octoprint like any polled sample.  Polling is
+# still used as a heartbeat and whenever the socket is down.
+
+from .logging import get_logger
+from .opraw import *
+import collections
+import copy
+import json
+import requests
+import threading
+import time
+
+def merge_json(base, changes):
+    rv = copy.deepcopy(base)
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(rv.get(key), dict):
+            rv[key] = merge_json(rv[key], value)
+        else:
+            rv[key] = value
+    return rv
+
+def push_current_to_jsons(current, base):
+    # Reshape a push "current" message into what /api/printer and /api/job
+    # return.  Anything the push message does not carry (e.g. sd) comes from
+    # the most recent polled sample so the mapped columns do not flap.
+    state = current.get('state', {})
+    printer = {'state': state}
+    temps = current.get('temps') or []
+    if len(temps) > 0:
+        offsets = current.get('offsets') or {}
+        temperature = dict()
+        for tool, reading in temps[-1].items():
+            if isinstance(reading, dict):
+                reading = dict(reading)
+                if tool in offsets:
+                    reading['offset'] = offsets[tool]
+                temperature[tool] = reading
+        printer['temperature'] = temperature
+    job = {
+            'job': current.get('job', {}),
+            'progress': current.get('progress', {}),
+            'state': state.get('text') }
+    return {
+            'PRINTER': merge_json(base.get('PRINTER', {}), printer),
+            'JOB': merge_json(base.get('JOB', {}), job) }
+
+class OctoPrintPushListener(threading.Thread):
+    def __init__(self, collector, throttle=2, reconnect_delay=5.0):
+        super().__init__(name='push {0}'.format(collector.name), daemon=True)
+        self._collector = collector
+        self._configuration = collector._configuration
+        self._logger = get_logger(__name__)
+        self._throttle = throttle
+        self._reconnect_delay = reconnect_delay
+        self._lock = threading.Lock()
+        self._base = dict()
+        self._pending = collections.deque()
+        self._force = False
+        self._terminated = False
+        self._ws = None
+        self.connected = False
+        self.last_message = None
+    def _login(self):
+        # A passive login exchanges the API key for a session the socket
+        # accepts.  Versions of OctoPrint (and stand-ins) without it are fine
+        # with no authentication.
+        c1 = self._configuration
+        try:
+            response = requests.post(c1.url('login'), json={'passive': True}, headers=c1.headers, timeout=2.0)
+            if response.status_code == 200:
+                user = response.json()
+                return '{0}:{1}'.format(user['name'], user['session'])
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            pass
+        return None
+    def _on_open(self, ws):
+        auth = self._login()
+        if auth is not None:
+            ws.send(json.dumps({'auth': auth}))
+        if self._throttle is not None:
+            ws.send(json.dumps({'throttle': self._throttle}))
+        self.connected = True
+    def _on_message(self, ws, message):
+        try:
+            data = json.loads(message)
+        except ValueError:
+            return
+        self.last_message = time.monotonic()
+        if 'event' in data:
+            # Events mark a transition; the next sample is always kept.
+            self._force = True
+        current = data.get('current')
+        if current is not None:
+            self._add_current(current)
+    def _on_close(self, ws, *args):
+        self.connected = False
+    def _on_error(self, ws, error):
+        self._logger.warning(
+                'Push socket for %s failed: %s', self._collector.name, error.__class__.__name__)
+    def _add_current(self, current):
+        with self._lock:
+            collected = OctoPrintRawDataCollected()
+            jsons = push_current_to_jsons(current, self._base)
+            for prefix, body in jsons.items():
+                collected.set_json(prefix, body)
+            pending = self._pending
+            # Keep only the latest of a run of samples in the same state.
+            if (not self._force) and (len(pending) > 0) and \
+                    (pending[-1].state_signature() == collected.state_signature()):
+                pending[-1] = collected
+            else:
+                pending.append(collected)
+            self._force = False
+    def set_base(self, collected):
+        if collected._http_status == 200:
+            with self._lock:
+                self._base = collected._jsons
+    def take(self):
+        with self._lock:
+            rv = list(self._pending)
+            self._pending.clear()
+        return rv
+    def run(self):
+        # Imported here so websocket-client is only needed by those who push
+        # (dmstl/__init__ imports this module).
+        # https://github.com/websocket-client/websocket-client
+        import websocket
+        c1 = self._configuration
+        url = 'ws://{0}/sockjs/websocket'.format(c1.ip_address)
+        while not self._terminated:
+            self._ws = websocket.WebSocketApp(url,
+                    header=['X-Api-Key: {0}'.format(c1.api_key)],
+                    on_open=self._on_open,
+                    on_message=self._on_message,
+                    on_error=self._on_error,
+                    on_close=self._on_close)
+            try:
+                self._ws.run_forever()
+            except Exception:
+                self._logger.warning('Push socket for %s stopped.', self._collector.name, exc_info=True)
+            self.connected = False
+            if not self._terminated:
+                time.sleep(self._reconnect_delay)
+    def terminate(self):
+        self._terminated = True
+        if self._ws is not None:
+            self._ws.close()
+
+class OctoPrintPushRawDataCollectors(OctoPrintRawDataCollectors):
+    # heartbeat is how often (seconds) a printer with a working push socket
+    # is still polled.  Printers without one are polled every cycle.
+    def __init__(self, dbi, heartbeat=60.0, throttle=2, batch=False):
+        super().__init__(dbi, batch=batch)
+        self._heartbeat = heartbeat
+        self._throttle = throttle
+        self._listeners = dict()
+        self._last_polled = dict()
+    def _get_listener(self, c1):
+        listener = self._listeners.get(c1.id)
+        if listener is None:
+            listener = OctoPrintPushListener(c1, self._throttle)
+            self._listeners[c1.id] = listener
+            listener.start()
+        return listener
+    def _collect(self):
+        results = list()
+        now = time.monotonic()
+        for c1 in self:
+            if not c1.active:
+                continue
+            listener = self._get_listener(c1)
+            results.extend((c1, collected) for collected in listener.take())
+            polled = self._last_polled.get(c1.id)
+            if (not listener.connected) or (polled is None) or (now - polled >= self._heartbeat):
+                collected = c1.collect()
+                listener.set_base(collected)
+                self._last_polled[c1.id] = now
+                results.append((c1, collected))
+        return results
+    def _retire(self, collector):
+        # The listener of a printer that is gone or changed goes with it.
+        listener = self._listeners.pop(collector.id, None)
+        if listener is not None:
+            listener.terminate()
+        super()._retire(collector)
+    def shutdown(self):
+        for listener in self._listeners.values():
+            listener.terminate()
+        super().shutdown()
@@ -20,14 +20,26 @@
 # SOFTWARE.
 #
 
+from .errors import ReadTimeout
 from .insulation import PrintersLoadFromMemory
 from .logging import get_logger
+from .metrics import increment
 from .raw import *
+from .timing import stage_timer
+from .trace import new_cycle_id, sample_id, traced
 from pubsub import pub
+import concurrent.futures
+import enum
 import requests
+import requests.adapters
 import sys
+import threading
+import time
 
 class OctoPrintRawDataCollected(RawDataCollected):
+    # Set by OctoPrintRawDataRecorder.  While True each sample keeps a list
+    # of what went into it (see _recorded) so it can be written out.
+    recording = False
     def __init__(self):
         super().__init__()
         self._logger = get_logger(__name__)
@@ -40,17 +52,44 @@ class OctoPrintRawDataCollected(RawDataCollected):
         self._http_message = None
         self._first_exception = None
         self._exceptions = dict()
-    def set_exception(self, prefix, exception):
+        self._contents = dict()
+        self._unchanged = set()
+        self._recorded = list()
+        self.trace_id = None
+    @property
+    def unchanged(self):
+        # True if every response is byte for byte the same as in the previous
+        # sample published for this printer.  Subscribers can skip the work.
+        return (self._first_exception is None) and (len(self._requests) > 0) and \
+                (len(self._unchanged) == len(self._requests))
+    def record(self, prefix, status, payload):
+        # Note what went into the sample while recording (see oprecord).
+        # set_request, set_exception and set_json call it; so do samples
+        # rebuilt from another process.
+        if self.recording:
+            self._recorded.append((time.time(), prefix, status, payload))
+    def set_exception(self, prefix, exception, quiet=False):
+        self.record(prefix, None, exception.__class__.__name__)
         if self._first_exception is None:
             self._first_exception = exception
         self._exceptions[prefix] = exception
-        self._logger.warning(
-                'An exception occurred trying to collected raw data: {0}'.
-                format(exception.__class__.__name__))
-    def set_request(self, prefix, request):
+        if not quiet:
+            self._logger.warning(
+                    'An exception occurred trying to collected raw data: {0}'.
+                    format(exception.__class__.__name__))
+    def set_request(self, prefix, request, previous=None):
+        self.record(prefix, request.status_code, request.content)
         self._requests[prefix] = request
         if request.status_code == 200:
-            self._jsons[prefix] = request.json()
+            content = request.content
+            last = previous.get(prefix) if previous is not None else None
+            if (last is not None) and (last[0] == content):
+                json = last[1]
+                self._unchanged.add(prefix)
+            else:
+                json = request.json()
+            self._jsons[prefix] = json
+            self._contents[prefix] = (content, json)
             if self._http_status is None:
                 self._http_status = request.status_code
         else:
@@ -58,6 +97,65 @@ class OctoPrintRawDataCollected(RawDataCollected):
                 self._http_status = request.status_code
                 if request.status_code == 409:
                     self._http_message = request.text
+    def set_json(self, prefix, json):
+        # For data that did not come from a request (e.g. the push socket).
+        self.record(prefix, 0, json)
+        self._jsons[prefix] = json
+        if self._http_status is None:
+            self._http_status = 200
+    def state_signature(self):
+        # Two samples with the same signature lead to the same printer state.
+        exception = self._first_exception
+        state = self._jsons.get('PRINTER', {}).get('state', {}).get('text')
+        return (exception.__class__.__name__ if exception is not None else None, self._http_status, state)
+
+def count_sample(printer_id, collected):
+    # Feed the poll and HTTP status counters with a published sample.
+    if not collected.active:
+        return
+    exception = collected._first_exception
+    if exception is None:
+        outcome = 'success'
+    elif exception.__class__.__name__ in ('ConnectTimeout', 'ReadTimeout'):
+        outcome = 'timeout'
+    else:
+        outcome = 'error'
+    increment('dmstl_polls_total', printer=printer_id, outcome=outcome)
+    if collected._http_status is not None:
+        increment('dmstl_http_responses_total', status=collected._http_status)
+
+def coalesce_raw_data(sender, collected):
+    # The coalesce function for QueuedSubscribers of raw_data.octoprint.
+    return (sender.id, collected.state_signature())
+
+def replaces_raw_data(sender, collected):
+    # An unchanged sample must not take the place of the queued one it
+    # matches; subscribers skip unchanged samples, so the queued sample's
+    # values would never be handled.
+    return not collected.unchanged
+
+class DiscardedRawData():
+    # Remembers the printers whose samples a QueuedSubscriber discarded (pass
+    # discarded or discarded_batch along to it).  A printer's next sample
+    # was compared with the discarded one, so it is not taken as unchanged
+    # even if it says so; unchanged() is asked instead of collected.unchanged.
+    def __init__(self):
+        super().__init__()
+        self._ids = set()
+        self._lock = threading.Lock()
+    def discarded(self, sender, collected):
+        with self._lock:
+            self._ids.add(sender.id)
+    def discarded_batch(self, sender, batch):
+        with self._lock:
+            self._ids.update(c1.id for c1, collected in batch)
+    def unchanged(self, sender, collected):
+        if len(self._ids) > 0:
+            with self._lock:
+                if sender.id in self._ids:
+                    self._ids.discard(sender.id)
+                    return False
+        return collected.unchanged
 
 class OctoPrintRawDataCollectorConfiguration(RawDataCollectorConfiguration):
     def __init__(self, row):
@@ -67,10 +165,15 @@ class OctoPrintRawDataCollectorConfiguration(RawDataCollectorConfiguration):
         self._ip_address = row[2]
         self._api_key = row[3]
         self._active = row[4]
+        # Built once so polling does not rebuild them every request.
+        self._headers = {
+                'User-Agent': 'Raw Data Logger/1',
+                'X-Api-Key': self._api_key,
+                'Content-Type': 'application/json' }
+        self._urls = dict()
     def __repr__(self):
-        row = (self._id, self._name, self._ip_address, self._api_key, self._active)
         return "%s(%s)" \
-            % ( self.__class__.__name__, repr(row) )
+            % ( self.__class__.__name__, repr(self.row) )
     @property
     def api_key(self):
         return self._api_key
@@ -84,8 +187,74 @@ class OctoPrintRawDataCollectorConfiguration(RawDataCollectorConfiguration):
     def active(self):
         return (self._active) and (self._api_key is not None) and (self._ip_address is not None)
     @property
+    def headers(self):
+        return self._headers
+    @property
+    def row(self):
+        return (self._id, self._name, self._ip_address, self._api_key, self._active)
+    @property
     def name(self):
         return self._name
+    def url(self, verb):
+        rv = self._urls.get(verb)
+        if rv is None:
+            rv = "http://%s/api/%s" % ( self._ip_address, verb )
+            self._urls[verb] = rv
+        return rv
+
+def is_unreachable(exception):
+    # True if exception means the printer could not be reached at all (as
+    # opposed to answering slowly or badly).
+    name = exception.__class__.__name__
+    if (name == 'ReadTimeout') or isinstance(exception, ValueError):
+        return False
+    return (name == 'ConnectTimeout') or isinstance(exception, OSError)
+
+class CircuitState(enum.Enum):
+    CLOSED = 1
+    OPEN = 2
+    HALF_OPEN = 3
+
+class OctoPrintCircuitBreaker():
+    # After threshold unreachable polls in a row the breaker opens and the
+    # printer is left alone for base_delay seconds, doubling each time a probe
+    # fails, up to max_delay.  While open, the last exception is reported
+    # without touching the network.
+    def __init__(self, name, threshold=3, base_delay=5.0, max_delay=300.0, timefunc=time.monotonic):
+        super().__init__()
+        self._name = name
+        self._threshold = threshold
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._timefunc = timefunc
+        self._logger = get_logger(__name__)
+        self._failures = 0
+        self._trips = 0
+        self._retry_at = None
+        self.state = CircuitState.CLOSED
+        self.last_exception = None
+    def allow(self):
+        if self.state == CircuitState.OPEN:
+            if self._timefunc() < self._retry_at:
+                return False
+            self.state = CircuitState.HALF_OPEN
+        return True
+    def success(self):
+        if self.state != CircuitState.CLOSED:
+            self._logger.info('%s is reachable again.', self._name)
+        self.state = CircuitState.CLOSED
+        self._failures = 0
+        self._trips = 0
+    def failure(self, exception):
+        self.last_exception = exception
+        self._failures += 1
+        if (self.state == CircuitState.HALF_OPEN) or (self._failures >= self._threshold):
+            delay = min(self._max_delay, self._base_delay * (2 ** self._trips))
+            if self.state == CircuitState.CLOSED:
+                self._logger.warning('%s is unreachable (%s); backing off.', self._name, exception.__class__.__name__)
+            self._trips += 1
+            self._retry_at = self._timefunc() + delay
+            self.state = CircuitState.OPEN
 
 class OctoPrintRequestDetails:
     def __init__(self, verb, prefix):
@@ -97,32 +266,108 @@ class OctoPrintRawDataCollector(RawDataCollector):
     REQUEST_DETAILS = [
             OctoPrintRequestDetails('printer', 'PRINTER'),
             OctoPrintRequestDetails('job', 'JOB') ]
-    def __init__(self, configuration):
+    def __init__(self, configuration, timeout=0.5):
         super().__init__()
         self._configuration = configuration
         self._logger = get_logger(__name__)
-    def get_fresh_data(self, collected=None):
+        self._timeout = timeout
+        self._session = None
+        self._session_used = False
+        self._breaker = OctoPrintCircuitBreaker(configuration.name)
+        self._previous = dict()
+        self.trace_cycle = None
+        self._urls = [(detail.prefix, configuration.url(detail.verb)) for detail in OctoPrintRawDataCollector.REQUEST_DETAILS]
+    def timed_out(self, message):
+        # A sample for a poll that did not finish in time.  Published like any
+        # other so the outage shows up in RAW_DATA and the metrics.
+        collected = OctoPrintRawDataCollected()
+        collected.reset()
+        collected.set_exception(self._urls[0][0], ReadTimeout(message), quiet=True)
+        return collected
+    def _get_session(self):
+        if self._session is None:
+            # One kept-alive connection per printer.  urllib3 notices a
+            # connection the printer has closed and quietly opens a new one.
+            session = requests.Session()
+            session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            session.headers.update(self._configuration.headers)
+            self._session = session
+            self._session_used = False
+        return self._session
+    def _reset_session(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+    def _get(self, url):
+        try:
+            rv = self._get_session().get(url, timeout=self._timeout)
+        except requests.exceptions.Timeout:
+            raise
+        except requests.exceptions.ConnectionError:
+            # The printer may have dropped a kept-alive connection just as it
+            # was reused.  Try once more on a fresh connection.
+            retry = self._session_used
+            self._reset_session()
+            if not retry:
+                raise
+            rv = self._get_session().get(url, timeout=self._timeout)
+        self._session_used = True
+        return rv
+    def collect(self, collected=None):
+        # Gather the raw data without publishing it.  Safe to call from a
+        # worker thread.
         if collected is None:
             collected = OctoPrintRawDataCollected()
         collected.reset()
+        collected.trace_id = sample_id(self.trace_cycle, self.id)
         c1 = self._configuration
         if self.active and c1.active:
-            headers = {
-                    'User-Agent': 'Raw Data Logger/1',
-                    'X-Api-Key': c1.api_key,
-                    'Content-Type': 'application/json' }
-            for detail in OctoPrintRawDataCollector.REQUEST_DETAILS:
-                url = "http://%s/api/%s" % ( c1.ip_address, detail.verb )
-                try:
-                    collected.set_request(detail.prefix, requests.get(url, headers=headers, timeout=0.5) )
-                except: #  requests.exceptions.ConnectTimeout as exception:
-                    exception = sys.exc_info()[1]
-                    collected.set_exception(detail.prefix, exception)
+            breaker = self._breaker
+            if not breaker.allow():
+                # Still an outage as far as the subscribers are concerned.
+                collected.set_exception(self._urls[0][0], breaker.last_exception, quiet=True)
+                return collected
+            with traced(collected.trace_id):
+                for prefix, url in self._urls:
+                    try:
+                        with stage_timer('http', self.id):
+                            response = self._get(url)
+                        with stage_timer('decode', self.id):
+                            collected.set_request(prefix, response, self._previous)
+                        breaker.success()
+                    except: #  requests.exceptions.ConnectTimeout as exception:
+                        exception = sys.exc_info()[1]
+                        collected.set_exception(prefix, exception)
+                        if is_unreachable(exception):
+                            # No point waiting on the second endpoint too.
+                            breaker.failure(exception)
+                            break
         else:
             collected.active = False
+        return collected
+    def remember(self, collected):
+        # The next sample is compared with this one.  Only published samples
+        # are remembered so "unchanged" is relative to what subscribers saw.
+        if (collected._first_exception is None) and (collected._http_status == 200):
+            self._previous = collected._contents
+        else:
+            self._previous = dict()
+    def publish(self, collected):
+        self.remember(collected)
+        count_sample(self.id, collected)
         pub.sendMessage('raw_data.octoprint', sender=self, collected=collected)
+    def get_fresh_data(self, collected=None):
+        self.trace_cycle = new_cycle_id()
+        collected = self.collect(collected)
+        self.publish(collected)
         return collected
     @property
+    def configuration(self):
+        return self._configuration
+    @property
+    def row(self):
+        return self._configuration.row
+    @property
     def id(self):
         return self._configuration.id
     @property
@@ -130,6 +375,29 @@ class OctoPrintRawDataCollector(RawDataCollector):
         return self._configuration.name
     def shutdown(self):
         super().shutdown()
+        self._reset_session()
+
+class OctoPrintRawDataBatch():
+    # Every sample collected in one cycle, as (collector, collected) pairs.
+    def __init__(self, cycle, samples):
+        super().__init__()
+        self.cycle = cycle
+        self.samples = samples
+        self.trace_id = None
+    def __iter__(self):
+        return iter(self.samples)
+    def __len__(self):
+        return len(self.samples)
+
+class OctoPrintRawDataBatchAdapter():
+    # Republishes each sample of a batch on raw_data.octoprint for
+    # subscribers that only handle one sample at a time.
+    def __init__(self):
+        super().__init__()
+        pub.subscribe(self.unbatch, 'raw_data.octoprint_batch')
+    def unbatch(self, sender, batch):
+        for c1, collected in batch:
+            pub.sendMessage('raw_data.octoprint', sender=c1, collected=collected)
 
 class OctoPrintRawDataCollectors(RawDataCollectors):
     SqlSelectPrinters = """
@@ -144,6 +412,24 @@ from
 order by
   P.PRINTERID
 """
+    # max_workers=None polls the printers one after another.  Otherwise a
+    # pool of max_workers threads polls them all at once and each cycle waits
+    # at most deadline seconds for the stragglers.  With batch=True a cycle
+    # is published as one OctoPrintRawDataBatch on raw_data.octoprint_batch
+    # instead of one message per printer on raw_data.octoprint.
+    def __init__(self, dbi, max_workers=None, deadline=4.0, batch=False):
+        super().__init__(dbi)
+        self._max_workers = max_workers
+        self._deadline = deadline
+        self._batch = batch
+        self._batch_cycle = 0
+        self._trace_cycle = None
+        self._executor = None
+        self._in_flight = dict()
+        self._scheduler = None
+        self._events = dict()
+        self._polled = dict()
+        self._logger = get_logger(__name__)
     def _create_collector_from_row(self, row):
         configuration = OctoPrintRawDataCollectorConfiguration(row)
         collector = OctoPrintRawDataCollector(configuration)
@@ -153,10 +439,126 @@ order by
     def _load_collectors_from_memory(self, method):
         loader = PrintersLoadFromMemory()
         loader._load_collectors_from_memory(method)
-    def get_fresh_data(self):
+    def _collect_sequentially(self):
+        results = list()
+        for c1 in self:
+            if c1.active:
+                results.append((c1, c1.collect()))
+        return results
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._max_workers)
+        return self._executor
+    def _collect_concurrently(self):
+        self._get_executor()
+        in_flight = self._in_flight
+        submitted = list()
+        results = list()
         for c1 in self:
             if c1.active:
-                c1.get_fresh_data()
+                # A printer still answering a previous cycle is left alone
+                # until it finishes; until then each cycle gets a timeout.
+                previous = in_flight.get(c1.id, None)
+                if (previous is not None) and (not previous.done()):
+                    results.append((c1, c1.timed_out('Still collecting from the previous cycle.')))
+                    continue
+                future = self._executor.submit(c1.collect)
+                in_flight[c1.id] = future
+                submitted.append((c1, future))
+        concurrent.futures.wait([f for c1, f in submitted], timeout=self._deadline)
+        for c1, future in submitted:
+            if future.done():
+                results.append((c1, future.result()))
+            else:
+                self._logger.warning(
+                        'Collecting raw data from %s missed the %.1f second deadline.',
+                        c1.name, self._deadline)
+                results.append((c1, c1.timed_out('Missed the {0:.1f} second deadline.'.format(self._deadline))))
+        return results
+    def _publish(self, results):
+        if self._trace_cycle is not None:
+            # Samples that were not collected here (other processes, the
+            # push socket) get their ids now.
+            for c1, collected in results:
+                if collected.trace_id is None:
+                    collected.trace_id = sample_id(self._trace_cycle, c1.id)
+        if self._batch:
+            self._batch_cycle += 1
+            for c1, collected in results:
+                c1.remember(collected)
+                count_sample(c1.id, collected)
+            batch = OctoPrintRawDataBatch(self._batch_cycle, results)
+            batch.trace_id = self._trace_cycle
+            pub.sendMessage('raw_data.octoprint_batch', sender=self, batch=batch)
+        else:
+            for c1, collected in results:
+                c1.publish(collected)
+    def _collect(self):
+        if self._max_workers is None:
+            return self._collect_sequentially()
+        else:
+            return self._collect_concurrently()
+    def get_fresh_data(self):
+        cycle_id = new_cycle_id()
+        if cycle_id is not None:
+            for c1 in self:
+                c1.trace_cycle = cycle_id
+        self._trace_cycle = cycle_id
+        with traced(cycle_id), stage_timer('cycle'):
+            results = self._collect()
+            self._publish(results)
+    def schedule(self, scheduler, priority, cadence, reload_every=60.0):
+        # Poll each printer with its own repeating event instead of one
+        # event for all of them.  cadence.interval(id) decides how often.
+        # With max_workers the events only hand the polls to the pool, so a
+        # slow printer does not hold up the others.  PRINTERS is read again
+        # every reload_every seconds (None for never) and the events follow
+        # the printers that come and go.
+        self._scheduler = scheduler
+        self._priority = priority
+        self._cadence = cadence
+        self._schedule_printers()
+        if reload_every is not None:
+            scheduler.every(reload_every, priority, self.reload_and_schedule, name='printers')
+    def _schedule_printers(self):
+        # One event per active printer; events of printers that are gone are
+        # stopped.  _polled maps ids to the current collectors.
+        self._polled = {c1.id: c1 for c1 in self if c1.active}
+        for c1 in self._polled.values():
+            if c1.id not in self._events:
+                self._events[c1.id] = self._scheduler.every(lambda id=c1.id: self._cadence.interval(id), self._priority,
+                        self._poll, argument=(c1.id,), name='poll {0}'.format(c1.name))
+        for id in [id for id in self._events if id not in self._polled]:
+            self._scheduler.stop(self._events.pop(id))
+    def reload_and_schedule(self):
+        self.reload()
+        if self._scheduler is not None:
+            self._schedule_printers()
+    def _retire(self, collector):
+        # A poll may still be using the collector's session; it is shut down
+        # once that poll is done.
+        future = self._in_flight.get(collector.id, None)
+        if future is not None:
+            future.add_done_callback(lambda future: collector.shutdown())
+        else:
+            collector.shutdown()
+    def _poll(self, id):
+        c1 = self._polled.get(id, None)
+        if c1 is None:
+            return
+        if self._max_workers is None:
+            c1.get_fresh_data()
+            return
+        # A printer still answering its last poll is left alone.
+        previous = self._in_flight.get(id, None)
+        if (previous is not None) and (not previous.done()):
+            return
+        if (previous is not None) and (previous.exception() is not None):
+            self._logger.error('Polling %s failed.', c1.name, exc_info=previous.exception())
+        self._in_flight[id] = self._get_executor().submit(c1.get_fresh_data)
     def shutdown(self):
         super().shutdown()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
 
@@ -0,0 +1,184 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+from .dispatch import subscribe
+from .errors import remote_exception
+from .logging import get_logger
+from .opraw import OctoPrintRawDataCollected, count_sample
+from pubsub import pub
+import json
+import marshal
+import struct
+import threading
+import time
+import zlib
+
+# A recording is a header followed by one record per published sample.  Each
+# record is a little-endian 32 bit length and that many bytes of zlib
+# compressed marshal data:
+#   (printer id, printer name, active, [(timestamp, prefix, status, payload)])
+# For a response, status is the HTTP status and payload the body (bytes);
+# samples from the sharded collectors carry the body written out again from
+# its JSON, since the original stays in the worker process.
+# For an exception, status is None and payload the class name.  Status 0 is
+# a JSON object that did not come from a request (the push socket).  Records
+# are only ever appended; a torn record at the end is ignored.
+
+Header = b'DMSTL raw data recording 1\n'
+
+class OctoPrintRawDataRecorder():
+    # Appends every published sample to path until closed.  With
+    # batched=True the samples are taken from raw_data.octoprint_batch.
+    def __init__(self, path, batched=False, queue_size=None):
+        super().__init__()
+        self._logger = get_logger(__name__)
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(Header)
+        self.records = 0
+        OctoPrintRawDataCollected.recording = True
+        if batched:
+            self._subscriber = subscribe(self.record_batch, 'raw_data.octoprint_batch', queue_size)
+        else:
+            self._subscriber = subscribe(self.record, 'raw_data.octoprint', queue_size)
+        self._batched = batched
+    def record(self, sender, collected):
+        data = marshal.dumps((sender.id, sender.name, collected.active, collected._recorded))
+        data = zlib.compress(data)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(struct.pack('<I', len(data)))
+                self._file.write(data)
+                self.records += 1
+    def record_batch(self, sender, batch):
+        for c1, collected in batch:
+            self.record(c1, collected)
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+    def close(self):
+        if self._subscriber is not None:
+            self._subscriber.shutdown()
+            self._subscriber = None
+        elif self._batched:
+            pub.unsubscribe(self.record_batch, 'raw_data.octoprint_batch')
+        else:
+            pub.unsubscribe(self.record, 'raw_data.octoprint')
+        OctoPrintRawDataCollected.recording = False
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+    def shutdown(self):
+        self.close()
+
+def read_recording(path):
+    # Yields (printer id, printer name, active, events) for each record.
+    with open(path, 'rb') as inf:
+        if inf.read(len(Header)) != Header:
+            raise ValueError('{0} is not a raw data recording.'.format(path))
+        while True:
+            prefix = inf.read(4)
+            if len(prefix) < 4:
+                break
+            length = struct.unpack('<I', prefix)[0]
+            data = inf.read(length)
+            if len(data) < length:
+                break
+            yield marshal.loads(zlib.decompress(data))
+
+class RecordedResponse():
+    # Looks enough like a requests response for set_request.
+    def __init__(self, status_code, content):
+        super().__init__()
+        self.status_code = status_code
+        self.content = content
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+    def json(self):
+        return json.loads(self.text)
+
+class ReplayedPrinter():
+    # Stands in for the collector that published a recorded sample.
+    def __init__(self, id, name):
+        super().__init__()
+        self.id = id
+        self.name = name
+        self._previous = dict()
+    def remember(self, collected):
+        if (collected._first_exception is None) and (collected._http_status == 200):
+            self._previous = collected._contents
+        else:
+            self._previous = dict()
+
+class OctoPrintRawDataReplay():
+    # Publishes a recording on raw_data.octoprint.  By default as fast as the
+    # subscribers take it; with realtime=True at the pace it was recorded.
+    # Responses are decoded again, so unchanged detection, mapping, deadband
+    # checking and crunching see what they saw in production.
+    def __init__(self, path):
+        super().__init__()
+        self._path = path
+        self._printers = dict()
+        self.samples = 0
+        self.elapsed = 0.0
+    def _rebuild(self, printer, active, events):
+        collected = OctoPrintRawDataCollected()
+        collected.active = active
+        for timestamp, prefix, status, payload in events:
+            if status is None:
+                collected.set_exception(prefix, remote_exception(payload), quiet=True)
+            elif status == 0:
+                collected.set_json(prefix, payload)
+            else:
+                collected.set_request(prefix, RecordedResponse(status, payload), printer._previous)
+        return collected
+    def run(self, realtime=False, limit=None):
+        started = time.perf_counter()
+        first_recorded = None
+        for id, name, active, events in read_recording(self._path):
+            if (limit is not None) and (self.samples >= limit):
+                break
+            printer = self._printers.get(id, None)
+            if printer is None:
+                printer = ReplayedPrinter(id, name)
+                self._printers[id] = printer
+            if realtime and (len(events) > 0):
+                if first_recorded is None:
+                    first_recorded = events[0][0]
+                delay = (events[0][0] - first_recorded) - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            collected = self._rebuild(printer, active, events)
+            printer.remember(collected)
+            count_sample(id, collected)
+            pub.sendMessage('raw_data.octoprint', sender=printer, collected=collected)
+            self.samples += 1
+        self.elapsed = time.perf_counter() - started
+        return self.samples
+    @property
+    def rate(self):
+        return self.samples / self.elapsed if self.elapsed > 0 else 0.0
@@ -0,0 +1,331 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+# Sharded collection.  The printers are split across worker processes, each
+# polling its share with its own OctoPrintRawDataCollector objects and
+# decoding the JSON.  Samples come back through a shared memory ring buffer
+# per worker, marshalled (much cheaper to load than JSON or pickle), with
+# unchanged responses sent as nothing but their prefix.  The parent
+# publishes them on raw_data.octoprint as usual.
+
+from .errors import remote_exception
+from .logging import get_logger
+from .opraw import *
+import concurrent.futures
+import json
+import marshal
+import multiprocessing
+import os
+import queue
+import struct
+import time
+
+class SharedRingBuffer():
+    # Single producer, single consumer.  head and tail count bytes written
+    # and read since the start so head - tail is the amount in use.
+    _Length = struct.Struct('<I')
+    def __init__(self, size):
+        super().__init__()
+        self._size = size
+        self._buffer = multiprocessing.RawArray('B', size)
+        self._head = multiprocessing.Value('Q', 0)
+        self._tail = multiprocessing.Value('Q', 0)
+        self._view = None
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_view'] = None
+        return state
+    def _get_view(self):
+        if self._view is None:
+            self._view = memoryview(self._buffer).cast('B')
+        return self._view
+    def _write(self, position, data):
+        view = self._get_view()
+        position %= self._size
+        first = min(len(data), self._size - position)
+        view[position:position+first] = data[:first]
+        if first < len(data):
+            view[0:len(data)-first] = data[first:]
+    def _read(self, position, length):
+        view = self._get_view()
+        position %= self._size
+        first = min(length, self._size - position)
+        rv = view[position:position+first].tobytes()
+        if first < length:
+            rv += view[0:length-first].tobytes()
+        return rv
+    def put(self, payload, timeout=1.0):
+        data = SharedRingBuffer._Length.pack(len(payload)) + payload
+        if len(data) > self._size:
+            return False
+        head = self._head.value
+        give_up = time.monotonic() + timeout
+        while self._size - (head - self._tail.value) < len(data):
+            if time.monotonic() >= give_up:
+                return False
+            time.sleep(0.001)
+        self._write(head, data)
+        self._head.value = head + len(data)
+        return True
+    def get(self):
+        tail = self._tail.value
+        if self._head.value == tail:
+            return None
+        length, = SharedRingBuffer._Length.unpack(self._read(tail, 4))
+        rv = self._read(tail + 4, length)
+        self._tail.value = tail + 4 + length
+        return rv
+
+def encode_sample(id, cycle, collected):
+    exception = collected._first_exception
+    unchanged = [prefix for prefix in collected._requests if prefix in collected._unchanged]
+    jsons = {prefix: json for prefix, json in collected._jsons.items() if prefix not in collected._unchanged}
+    statuses = {prefix: request.status_code for prefix, request in collected._requests.items()}
+    return marshal.dumps((
+            id,
+            cycle,
+            collected.active,
+            exception.__class__.__name__ if exception is not None else None,
+            list(collected._exceptions),
+            collected._http_status,
+            collected._http_message,
+            unchanged,
+            jsons,
+            statuses))
+
+def _shard_worker(index, control, done, ring, threads):
+    logger = get_logger(__name__)
+    collectors = dict()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+    def collect_one(c1):
+        return c1, c1.collect()
+    try:
+        while True:
+            # Handle everything that is waiting; a backlog of collect
+            # requests only earns one collection, for the latest cycle.
+            messages = [control.get()]
+            while True:
+                try:
+                    messages.append(control.get_nowait())
+                except queue.Empty:
+                    break
+            cycle = None
+            for message in messages:
+                if message is None:
+                    return
+                if message[0] == 'printers':
+                    rows = {row[0]: row for row in message[1]}
+                    for id in list(collectors):
+                        if (id not in rows) or (collectors[id].configuration.row != rows[id]):
+                            collectors.pop(id).shutdown()
+                    for id, row in rows.items():
+                        if id not in collectors:
+                            collectors[id] = OctoPrintRawDataCollector(OctoPrintRawDataCollectorConfiguration(row))
+                elif message[0] == 'collect':
+                    cycle = message[1]
+            if cycle is not None:
+                for c1, collected in executor.map(collect_one, list(collectors.values())):
+                    if ring.put(encode_sample(c1.id, cycle, collected)):
+                        c1.remember(collected)
+                    else:
+                        logger.warning('Shard %d ring buffer is full; dropped a sample from %s.', index, c1.name)
+                        c1.remember(OctoPrintRawDataCollected())
+                done.put((index, cycle))
+    finally:
+        for c1 in collectors.values():
+            c1.shutdown()
+        executor.shutdown(wait=False)
+
+def _json_body(document):
+    return json.dumps(document, separators=(',', ':')).encode('utf-8')
+
+class OctoPrintShard():
+    def __init__(self, index, done, ring_size, threads):
+        super().__init__()
+        self.index = index
+        self.ids = set()
+        self.rows = None
+        self._done = done
+        self._ring_size = ring_size
+        self._threads = threads
+        self._process = None
+        self._previous = dict()
+    def start(self):
+        self.control = multiprocessing.Queue()
+        self.ring = SharedRingBuffer(self._ring_size)
+        self.rows = None
+        self._previous = dict()
+        self._process = multiprocessing.Process(
+                target=_shard_worker,
+                args=(self.index, self.control, self._done, self.ring, self._threads),
+                name='dmstl shard {0}'.format(self.index),
+                daemon=True)
+        self._process.start()
+    @property
+    def alive(self):
+        return (self._process is not None) and self._process.is_alive()
+    def decode(self, record):
+        # Returns (id, collected) rebuilt from a record.
+        id, cycle, active, exception, prefixes, http_status, http_message, unchanged, jsons, statuses = marshal.loads(record)
+        collected = OctoPrintRawDataCollected()
+        collected.active = active
+        if exception is not None:
+            for prefix in prefixes:
+                collected.set_exception(prefix, remote_exception(exception), quiet=True)
+        previous = self._previous.get(id, {})
+        for prefix in unchanged:
+            jsons[prefix] = previous[prefix]
+            collected._requests[prefix] = None
+            collected._unchanged.add(prefix)
+        for prefix, json in jsons.items():
+            collected._jsons[prefix] = json
+            collected._requests.setdefault(prefix, None)
+        collected._http_status = http_status
+        collected._http_message = http_message
+        if collected.recording:
+            # The bodies stay in the worker; a body is written out again
+            # from its JSON so a replay decodes (and compares) the same.
+            for prefix, status in statuses.items():
+                if status != 200:
+                    collected.record(prefix, status, (http_message or '').encode('utf-8'))
+                elif prefix in jsons:
+                    collected.record(prefix, status, _json_body(jsons[prefix]))
+        if (exception is None) and (http_status == 200):
+            self._previous[id] = jsons
+        else:
+            self._previous.pop(id, None)
+        return id, collected
+    def stop(self):
+        if self._process is not None:
+            try:
+                self.control.put(None)
+                self._process.join(2.0)
+            finally:
+                if self._process.is_alive():
+                    self._process.terminate()
+                self._process = None
+
+class OctoPrintShardedRawDataCollectors(OctoPrintRawDataCollectors):
+    # workers processes poll about the same number of printers each, using
+    # threads threads apiece.  PRINTERS is read again every reload_every
+    # seconds and the printers rebalanced across the workers.
+    def __init__(self, dbi, workers=None, threads=8, deadline=4.0, ring_size=4*1024*1024, reload_every=60.0, batch=False):
+        super().__init__(dbi, deadline=deadline, batch=batch)
+        self._workers = workers or os.cpu_count() or 1
+        self._threads = threads
+        self._ring_size = ring_size
+        self._reload_every = reload_every
+        self._loaded = None
+        self._shards = None
+        self._done = None
+        self._cycle = 0
+        self._by_id = dict()
+    def _start(self):
+        self._done = multiprocessing.Queue()
+        self._shards = [OctoPrintShard(i1, self._done, self._ring_size, self._threads) for i1 in range(self._workers)]
+        for shard in self._shards:
+            shard.start()
+    def _rebalance(self):
+        self._by_id = {c1.id: c1 for c1 in self if c1.active}
+        shards = self._shards
+        changed = set()
+        for shard in shards:
+            gone = shard.ids - set(self._by_id)
+            if len(gone) > 0:
+                shard.ids -= gone
+                changed.add(shard)
+        assigned = set()
+        for shard in shards:
+            assigned |= shard.ids
+        for id in self._by_id:
+            if id not in assigned:
+                shard = min(shards, key=lambda s: len(s.ids))
+                shard.ids.add(id)
+                changed.add(shard)
+        while True:
+            most = max(shards, key=lambda s: len(s.ids))
+            least = min(shards, key=lambda s: len(s.ids))
+            if len(most.ids) - len(least.ids) <= 1:
+                break
+            least.ids.add(most.ids.pop())
+            changed.update((most, least))
+        for shard in shards:
+            # A printer changed in place (same id, new address or API key)
+            # changes the shard's rows but not its ids.
+            if (shard in changed) or (self._rows_for(shard) != shard.rows):
+                self._send_printers(shard)
+    def _rows_for(self, shard):
+        return [self._by_id[id].configuration.row for id in sorted(shard.ids)]
+    def _send_printers(self, shard):
+        rows = self._rows_for(shard)
+        shard.control.put(('printers', rows))
+        shard.rows = rows
+    def _drain(self, results):
+        for shard in self._shards:
+            while True:
+                record = shard.ring.get()
+                if record is None:
+                    break
+                id, collected = shard.decode(record)
+                c1 = self._by_id.get(id, None)
+                if c1 is not None:
+                    results.append((c1, collected))
+    def _collect(self):
+        if self._shards is None:
+            self._start()
+        now = time.monotonic()
+        if (self._loaded is None) or (now - self._loaded >= self._reload_every):
+            if self._loaded is not None:
+                self.reload()
+            self._loaded = now
+            self._rebalance()
+        for shard in self._shards:
+            if not shard.alive:
+                self._logger.warning('Shard %d is not running; restarting it.', shard.index)
+                shard.stop()
+                shard.start()
+                self._send_printers(shard)
+        self._cycle += 1
+        for shard in self._shards:
+            shard.control.put(('collect', self._cycle))
+        results = list()
+        pending = set(shard.index for shard in self._shards)
+        give_up = now + self._deadline
+        while (len(pending) > 0) and (time.monotonic() < give_up):
+            try:
+                index, cycle = self._done.get(timeout=0.01)
+                if cycle == self._cycle:
+                    pending.discard(index)
+            except queue.Empty:
+                pass
+            self._drain(results)
+        self._drain(results)
+        for index in pending:
+            self._logger.warning('Shard %d missed the %.1f second deadline.', index, self._deadline)
+        return results
+    def shutdown(self):
+        if self._shards is not None:
+            for shard in self._shards:
+                shard.stop()
+            self._shards = None
+        super().shutdown()
@@ -0,0 +1,294 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+from .logging import get_logger
+import asyncio
+import json
+import math
+import random
+import time
+
+# A stand-in for a fleet of OctoPrint servers.  One asyncio server answers
+# /api/printer and /api/job for every virtual printer; the X-Api-Key header
+# says which printer is asked.  Each printer wanders through Operational,
+# Printing, Paused, Offline (409 from /api/printer) and Unreachable (no answer
+# at all, so the collector times out), heats and cools its bed and tool, and
+# some printers have a bad password (401), a flaky proxy (502) or a slow
+# network.  time_scale > 1 makes everything happen faster.
+#
+# A refused connection is easy to get (point a printer at a closed port) but
+# a true ConnectTimeout needs an address that does not answer at all, which
+# loopback cannot provide; Unreachable printers produce ReadTimeouts.
+
+def simulated_printer_rows(count, address='127.0.0.1', port=5080):
+    # Rows in the form the printer loaders provide.
+    for i1 in range(count):
+        yield (i1+1, 'Sim{0}'.format(i1+1), '{0}:{1}'.format(address, port), 'SIM{0}'.format(i1+1), True)
+
+def simulated_collectors(collectors_class, count, address='127.0.0.1', port=5080, **kwargs):
+    # An instance of collectors_class (OctoPrintRawDataCollectors or one of
+    # its variations) loaded with the simulated printers.
+    class SimulatedCollectors(collectors_class):
+        def _load_collectors_from_memory(self, method):
+            for row in simulated_printer_rows(count, address, port):
+                method(row)
+    return SimulatedCollectors(None, **kwargs)
+
+class VirtualPrinter():
+    # How long each state lasts (seconds); a print lasts as long as its job.
+    Durations = {
+        'Operational': (30, 900),
+        'Printing': (600, 7200),
+        'Paused': (30, 600),
+        'Offline': (60, 900),
+        'Unreachable': (60, 600) }
+    Targets = {
+        'Operational': (0.0, 0.0),
+        'Printing': (60.0, 210.0),
+        'Paused': (60.0, 170.0),
+        'Offline': (0.0, 0.0),
+        'Unreachable': (0.0, 0.0) }
+    Ambient = 21.5
+    def __init__(self, number, seed=0, time_scale=1.0, timefunc=time.monotonic):
+        super().__init__()
+        self.number = number
+        self._random = random.Random(seed * 100003 + number)
+        self._time_scale = time_scale
+        self._timefunc = timefunc
+        r1 = self._random.random()
+        self.bad_password = r1 < 0.01
+        self.flaky = 0.01 <= r1 < 0.11
+        self.slow = 0.11 <= r1 < 0.16
+        self.latency = self._random.uniform(0.1, 1.0) if self.slow else self._random.uniform(0.001, 0.010)
+        self._started = self._now()
+        self._state = None
+        self._state_ends = 0.0
+        self._job = None
+        self._bed = VirtualPrinter.Ambient
+        self._tool = VirtualPrinter.Ambient
+        self._last_update = self._started
+        self._enter(self._random.choice(['Operational', 'Operational', 'Printing']), self._started)
+    def _now(self):
+        return self._timefunc() * self._time_scale
+    def _enter(self, state, now):
+        self._state = state
+        if state == 'Printing':
+            if self._job is None:
+                seconds = self._random.uniform(*VirtualPrinter.Durations['Printing'])
+                self._job = {
+                    'name': 'part{0:04d}.gcode'.format(self._random.randrange(10000)),
+                    'size': self._random.randrange(100000, 20000000),
+                    'date': int(time.time()) - self._random.randrange(86400 * 30),
+                    'estimated': seconds * self._random.uniform(0.8, 1.2),
+                    'length': self._random.uniform(500.0, 50000.0),
+                    'seconds': seconds,
+                    'printed': 0.0 }
+            remaining = self._job['seconds'] - self._job['printed']
+            if self._random.random() < 0.1:
+                # Paused somewhere along the way.
+                remaining *= self._random.random()
+            self._state_ends = now + remaining
+        else:
+            self._state_ends = now + self._random.uniform(*VirtualPrinter.Durations[state])
+    def _next_state(self):
+        r1 = self._random.random()
+        if self._state == 'Operational':
+            if r1 < 0.15:
+                return 'Offline'
+            if r1 < 0.20:
+                return 'Unreachable'
+            return 'Printing'
+        if self._state == 'Printing':
+            if self._job['printed'] < self._job['seconds'] - 0.001:
+                return 'Paused'
+            self._job = None
+            return 'Operational'
+        if self._state == 'Paused':
+            if r1 < 0.8:
+                return 'Printing'
+            self._job = None
+        return 'Operational'
+    def advance(self):
+        now = self._now()
+        while now >= self._state_ends:
+            mark = self._state_ends
+            self._account(mark)
+            self._enter(self._next_state(), mark)
+        self._account(now)
+    def _account(self, now):
+        # Temperatures approach their targets exponentially; printing time
+        # accumulates.
+        elapsed = now - self._last_update
+        if elapsed <= 0:
+            return
+        self._last_update = now
+        bed_target, tool_target = VirtualPrinter.Targets[self._state]
+        if bed_target == 0.0:
+            bed_target = VirtualPrinter.Ambient
+        if tool_target == 0.0:
+            tool_target = VirtualPrinter.Ambient
+        self._bed = bed_target + (self._bed - bed_target) * math.exp(-elapsed / 120.0)
+        self._tool = tool_target + (self._tool - tool_target) * math.exp(-elapsed / 40.0)
+        if (self._state == 'Printing') and (self._job is not None):
+            self._job['printed'] = min(self._job['printed'] + elapsed, self._job['seconds'])
+    @property
+    def state(self):
+        return self._state
+    def _temperature(self, actual, target):
+        return {'actual': round(actual + self._random.gauss(0.0, 0.2), 2), 'offset': 0, 'target': target}
+    def printer_body(self):
+        state = self._state
+        bed_target, tool_target = VirtualPrinter.Targets[state]
+        return {
+            'sd': {'ready': False},
+            'state': {
+                'flags': {
+                    'closedOrError': False,
+                    'error': False,
+                    'operational': True,
+                    'paused': state == 'Paused',
+                    'printing': state == 'Printing',
+                    'ready': state == 'Operational',
+                    'sdReady': False },
+                'text': state },
+            'temperature': {
+                'bed': self._temperature(self._bed, bed_target),
+                'tool0': self._temperature(self._tool, tool_target) } }
+    def job_body(self):
+        job = self._job
+        state = self._state if self._state != 'Unreachable' else 'Offline'
+        if job is None:
+            return {
+                'job': {
+                    'averagePrintTime': None, 'estimatedPrintTime': None, 'filament': None,
+                    'file': {'date': None, 'name': None, 'origin': None, 'path': None, 'size': None},
+                    'lastPrintTime': None },
+                'progress': {
+                    'completion': None, 'filepos': None, 'printTime': None,
+                    'printTimeLeft': None, 'printTimeLeftOrigin': None },
+                'state': state }
+        fraction = job['printed'] / job['seconds']
+        return {
+            'job': {
+                'averagePrintTime': None,
+                'estimatedPrintTime': job['estimated'],
+                'filament': {'tool0': {'length': job['length'], 'volume': job['length'] * 0.0024}},
+                'file': {'date': job['date'], 'name': job['name'], 'origin': 'local', 'path': job['name'], 'size': job['size']},
+                'lastPrintTime': None },
+            'progress': {
+                'completion': fraction * 100.0,
+                'filepos': int(job['size'] * fraction),
+                'printTime': int(job['printed']),
+                'printTimeLeft': int(job['seconds'] - job['printed']),
+                'printTimeLeftOrigin': 'estimate' },
+            'state': state }
+    def respond(self, verb):
+        # (delay, status, body); a status of None means never answer.
+        self.advance()
+        if self._state == 'Unreachable':
+            return (0.0, None, None)
+        if self.bad_password:
+            return (self.latency, 401, b'Invalid API key')
+        if self.flaky and (self._random.random() < 0.05):
+            return (self.latency, 502, b'<html><body><h1>502 Bad Gateway</h1></body></html>')
+        if verb == 'printer':
+            if self._state == 'Offline':
+                return (self.latency, 409, b'Printer is not operational')
+            return (self.latency, 200, json.dumps(self.printer_body()).encode('utf-8'))
+        if verb == 'job':
+            return (self.latency, 200, json.dumps(self.job_body()).encode('utf-8'))
+        return (self.latency, 404, b'Not Found')
+
+Reasons = {200: b'OK', 401: b'UNAUTHORIZED', 404: b'NOT FOUND', 409: b'CONFLICT', 502: b'Bad Gateway'}
+
+class OctoPrintSimulator():
+    def __init__(self, count, address='127.0.0.1', port=5080, seed=0, time_scale=1.0, hang=30.0):
+        super().__init__()
+        self._address = address
+        self._port = port
+        self._hang = hang
+        self._logger = get_logger(__name__)
+        self._printers = dict()
+        for i1 in range(count):
+            self._printers['SIM{0}'.format(i1+1)] = VirtualPrinter(i1+1, seed, time_scale)
+        self.requests = 0
+    def printer(self, api_key):
+        return self._printers.get(api_key, None)
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if request_line == b'':
+                    break
+                keep_alive = True
+                api_key = None
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    lower = line.lower()
+                    if lower.startswith(b'connection:') and (b'close' in lower):
+                        keep_alive = False
+                    elif lower.startswith(b'x-api-key:'):
+                        api_key = line[10:].strip().decode('ascii', 'replace')
+                self.requests += 1
+                parts = request_line.split()
+                path = parts[1].decode('ascii', 'replace') if len(parts) > 1 else ''
+                printer = self._printers.get(api_key, None)
+                if printer is None:
+                    delay, status, body = (0.0, 401, b'Invalid API key')
+                else:
+                    delay, status, body = printer.respond(path.rsplit('/', 1)[-1])
+                if status is None:
+                    await asyncio.sleep(self._hang)
+                    break
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                content_type = b'application/json' if status == 200 else b'text/html'
+                writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n' %
+                        (status, Reasons.get(status, b'Unknown'), content_type, len(body)))
+                writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self._address, self._port, backlog=4096)
+        self._logger.info('Simulating %d printers on %s:%d.', len(self._printers), self._address, self._port)
+        return self._server
+    def run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self.start())
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+def run_simulator(count, address='127.0.0.1', port=5080, seed=0, time_scale=1.0):
+    # Target for multiprocessing.Process so the simulator does not compete
+    # with the collectors for a core.
+    OctoPrintSimulator(count, address, port, seed, time_scale).run()
@@ -0,0 +1,159 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+from .logging import get_logger
+import collections
+import os
+import sys
+import threading
+import time
+
+# Profiles the running process on request.  Nothing runs while idle except a
+# check for the control file once per cycle.  When triggered, a thread
+# samples the stack of every other thread for the next few cycles and the
+# samples are written in the "folded" format flame graph tools read
+# (flamegraph.pl, speedscope, inferno):
+#   thread;outer (file.py:12);inner (file.py:34) count
+#
+# To trigger:  send SIGUSR2, or create the control file.  The control file
+# may contain the number of cycles to profile; it is removed once seen.
+
+def _frame_name(code):
+    return '{0} ({1}:{2})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+class SamplingProfiler():
+    def __init__(self, interval=0.005):
+        super().__init__()
+        self._interval = interval
+        self._stacks = collections.Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self.samples = 0
+    @property
+    def running(self):
+        return self._thread is not None
+    def start(self):
+        if self._thread is None:
+            self._stacks = collections.Counter()
+            self.samples = 0
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+            self._thread.start()
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self._stacks
+    def _run(self):
+        me = threading.get_ident()
+        names = dict()
+        while not self._stop.wait(self._interval):
+            for t1 in threading.enumerate():
+                names[t1.ident] = t1.name
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = list()
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stack.reverse()
+                self._stacks[';'.join(stack)] += 1
+            self.samples += 1
+    def write_folded(self, path):
+        with open(path, 'wt') as ouf:
+            for stack, count in sorted(self._stacks.items()):
+                ouf.write('{0} {1}\n'.format(stack, count))
+
+class OnDemandProfiler():
+    # Checks for a request every cycle seconds (the collection cadence) and
+    # profiles the following cycles cycles.  Folded stacks are written to
+    # directory as dmstl-profile-<UTC time>.folded.
+    def __init__(self, scheduler, cycle=5.0, cycles=6, control_file='dmstl.profile', signum=None, directory='.', interval=0.005):
+        super().__init__()
+        self._logger = get_logger(__name__)
+        self._cycles = cycles
+        self._control_file = control_file
+        self._directory = directory
+        self._profiler = SamplingProfiler(interval)
+        self._requested = None
+        self._remaining = 0
+        self.last_path = None
+        import signal
+        if signum is None:
+            signum = getattr(signal, 'SIGUSR2', None)
+        if signum is not None:
+            signal.signal(signum, self._on_signal)
+        scheduler.every(cycle, 1, self.tick, name='profiler')
+    def _on_signal(self, signum, frame):
+        # Only note the request; tick does the work.
+        self._requested = self._cycles
+    def request(self, cycles=None):
+        self._requested = cycles if cycles is not None else self._cycles
+    def _check_control_file(self):
+        path = self._control_file
+        if (path is None) or (not os.path.exists(path)):
+            return None
+        cycles = self._cycles
+        try:
+            with open(path, 'rt') as inf:
+                text = inf.read().strip()
+            if text != '':
+                cycles = int(text)
+        except (OSError, ValueError):
+            pass
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return cycles
+    def tick(self):
+        requested = self._requested
+        self._requested = None
+        if requested is None:
+            requested = self._check_control_file()
+        if self._profiler.running:
+            self._remaining -= 1
+            if self._remaining <= 0:
+                self._finish()
+        elif requested is not None:
+            self._remaining = requested
+            self._profiler.start()
+            self._logger.info('Profiling the next %d cycles.', requested)
+    def _finish(self):
+        self._profiler.stop()
+        name = 'dmstl-profile-{0}.folded'.format(time.strftime('%Y%m%d-%H%M%S', time.gmtime()))
+        path = os.path.join(self._directory, name)
+        try:
+            self._profiler.write_folded(path)
+        except OSError as exc:
+            # Losing a profile must not take the collector down with it.
+            self._logger.error('Unable to write the profile to %s: %s', path, exc)
+            return
+        self.last_path = path
+        self._logger.info('Wrote %d samples to %s.', self._profiler.samples, path)
+    def shutdown(self):
+        if self._profiler.running:
+            self._finish()
@@ -43,6 +43,11 @@ class RawDataCollector():
     @property
     def name(self):
         return ''
+    @property
+    def row(self):
+        # The configuration row the collector was created from, or None if
+        # it cannot be kept across a reload.
+        return None
     def shutdown(self):
         pass
 
@@ -75,6 +80,30 @@ class RawDataCollectors():
             self._load_collectors_from_memory(self._load_collector)
     def _load_collectors_from_memory(self, method):
         assert False
+    def reload(self):
+        # Pick up printers that have been added, removed or changed.  A
+        # collector whose row has not changed is kept, along with whatever it
+        # has built up (connections, what it last saw); the others are
+        # retired.
+        previous = self._container
+        self._container = indexed.IndexedOrderedDict()
+        try:
+            self._load_collectors()
+        except:
+            self._container = previous
+            raise
+        kept = set()
+        for name, c1 in self._container.items():
+            p1 = previous.get(name, None)
+            if (p1 is not None) and (p1.row is not None) and (p1.row == c1.row):
+                self._container[name] = p1
+                kept.add(id(p1))
+        for c1 in previous.values():
+            if id(c1) not in kept:
+                self._retire(c1)
+    def _retire(self, collector):
+        # Called for a collector dropped by reload.
+        collector.shutdown()
     def __iter__(self):
         if self._need_load:
             self._load_collectors()
@@ -20,20 +20,34 @@
 # SOFTWARE.
 #
 
+import threading
+
 from .singleton import Singleton
+from .metrics import increment
+from .timing import stage_timer
 
 class RedundantStringsBase:
     def __init__(self):
         if not hasattr(self, '_string_to_id'):
             self._string_to_id = dict()
+            self._miss_lock = threading.Lock()
     def _insert_select_string(self, key):
         assert(False)
         return 0
     def get_id(self, key):
+        # Hits are a plain dict lookup.  Misses are serialized so field maps
+        # shared by several mapping threads insert each string only once.
         rv = self._string_to_id.get(key)
         if rv is None:
-            rv = self._insert_select_string(key)
-            self._string_to_id[key] = rv
+            with self._miss_lock:
+                rv = self._string_to_id.get(key)
+                if rv is None:
+                    increment('dmstl_redundant_strings_total', result='miss')
+                    with stage_timer('string miss'):
+                        rv = self._insert_select_string(key)
+                    self._string_to_id[key] = rv
+                    return rv
+        increment('dmstl_redundant_strings_total', result='hit')
         return rv
     def reset(self):
         del self._string_to_id
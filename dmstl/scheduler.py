@@ -20,30 +20,210 @@
 # SOFTWARE.
 #
 
+from .stats import Histogram
+import concurrent.futures
+import enum
 import math
 import sched
+import threading
 import time
 
-class RepeatingEvent(sched.Event):
+class OverrunPolicy(enum.Enum):
+    # What to do when a repeating action runs past its next tick.
+    DRIFT = 1     # next run is a period after the action finishes
+    SKIP = 2      # missed ticks are dropped; stay on the original grid
+    CATCH_UP = 3  # every missed tick runs, back to back
+    COALESCE = 4  # one run right away stands in for all missed ticks
+
+class RepeatingEventStatistics():
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+        self.runs = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.lateness = Histogram()
+        self.duration = Histogram()
+    def __str__(self):
+        return '{0}: runs={1} overruns={2} skipped={3} coalesced={4} lateness[{5}] duration[{6}]'.format(
+                self.name, self.runs, self.overruns, self.skipped, self.coalesced, self.lateness, self.duration)
+
+class RepeatingEvent:
+    def __init__(self, frequency, priority, action, argument, kwargs, policy=OverrunPolicy.DRIFT, name=None):
+        super().__init__()
+        self.frequency = frequency
+        self.priority = priority
+        self.action = action
+        self.argument = argument
+        self.kwargs = kwargs
+        self.policy = policy
+        self.due = None
+        self.stopped = False
+        if name is None:
+            name = getattr(action, '__qualname__', repr(action))
+        self.statistics = RepeatingEventStatistics(name)
+    def get_frequency(self):
+        # frequency can be a number or something to call for a number.
+        if callable(self.frequency):
+            return self.frequency()
+        return self.frequency
+    def get_next(self, scheduler, finished):
+        stats = self.statistics
+        frequency = self.get_frequency()
+        nominal = self.due + frequency
+        if finished <= nominal:
+            if self.policy == OverrunPolicy.DRIFT:
+                return scheduler.get_next(frequency)
+            return nominal
+        stats.overruns += 1
+        missed = int((finished - nominal) // frequency)
+        if self.policy == OverrunPolicy.SKIP:
+            stats.skipped += missed + 1
+            return nominal + (missed + 1) * frequency
+        elif self.policy == OverrunPolicy.CATCH_UP:
+            return nominal
+        elif self.policy == OverrunPolicy.COALESCE:
+            # Due at the last missed tick, which is in the past, so it runs
+            # right away and the grid carries on after it.
+            stats.coalesced += missed
+            return nominal + missed * frequency
+        return scheduler.get_next(frequency)
     def thunk(self, scheduler):
         # NOTE: If action raises an exception it will not be rescheduled.
+        if self.stopped:
+            return
+        stats = self.statistics
+        started = scheduler.timefunc()
+        stats.lateness.add(max(0.0, started - self.due))
         self.action(*self.argument, **self.kwargs)
-        next = scheduler.get_next(self.time)
-        scheduler.enterabs(next, self.priority, self.thunk, argument=(scheduler,))
+        finished = scheduler.timefunc()
+        stats.runs += 1
+        stats.duration.add(finished - started)
+        self.due = self.get_next(scheduler, finished)
+        scheduler.enterabs(self.due, self.priority, self.thunk, argument=(scheduler,))
 
 class ToolLogsScheduler(sched.scheduler):
     def __init__(self, timefunc=time.time, delayfunc=time.sleep):
         super().__init__(timefunc, delayfunc)
-    def every(self, frequency, priority, action, argument=(), kwargs=sched._sentinel):
+        self._repeating_events = list()
+    def every(self, frequency, priority, action, argument=(), kwargs=sched._sentinel, policy=OverrunPolicy.DRIFT, name=None):
         if kwargs is sched._sentinel:
             kwargs = {}
-        repeating_event = RepeatingEvent(frequency, priority, action, argument, kwargs)
+        repeating_event = RepeatingEvent(frequency, priority, action, argument, kwargs, policy, name)
+        self._repeating_events.append(repeating_event)
         # Schedule the first run within the next seconds
         next = self.get_next(1)  # rmv self.get_next(frequency)
+        repeating_event.due = next
         return self.enterabs(next, priority, repeating_event.thunk, argument=(self,))
+    def stop(self, event):
+        # Ends a repetition; event is what every() returned.  The pending
+        # run is left in the queue and does nothing.
+        repeating_event = event.action.__self__
+        repeating_event.stopped = True
+        if repeating_event in self._repeating_events:
+            self._repeating_events.remove(repeating_event)
+    def statistics(self):
+        return [r1.statistics for r1 in self._repeating_events]
     def get_next(self, frequency):
         mark = self.timefunc()
         fraction, whole = math.modf(mark+0.5)
         next = whole + frequency
         return next
 
+
+class DispatchedRepeatingEvent(RepeatingEvent):
+    # The timer only hands the action to an executor and reschedules, so a
+    # slow action never delays other timers.  At most max_in_flight runs of
+    # the action are outstanding; a tick that finds the limit reached is
+    # skipped.
+    def __init__(self, frequency, priority, action, argument, kwargs, name, executor, max_in_flight):
+        super().__init__(frequency, priority, action, argument, kwargs, OverrunPolicy.SKIP, name)
+        self._executor = executor
+        self._max_in_flight = max_in_flight
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._failure = None
+    def _run(self, scheduler):
+        stats = self.statistics
+        began = scheduler.timefunc()
+        try:
+            self.action(*self.argument, **self.kwargs)
+        except BaseException as exc:
+            self._failure = exc
+        finished = scheduler.timefunc()
+        with self._lock:
+            self._in_flight -= 1
+            stats.runs += 1
+            stats.duration.add(finished - began)
+    def thunk(self, scheduler):
+        # NOTE: As with RepeatingEvent, an exception from the action ends the
+        # repetition.  It is raised on the scheduling thread at the next tick.
+        if self.stopped:
+            return
+        failure = self._failure
+        if failure is not None:
+            self._failure = None
+            raise failure
+        stats = self.statistics
+        started = scheduler.timefunc()
+        with self._lock:
+            stats.lateness.add(max(0.0, started - self.due))
+            if self._in_flight < self._max_in_flight:
+                self._in_flight += 1
+                dispatch = True
+            else:
+                stats.overruns += 1
+                stats.skipped += 1
+                dispatch = False
+        if dispatch:
+            self._executor.submit(self._run, scheduler)
+        frequency = self.get_frequency()
+        next = self.due + frequency
+        if next <= started:
+            missed = int((started - next) // frequency) + 1
+            stats.skipped += missed
+            next += missed * frequency
+        self.due = next
+        scheduler.enterabs(self.due, self.priority, self.thunk, argument=(scheduler,))
+
+class DispatchingToolLogsScheduler(ToolLogsScheduler):
+    # Jobs registered with every() run on executor (a thread pool unless
+    # another is supplied).  One-off events from enter() and enterabs(), such
+    # as the prattlers, still run on the scheduling thread; they are quick.
+    # Dispatched actions may run at the same time as each other so they have
+    # to be thread safe.
+    def __init__(self, executor=None, max_workers=4, timefunc=time.time):
+        self._condition = threading.Condition()
+        super().__init__(timefunc, self._wait)
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._executor = executor
+    def _wait(self, delay):
+        # Wakes early if another thread enters an event; run() then looks
+        # at the queue again.  The delay run() worked out is checked against
+        # the queue under the condition enterabs notifies on, so an event
+        # entered in between is not slept through.
+        with self._condition:
+            queue = self._queue
+            if len(queue) > 0:
+                delay = min(delay, queue[0].time - self.timefunc())
+            if delay > 0:
+                self._condition.wait(delay)
+    def enterabs(self, time, priority, action, argument=(), kwargs=sched._sentinel):
+        rv = super().enterabs(time, priority, action, argument, kwargs)
+        with self._condition:
+            self._condition.notify_all()
+        return rv
+    # policy is accepted for compatibility; a dispatched job always skips
+    # ticks it cannot keep up with.
+    def every(self, frequency, priority, action, argument=(), kwargs=sched._sentinel, policy=None, name=None, max_in_flight=1):
+        if kwargs is sched._sentinel:
+            kwargs = {}
+        repeating_event = DispatchedRepeatingEvent(frequency, priority, action, argument, kwargs, name, self._executor, max_in_flight)
+        self._repeating_events.append(repeating_event)
+        next = self.get_next(1)
+        repeating_event.due = next
+        return self.enterabs(next, priority, repeating_event.thunk, argument=(self,))
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
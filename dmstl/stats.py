@@ -0,0 +1,69 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import bisect
+
+class Histogram():
+    # Fixed buckets; each count is for values up to and including the bound.
+    # The last count is for everything larger than the last bound.
+    Bounds = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    def __init__(self, bounds=None):
+        super().__init__()
+        self.bounds = tuple(bounds) if bounds is not None else Histogram.Bounds
+        self.reset()
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+    def merge(self, other):
+        # Add the values of another histogram with the same bounds.
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        if other.max > self.max:
+            self.max = other.max
+        return self
+    def copy(self):
+        return Histogram(self.bounds).merge(self)
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count > 0 else 0.0
+    def percentile(self, fraction):
+        # The bound of the bucket holding the given fraction of the values.
+        target = fraction * self.count
+        running = 0
+        for bound, count in zip(self.bounds, self.counts):
+            running += count
+            if (running >= target) and (running > 0):
+                return bound
+        return self.max
+    def __str__(self):
+        return 'n={0} mean={1:.6f} p50<={2} p99<={3} max={4:.6f}'.format(
+                self.count, self.mean, self.percentile(0.50), self.percentile(0.99), self.max)
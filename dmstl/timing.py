@@ -0,0 +1,152 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+from .logging import get_logger
+from .stats import Histogram
+from .trace import emit_span, tracing
+import threading
+import time
+
+# Latency of each stage of the poll-to-insert pipeline, per printer.  The
+# stages are:
+#   http        an OctoPrint request (including timeouts)
+#   decode      OctoPrintRawDataCollected.set_request (mostly JSON decoding)
+#   map         JsonValueToDatabaseFieldMaps.update for one sample
+#   deadband    DeadbandCheckers.alive
+#   insert      DatabaseInterface.execute / executemany of RAW_DATA rows
+#   commit      DatabaseInterface.commit after the insert
+#   string miss RedundantStrings.get_id going to the database
+#   crunch      OctoPrintRawDataCruncher.crunch_the_data
+#   tweet       TwitterThreadUpdateStatus on the TwitterThread
+#   cycle       one OctoPrintRawDataCollectors.get_fresh_data
+# Samples with no particular printer (a batch insert, a string miss) are
+# recorded against printer None.  While tracing is enabled (trace.py) each
+# timed stage also writes a span.
+
+# Most stages take well under a millisecond.
+Bounds = (0.00005, 0.0001, 0.00025, 0.0005) + Histogram.Bounds
+
+_enabled = True
+_lock = threading.Lock()
+_histograms = dict()
+
+def enable_stage_timing(enabled=True):
+    global _enabled
+    _enabled = enabled
+
+def record_stage(stage, printer_id, seconds):
+    key = (stage, printer_id)
+    with _lock:
+        histogram = _histograms.get(key, None)
+        if histogram is None:
+            histogram = Histogram(Bounds)
+            _histograms[key] = histogram
+        histogram.add(seconds)
+
+class stage_timer():
+    # with stage_timer('map', printer_id): ...  The span goes to trace_id if
+    # given (coroutines share a thread), else to the current trace.
+    __slots__ = ('_stage', '_printer_id', '_trace_id', '_start', '_wall')
+    def __init__(self, stage, printer_id=None, trace_id=None):
+        self._stage = stage
+        self._printer_id = printer_id
+        self._trace_id = trace_id
+        self._start = None
+        self._wall = None
+    def __enter__(self):
+        if tracing():
+            self._wall = time.time()
+            self._start = time.perf_counter()
+        elif _enabled:
+            self._start = time.perf_counter()
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._start is not None:
+            elapsed = time.perf_counter() - self._start
+            if _enabled:
+                record_stage(self._stage, self._printer_id, elapsed)
+            if self._wall is not None:
+                emit_span(self._stage, self._printer_id, self._wall, elapsed, self._trace_id)
+        return False
+
+def stage_statistics(stage=None, printer_id=None):
+    # A copy of the histograms as {(stage, printer_id): Histogram}, optionally
+    # only those for one stage and/or one printer.
+    rv = dict()
+    with _lock:
+        for (s1, p1), h1 in _histograms.items():
+            if ((stage is None) or (s1 == stage)) and ((printer_id is None) or (p1 == printer_id)):
+                rv[(s1, p1)] = h1.copy()
+    return rv
+
+def reset_stage_statistics():
+    with _lock:
+        _histograms.clear()
+
+def stage_summary(by_printer=False):
+    # One line per stage (all printers combined) or per stage and printer.
+    combined = dict()
+    for (stage, printer_id), h1 in stage_statistics().items():
+        key = (stage, printer_id) if by_printer else (stage, None)
+        h2 = combined.get(key, None)
+        if h2 is None:
+            h2 = Histogram(h1.bounds)
+            combined[key] = h2
+        h2.merge(h1)
+    lines = list()
+    for (stage, printer_id), h1 in sorted(combined.items(), key=lambda i1: (i1[0][0], str(i1[0][1]))):
+        if by_printer:
+            lines.append('{0} [{1}]: {2}'.format(stage, printer_id, h1))
+        else:
+            lines.append('{0}: {1}'.format(stage, h1))
+    return '\n'.join(lines)
+
+def log_stage_summary(by_printer=False):
+    get_logger(__name__).info('Stage latencies:\n%s', stage_summary(by_printer))
+
+_summary_requested = False
+
+def _request_summary(signum, frame):
+    # Only note the request.  The handler can interrupt record_stage while
+    # it holds _lock, so taking the lock here would deadlock.
+    global _summary_requested
+    _summary_requested = True
+
+def _log_requested_summary():
+    global _summary_requested
+    if _summary_requested:
+        _summary_requested = False
+        log_stage_summary()
+
+def log_stage_summary_on_signal(scheduler, signum=None, every=1.0):
+    # Log the summary soon after the process receives signum (SIGUSR1 by
+    # default); a job on scheduler checks for the request every every
+    # seconds.  Does nothing where there is no such signal.
+    import signal
+    if signum is None:
+        signum = getattr(signal, 'SIGUSR1', None)
+        if signum is None:
+            return False
+    signal.signal(signum, _request_summary)
+    scheduler.every(every, 1, _log_requested_summary, name='stage summary')
+    return True
@@ -0,0 +1,102 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import threading
+
+# Correlation ids and spans.  While tracing is enabled every collection cycle
+# gets an id and every sample in it gets "<cycle id>.<printer id>".  The
+# sample's id travels with OctoPrintRawDataCollected (trace_id) and is made
+# current, per thread, by traced() wherever the sample is worked on; the
+# stage timers then write one JSON line per stage:
+#   {"trace":"5f2a1c-17.42","span":"insert","printer":42,"start":1508000000.123456,"duration":0.000412}
+# Tweets queued while a sample is current carry its id to the TwitterThread.
+# While tracing is disabled trace ids are None and traced() does nothing.
+
+_handler = None
+_local = threading.local()
+_cycles = itertools.count(1)
+_prefix = '{0:x}'.format(os.getpid())
+
+def enable_tracing(path='dmstl_trace.jsonl', max_bytes=16*1024*1024, backup_count=5):
+    # The spans go straight to a rotating file handler; they are not log
+    # messages and should not reach RawDataLogger.log.
+    global _handler
+    disable_tracing()
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    _handler = handler
+
+def disable_tracing():
+    global _handler
+    handler = _handler
+    _handler = None
+    if handler is not None:
+        handler.close()
+
+def tracing():
+    return _handler is not None
+
+def new_cycle_id():
+    if _handler is None:
+        return None
+    return '{0}-{1}'.format(_prefix, next(_cycles))
+
+def sample_id(cycle_id, printer_id):
+    if cycle_id is None:
+        return None
+    return '{0}.{1}'.format(cycle_id, printer_id)
+
+def current_trace_id():
+    return getattr(_local, 'trace_id', None)
+
+class traced():
+    # with traced(collected.trace_id): ... makes the id current.
+    __slots__ = ('_trace_id', '_previous')
+    def __init__(self, trace_id):
+        self._trace_id = trace_id
+        self._previous = None
+    def __enter__(self):
+        if self._trace_id is not None:
+            self._previous = getattr(_local, 'trace_id', None)
+            _local.trace_id = self._trace_id
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._trace_id is not None:
+            _local.trace_id = self._previous
+        return False
+
+def emit_span(span, printer_id, start, duration, trace_id=None, **extra):
+    handler = _handler
+    if handler is None:
+        return
+    if trace_id is None:
+        trace_id = getattr(_local, 'trace_id', None)
+    record = {'trace': trace_id, 'span': span, 'printer': printer_id, 'start': round(start, 6), 'duration': round(duration, 6)}
+    if extra:
+        record.update(extra)
+    handler.handle(logging.makeLogRecord({'msg': json.dumps(record, separators=(',', ':'))}))
@@ -21,6 +21,9 @@
 #
 
 import dmstl
+from dmstl.metrics import watch_twitter_thread
+from dmstl.timing import stage_timer
+from dmstl.trace import current_trace_id, traced
 from dmstl.uniquifier import Uniquifier
 # rmv  import logging
 import queue
@@ -66,10 +69,13 @@ class TwitterThreadUpdateStatus(TwitterThreadWork):
         super().__init__()
         self._text = tidy_tweet_text(text)
         self._make_unique = make_unique
+        # The sample that led to this tweet, if tracing.
+        self.trace_id = current_trace_id()
     def __str__(self):
         return 'update status to "%s"' % self._text
     def do_work(self, thread):
-        thread._update_status(self._text, self._make_unique)
+        with traced(self.trace_id), stage_timer('tweet'):
+            thread._update_status(self._text, self._make_unique)
 
 class TwitterThread(threading.Thread):
     def __init__(self, name, credentials):
@@ -81,7 +87,11 @@ class TwitterThread(threading.Thread):
         self._queue = queue.Queue()
         self._terminated = False
         self._uniquifier = Uniquifier()
+        watch_twitter_thread(self)
         self.start()
+    @property
+    def depth(self):
+        return self._queue.qsize()
     def add_work(self, work):
         self._queue.put_nowait(work)
     def run(self):
@@ -168,4 +178,8 @@ class TwitterNull():
     def update_status(self, text):
         pass
 
-
+class TwitterCredentialsLoadNone():
+    # For runs that must never tweet (benchmarks, replays): every printer
+    # gets a TwitterNull.
+    def get_credentials(self, id):
+        return None
@@ -0,0 +1,97 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+from .logging import get_logger
+import os
+import threading
+
+# JSON paths no field map asked for, with how often each was seen.  A path
+# is logged the first time it is seen and only counted after that; the
+# counts are logged as a summary now and then.  Paths in the ignore list are
+# counted but never logged.  With learn=True every new path is added to the
+# ignore list (and its file), so the next run is quiet about it.
+
+_lock = threading.Lock()
+_counts = dict()
+_ignored = set()
+_ignore_file = None
+_learn = False
+_reported = 0
+
+def note_unrecognized_path(path, value):
+    with _lock:
+        count = _counts.get(path, 0)
+        _counts[path] = count + 1
+        if (count > 0) or (path in _ignored):
+            return
+        if _learn:
+            _ignored.add(path)
+            if _ignore_file is not None:
+                with open(_ignore_file, 'a') as f1:
+                    f1.write(path + '\n')
+    get_logger(__name__).warning('Unrecognized path %s with value %s', path, value)
+
+def load_ignore_list(path, learn=False):
+    # Read the paths to ignore, one per line, from the file at path (if it
+    # exists).  With learn=True new paths are appended to it.
+    global _ignore_file, _learn
+    paths = set()
+    if os.path.exists(path):
+        with open(path) as f1:
+            paths = set(l1.strip() for l1 in f1 if l1.strip() != '')
+    with _lock:
+        _ignored.update(paths)
+        _ignore_file = path
+        _learn = learn
+    return len(paths)
+
+def unrecognized_paths():
+    # A copy of the counts as {path: count}.
+    with _lock:
+        return dict(_counts)
+
+def reset_unrecognized_paths():
+    global _reported
+    with _lock:
+        _counts.clear()
+        _reported = 0
+
+def unrecognized_summary():
+    # One line per path, most often seen first.
+    lines = list()
+    for path, count in sorted(unrecognized_paths().items(), key=lambda i1: (-i1[1], i1[0])):
+        lines.append('{0}: {1}'.format(path, count))
+    return '\n'.join(lines)
+
+def log_unrecognized_summary():
+    # Logs the summary if anything was seen since the last one.
+    global _reported
+    with _lock:
+        total = sum(_counts.values())
+        if total == _reported:
+            return
+        _reported = total
+    get_logger(__name__).info('Unrecognized paths (%d seen):\n%s', total, unrecognized_summary())
+
+def log_unrecognized_summary_every(scheduler, seconds=3600.0, priority=1):
+    return scheduler.every(seconds, priority, log_unrecognized_summary, name='unrecognized paths')
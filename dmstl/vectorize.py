@@ -0,0 +1,195 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+# Converting the raw values of many samples a column at a time with NumPy,
+# for replay, backfill and other bulk work.  Needs NumPy, which the
+# collector itself does not; dmstl/__init__ does not import this module.
+#
+#   raw = RawColumns(maps.schema())
+#   for sample in samples:
+#       raw.new_row()
+#       raw.update('PRINTER', sample['PRINTER'])
+#   columns = raw.convert()
+#
+# A value converts as the field map's convert would convert it, and a value
+# is null where is_null would say so (the raw value, or what convert made
+# of it, is None).  Values convert cannot convert, or that do not fit the
+# column's type (ints beyond 64 bits), are null and flagged in invalid
+# instead of raising.
+
+from .map import JsonValueToBooleanFieldMap, JsonValueToIntFieldMap, JsonValueToFloatFieldMap, JsonValueToStringIdFieldMap, PrinterIdFieldMap, HttpStatusFieldMap
+import collections
+import numpy
+
+Column = collections.namedtuple('Column', 'values nulls invalid')
+
+_missing = object()
+
+def _dtype(field_map):
+    # The dtype NumPy can convert to directly, or None when each distinct
+    # value has to go through the field map's convert.
+    if isinstance(field_map, JsonValueToStringIdFieldMap):
+        return None
+    if isinstance(field_map, JsonValueToFloatFieldMap):
+        return numpy.float64
+    if isinstance(field_map, (JsonValueToIntFieldMap, PrinterIdFieldMap, HttpStatusFieldMap)):
+        return numpy.int64
+    if isinstance(field_map, JsonValueToBooleanFieldMap):
+        return numpy.bool_
+    return None
+
+def _column_dtype(field_map):
+    typecode = field_map.column_typecode()
+    if typecode == 'd':
+        return numpy.float64
+    if typecode == 'q':
+        return numpy.int64
+    if typecode == 'b':
+        return numpy.bool_
+    return object
+
+def _convert_each(field_map, raw, nulls, dtype):
+    # One convert per distinct value, into a list that becomes the array at
+    # the end; setting array elements one at a time is much slower.  Object
+    # columns, and anything convert or the dtype will not take, go value by
+    # value instead.
+    if dtype is not object:
+        cache = dict()
+        convert = field_map.convert
+        values = list()
+        try:
+            for v1, n1 in zip(raw.tolist(), nulls.tolist()):
+                if n1:
+                    values.append(0)
+                    continue
+                # The type is part of the key since True == 1 but str(True) != str(1).
+                key = (type(v1), v1)
+                v2 = cache.get(key, _missing)
+                if v2 is _missing:
+                    v2 = convert(v1)
+                    cache[key] = v2
+                values.append(v2)
+            if None not in values:
+                return Column(numpy.array(values, dtype=dtype), nulls, numpy.zeros(len(raw), dtype=numpy.bool_))
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return _convert_each_value(field_map, raw, nulls, dtype)
+
+def _convert_each_value(field_map, raw, nulls, dtype):
+    # As _convert_each, a value at a time so a value that cannot be
+    # converted only makes itself invalid.
+    values = numpy.zeros(len(raw), dtype=dtype)
+    invalid = numpy.zeros(len(raw), dtype=numpy.bool_)
+    cache = dict()
+    for i1, v1 in enumerate(raw):
+        if nulls[i1]:
+            continue
+        try:
+            key = (type(v1), v1)
+            try:
+                v2 = cache[key]
+            except KeyError:
+                v2 = field_map.convert(v1)
+                cache[key] = v2
+            except TypeError:
+                v2 = field_map.convert(v1)
+            if v2 is None:
+                nulls[i1] = True
+            else:
+                values[i1] = v2
+        except (TypeError, ValueError, OverflowError):
+            nulls[i1] = True
+            invalid[i1] = True
+    return Column(values, nulls, invalid)
+
+def _convert_floats(raw, missing):
+    # None when something in raw is not a number.  NumPy is slow to turn
+    # None into NaN, so missing values are filled in first.
+    if missing > 0:
+        nulls = numpy.array([v1 is None for v1 in raw], dtype=numpy.bool_)
+        raw = [0.0 if v1 is None else v1 for v1 in raw]
+    else:
+        nulls = numpy.zeros(len(raw), dtype=numpy.bool_)
+    try:
+        values = numpy.array(raw, dtype=numpy.float64)
+    except (TypeError, ValueError):
+        return None
+    if values.shape != (len(raw),):
+        return None
+    return Column(values, nulls, numpy.zeros(len(raw), dtype=numpy.bool_))
+
+def convert_column(field_map, raw):
+    # Converts a sequence of raw values (None for missing) for field_map.
+    # Returns a Column of values, nulls and invalid arrays; values is zero
+    # where nulls is True.
+    if not isinstance(raw, list):
+        raw = list(raw)
+    missing = raw.count(None)
+    if missing == len(raw):
+        # Common for the job columns of idle printers.
+        return Column(numpy.zeros(len(raw), dtype=_column_dtype(field_map)),
+                numpy.ones(len(raw), dtype=numpy.bool_), numpy.zeros(len(raw), dtype=numpy.bool_))
+    dtype = _dtype(field_map)
+    if dtype is numpy.float64:
+        column = _convert_floats(raw, missing)
+        if column is not None:
+            return column
+    objects = numpy.empty(len(raw), dtype=object)
+    objects[:] = raw
+    nulls = numpy.equal(objects, None)
+    if dtype is None:
+        return _convert_each(field_map, objects, nulls, _column_dtype(field_map))
+    objects[nulls] = 0
+    try:
+        values = objects.astype(dtype)
+    except (TypeError, ValueError, OverflowError):
+        return _convert_each(field_map, objects, nulls, dtype)
+    return Column(values, nulls, numpy.zeros(len(raw), dtype=numpy.bool_))
+
+class RawColumns:
+    # The unconverted values of many samples, a list per field, filled
+    # through the same new_row/assign/set/update interface as FieldColumns.
+    def __init__(self, schema):
+        super().__init__()
+        self._schema = schema
+        self._columns = tuple(list() for f1 in schema.fields)
+        self.row = -1
+    @property
+    def schema(self):
+        return self._schema
+    def __len__(self):
+        return self.row + 1
+    def new_row(self):
+        for c1 in self._columns:
+            c1.append(None)
+        self.row += 1
+        return self.row
+    def assign(self, index, value):
+        self._columns[index][self.row] = value
+    def set(self, field_map, value):
+        self.assign(self._schema.index(field_map), value)
+    def update(self, prefix, json):
+        self._schema.walk(self.assign, prefix, json)
+    def convert(self):
+        # A Column per field, in schema order.
+        return [convert_column(f1, c1) for f1, c1 in zip(self._schema.fields, self._columns)]
@@ -0,0 +1,241 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+# Micro and macro benchmarks for the poll-to-insert pipeline.  Results are
+# written as JSON so two versions can be compared.
+#
+# "C:\Python36\python" dmstl_bench.py run dmstl_bench.json
+# "C:\Python36\python" dmstl_bench.py compare before.json after.json
+
+import dmstl
+import dmstl.opsim
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from dmstl.errors import ReadTimeout
+from dmstl.opcruncher import OctoPrintModel, DeviceState, NetworkState
+from dmstl.oplog import OctoPrintRawDataMaps, OctoPrintDeadbandCheckers, OctoPrintRawDataLogger
+from dmstl.opraw import OctoPrintRawDataCollector, OctoPrintRawDataCollectorConfiguration
+from dmstl.oprecord import RecordedResponse
+from dmstl.rsb import RedundantStringsBase
+from dmstl.twitter import tidy_tweet_text
+
+def measure(name, function, number, repeat=5):
+    # Seconds per call: the best and the median of repeat runs of number
+    # calls each.
+    function()
+    runs = list()
+    for i1 in range(repeat):
+        started = time.perf_counter()
+        for i2 in range(number):
+            function()
+        runs.append((time.perf_counter() - started) / number)
+    result = {'name': name, 'number': number, 'repeat': repeat, 'best': min(runs), 'median': statistics.median(runs)}
+    print('{0:32s} {1:12.3f} us best {2:12.3f} us median'.format(name, result['best'] * 1e6, result['median'] * 1e6))
+    return result
+
+class RedundantStringsCounter(RedundantStringsBase):
+    # Hands out ids without a database so only get_id itself is measured.
+    def __init__(self):
+        super().__init__()
+        self._current_id = 0
+    def _insert_select_string(self, key):
+        self._current_id += 1
+        return self._current_id
+
+def sample_bodies():
+    printer = dmstl.opsim.VirtualPrinter(3, time_scale=1.0, timefunc=lambda: 0.0)
+    while printer.state != 'Printing':
+        printer = dmstl.opsim.VirtualPrinter(printer.number + 1, timefunc=lambda: 0.0)
+    return printer.printer_body(), printer.job_body()
+
+def micro_benchmarks():
+    results = list()
+    printer_json, job_json = sample_bodies()
+    rs = RedundantStringsCounter()
+    maps = OctoPrintRawDataMaps(rs)
+    def update():
+        maps.reset()
+        maps.update('PRINTER', printer_json)
+        maps.update('JOB', job_json)
+    results.append(measure('map.update', update, 20000))
+    # A printer with plugins sends a lot that is not mapped.
+    plugins = dict(printer_json, plugins={'plugin{0}'.format(i1): i1 for i1 in range(50)})
+    schema = maps.schema()
+    results.append(measure('schema.update 50 unknown', lambda: schema.new_values().update('PRINTER', plugins), 20000))
+    maps.report_unrecognized = False
+    results.append(measure('schema.update 50 unknown once', lambda: schema.new_values().update('PRINTER', plugins), 20000))
+    maps.report_unrecognized = True
+    maps.set_printer_id(1)
+    maps.set_http_status(200, None)
+    update()
+    results.append(measure('map.generate_value_tuple', maps.generate_value_tuple, 50000))
+    schema = maps.schema()
+    def update_values():
+        values = schema.new_values()
+        values.update('PRINTER', printer_json)
+        values.update('JOB', job_json)
+        return values
+    results.append(measure('schema.update', update_values, 20000))
+    values = update_values()
+    results.append(measure('values.generate_value_tuple', values.generate_value_tuple, 50000))
+    dbcs = OctoPrintDeadbandCheckers(maps)
+    # Until the first commit DeadbandCheckerDoOnce answers alive by itself.
+    dbcs.commit()
+    results.append(measure('deadband.alive', dbcs.alive, 50000))
+    results.append(measure('deadband.commit', dbcs.commit, 50000))
+    rs.get_id('Printing')
+    results.append(measure('rs.get_id hit', lambda: rs.get_id('Printing'), 200000))
+    misses = iter(range(10**9))
+    results.append(measure('rs.get_id miss', lambda: rs.get_id(str(next(misses))), 200000))
+    scheduler = dmstl.ToolLogsScheduler()
+    model = OctoPrintModel(1, 'Bench', None, scheduler)
+    model.update_network_state(NetworkState.GOOD)
+    states = iter(DeviceState.BUSY if (i1 % 2) == 0 else DeviceState.IDLE for i1 in range(10**9))
+    def transition():
+        model._device_state_current = next(states)
+        model.update_if_not_frozen()
+    results.append(measure('model.update_if_not_frozen', transition, 20000))
+    model.shutdown()
+    text = 'Done! Another fine thing brought to you by your favourite Prattle Printer! ' * 2
+    results.append(measure('tidy_tweet_text', lambda: tidy_tweet_text(text, ' #3DPrinting', ' #Prattle'), 100000))
+    return results
+
+def convert_benchmarks(count=1000):
+    # Converting the raw values of count samples: one convert per value, as
+    # FieldColumns does while mapping, against a column at a time with
+    # NumPy (dmstl.vectorize).  Skipped without NumPy.
+    try:
+        from dmstl.vectorize import RawColumns
+    except ImportError:
+        return []
+    maps = OctoPrintRawDataMaps(RedundantStringsCounter())
+    schema = maps.schema()
+    raw = RawColumns(schema)
+    for number in range(1, count+1):
+        printer = dmstl.opsim.VirtualPrinter(number, timefunc=lambda number=number: number * 97.0)
+        raw.new_row()
+        raw.update('PRINTER', printer.printer_body())
+        raw.update('JOB', printer.job_body())
+    columns = list(zip(schema._converters, raw._columns))
+    def each():
+        return [[None if v1 is None else convert(v1) for v1 in values] for convert, values in columns]
+    return [
+        measure('convert {0} rows each'.format(count), each, 20),
+        measure('convert {0} rows numpy'.format(count), raw.convert, 20) ]
+
+class InMemoryCollector(OctoPrintRawDataCollector):
+    # Answers from a virtual printer instead of the network.
+    def __init__(self, configuration, printer):
+        super().__init__(configuration)
+        self._printer = printer
+    def _get(self, url):
+        delay, status, body = self._printer.respond(url.rsplit('/', 1)[-1])
+        if status is None:
+            raise ReadTimeout(url)
+        return RecordedResponse(status, body)
+
+class InMemoryCollectors(dmstl.OctoPrintRawDataCollectors):
+    def __init__(self, count, time_scale, batch=False):
+        super().__init__(None, batch=batch)
+        self._count = count
+        self._time_scale = time_scale
+    def _create_collector_from_row(self, row):
+        printer = dmstl.opsim.VirtualPrinter(row[0], time_scale=self._time_scale)
+        return InMemoryCollector(OctoPrintRawDataCollectorConfiguration(row), printer)
+    def _load_collectors_from_memory(self, method):
+        for row in dmstl.opsim.simulated_printer_rows(self._count):
+            method(row)
+
+def cycle_benchmark(count=200, time_scale=600.0, batched=False):
+    # collect -> map -> log -> crunch with MySQL and Twitter stand-ins.  The
+    # printers run time_scale times faster than real time so their states
+    # keep changing.
+    dbi = dmstl.DatabaseInterfaceInMemory()
+    rs = dmstl.RedundantStrings(dbi)
+    rdl = OctoPrintRawDataLogger(dbi, rs, batched=batched)
+    cru = dmstl.OctoPrintRawDataCruncher(None, dmstl.ToolLogsScheduler(), batched=batched,
+            credentials_loader=dmstl.TwitterCredentialsLoadNone())
+    rdc = InMemoryCollectors(count, time_scale, batch=batched)
+    name = 'cycle ({0} printers{1})'.format(count, ', batched' if batched else '')
+    try:
+        result = measure(name, rdc.get_fresh_data, 10)
+    finally:
+        rdc.shutdown()
+        cru.shutdown()
+        rdl.shutdown()
+    result['rows'] = len(dbi.tables.get('RAW_DATA', ()))
+    return result
+
+def version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except Exception:
+        return None
+
+def run(path):
+    results = micro_benchmarks()
+    results.extend(convert_benchmarks())
+    results.append(cycle_benchmark())
+    results.append(cycle_benchmark(batched=True))
+    document = {
+        'version': version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'when': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'results': results }
+    with open(path, 'wt') as ouf:
+        json.dump(document, ouf, indent=2)
+
+def compare(before_path, after_path):
+    with open(before_path, 'rt') as inf:
+        before = {r1['name']: r1 for r1 in json.load(inf)['results']}
+    with open(after_path, 'rt') as inf:
+        after = json.load(inf)['results']
+    for r1 in after:
+        b1 = before.get(r1['name'], None)
+        if b1 is None:
+            print('{0:32s} new'.format(r1['name']))
+        else:
+            ratio = r1['best'] / b1['best'] if b1['best'] > 0 else float('inf')
+            print('{0:32s} {1:7.2f}x{2}'.format(r1['name'], ratio, '  SLOWER' if ratio > 1.10 else ''))
+
+def main(argv):
+    # The collectors and models log every timeout and state change; that
+    # output would swamp the timings.
+    logging.getLogger().setLevel(logging.ERROR)
+    if (len(argv) >= 1) and (argv[0] == 'compare') and (len(argv) == 3):
+        compare(argv[1], argv[2])
+    elif (len(argv) >= 1) and (argv[0] == 'run'):
+        run(argv[1] if len(argv) > 1 else 'dmstl_bench.json')
+    else:
+        print('usage: dmstl_bench.py run [results.json] | compare before.json after.json')
+        return 2
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,105 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+# Measures how many printers one core can collect from at a five second
+# cadence using OctoPrintAsyncRawDataCollectors.  A fake OctoPrint server
+# runs in a separate process so it does not compete for this process' core.
+#
+# "C:\Python36\python" dmstl_bench_aio.py 100 500 1000 2000
+
+import asyncio
+import dmstl
+import multiprocessing
+import sys
+import time
+
+FakePrinterBody = b'{"sd": {"ready": false}, "state": {"flags": {"closedOrError": false, "error": false, "operational": true, "paused": false, "printing": false, "ready": true, "sdReady": false}, "text": "Operational"}, "temperature": {"bed": {"actual": 21.3, "offset": 0, "target": 0.0}, "tool0": {"actual": 22.1, "offset": 0, "target": 0.0}}}'
+FakeJobBody = b'{"job": {"averagePrintTime": null, "estimatedPrintTime": null, "filament": null, "file": {"date": null, "name": null, "origin": null, "path": null, "size": null}, "lastPrintTime": null}, "progress": {"completion": null, "filepos": null, "printTime": null, "printTimeLeft": null, "printTimeLeftOrigin": null}, "state": "Operational"}'
+
+async def fake_octoprint(reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if request_line == b'':
+                break
+            keep_alive = True
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                if line.lower().startswith(b'connection:') and (b'close' in line.lower()):
+                    keep_alive = False
+            body = FakeJobBody if b'/api/job' in request_line else FakePrinterBody
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n' % len(body))
+            writer.write(body)
+            await writer.drain()
+            if not keep_alive:
+                break
+    finally:
+        writer.close()
+
+def serve_fake_octoprint(port):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(asyncio.start_server(fake_octoprint, '127.0.0.1', port, backlog=4096))
+    loop.run_forever()
+
+class BenchmarkCollectors(dmstl.OctoPrintAsyncRawDataCollectors):
+    def __init__(self, count, port):
+        super().__init__(None)
+        self._count = count
+        self._port = port
+    def _load_collectors_from_memory(self, method):
+        for i1 in range(self._count):
+            method((i1+1, 'Bench{0}'.format(i1+1), '127.0.0.1:{0}'.format(self._port), 'BENCHMARK', True))
+
+def benchmark(count, port, cycles=5, period=5.0):
+    rdc = BenchmarkCollectors(count, port)
+    try:
+        rdc.get_fresh_data()  # warm up
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        for i1 in range(cycles):
+            rdc.get_fresh_data()
+        wall = (time.perf_counter() - wall) / cycles
+        cpu = (time.process_time() - cpu) / cycles
+    finally:
+        rdc.shutdown()
+    per_core = count * period / cpu if cpu > 0 else float('inf')
+    print('{0:6d} printers  {1:7.3f} s wall/cycle  {2:7.3f} s cpu/cycle  {3:9.0f} printers/core @ {4:.0f} s'.format(
+            count, wall, cpu, per_core, period))
+
+def main(argv):
+    port = 5080
+    counts = [int(a) for a in argv] or [100, 500, 1000]
+    server = multiprocessing.Process(target=serve_fake_octoprint, args=(port,), daemon=True)
+    server.start()
+    time.sleep(0.5)
+    try:
+        for count in counts:
+            benchmark(count, port)
+    finally:
+        server.terminate()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
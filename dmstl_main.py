@@ -30,21 +30,39 @@ import time
 def do_it():
     rdc = None
     cru = None
+    mes = None
+    odp = None
     try:
         scheduler = dmstl.ToolLogsScheduler()
+        dmstl.log_stage_summary_on_signal(scheduler)
+        try:
+            mes = dmstl.MetricsServer(9464, scheduler=scheduler)
+        except OSError as exc:
+            # Most likely the port is taken; carry on without metrics.
+            dmstl.get_logger(__name__).error('Unable to serve metrics: {0}'.format(exc))
+        odp = dmstl.OnDemandProfiler(scheduler)
+        # dmstl.load_ignore_list('dmstl_unrecognized.txt', learn=True)
+        dmstl.log_unrecognized_summary_every(scheduler)
+        # dmstl.enable_tracing('dmstl_trace.jsonl')
         dbi = None  # dbi = dmstl.DatabaseInterface()
         # rs = dmstl.RedundantStrings(dbi)
-        # rdl = dmstl.OctoPrintRawDataLogger(dbi, rs)
-        cru = dmstl.OctoPrintRawDataCruncher(dbi, scheduler)
-        rdc = dmstl.OctoPrintRawDataCollectors(dbi)
-        scheduler.every(5, 100, rdc.get_fresh_data)
+        # rdl = dmstl.OctoPrintRawDataLogger(dbi, rs, queue_size=1000, policy=dmstl.OverloadPolicy.COALESCE, report_unrecognized=False)
+        cru = dmstl.OctoPrintRawDataCruncher(dbi, scheduler, queue_size=1000, policy=dmstl.OverloadPolicy.COALESCE)
+        # rec = dmstl.OctoPrintRawDataRecorder('raw_data.rec', queue_size=1000)
+        rdc = dmstl.OctoPrintRawDataCollectors(dbi, max_workers=16)
+        rdc.schedule(scheduler, 100, dmstl.OctoPrintPollCadence())
         scheduler.run()
-    except (SystemExit, KeyboardInterrupt):
+    finally:
+        # Also on the way back to wrap_do_it so a restart does not leave the
+        # old subscribers behind.
         if rdc is not None:
             rdc.shutdown()
         if cru is not None:
             cru.shutdown()
-        raise
+        if mes is not None:
+            mes.shutdown()
+        if odp is not None:
+            odp.shutdown()
 
 def wrap_do_it():
     while True:
@@ -0,0 +1,155 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+# A stand-in for one OctoPrint server's push socket and REST API, for trying
+# OctoPrintPushRawDataCollectors without a printer.  The printer cycles
+# through Operational, Printing and Paused every few seconds.
+#
+# "C:\Python36\python" dmstl_push_standin.py 5081
+
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import sys
+import time
+
+WebSocketMagic = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+States = ['Operational', 'Printing', 'Printing', 'Paused', 'Printing', 'Operational']
+
+class StandInPrinter:
+    def __init__(self, period=4.0):
+        self._period = period
+        self._started = time.monotonic()
+    def state_text(self):
+        elapsed = time.monotonic() - self._started
+        return States[int(elapsed / self._period) % len(States)]
+    def state(self):
+        text = self.state_text()
+        return {
+                'text': text,
+                'flags': {
+                        'closedOrError': False, 'error': False, 'operational': True,
+                        'paused': text == 'Paused', 'printing': text == 'Printing',
+                        'ready': text == 'Operational', 'sdReady': False } }
+    def temperature(self):
+        target = 210.0 if self.state_text() != 'Operational' else 0.0
+        return {'tool0': {'actual': target or 22.0, 'target': target}, 'bed': {'actual': 21.0, 'target': 0.0}}
+    def job(self):
+        printing = self.state_text() != 'Operational'
+        return {
+                'job': {'file': {'name': 'standin.gcode' if printing else None}},
+                'progress': {'completion': 50.0 if printing else None, 'printTime': 60 if printing else None} }
+    def api_printer(self):
+        temperature = self.temperature()
+        for reading in temperature.values():
+            reading['offset'] = 0
+        return {'sd': {'ready': False}, 'state': self.state(), 'temperature': temperature}
+    def api_job(self):
+        rv = self.job()
+        rv['state'] = self.state_text()
+        return rv
+    def current(self):
+        temps = self.temperature()
+        temps['time'] = int(time.time())
+        rv = self.job()
+        rv.update({'state': self.state(), 'temps': [temps], 'offsets': {}, 'logs': [], 'messages': []})
+        return {'current': rv}
+
+def ws_frame(text):
+    payload = text.encode('utf-8')
+    n = len(payload)
+    if n < 126:
+        header = struct.pack('!BB', 0x81, n)
+    elif n < 65536:
+        header = struct.pack('!BBH', 0x81, 126, n)
+    else:
+        header = struct.pack('!BBQ', 0x81, 127, n)
+    return header + payload
+
+async def push_socket(printer, headers, reader, writer):
+    key = headers.get('sec-websocket-key', '').encode('latin-1')
+    accept = base64.b64encode(hashlib.sha1(key + WebSocketMagic).digest())
+    writer.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+    writer.write(ws_frame(json.dumps({'connected': {'version': 'stand-in'}})))
+    previous = None
+    while True:
+        text = printer.state_text()
+        if text != previous:
+            writer.write(ws_frame(json.dumps({'event': {'type': 'PrinterStateChanged', 'payload': {'state_string': text}}})))
+            previous = text
+        writer.write(ws_frame(json.dumps(printer.current())))
+        await writer.drain()
+        await asyncio.sleep(0.5)
+
+async def serve(printer, reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if request_line == b'':
+                break
+            headers = dict()
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length > 0:
+                await reader.readexactly(length)
+            method, path = request_line.decode('latin-1').split()[:2]
+            if path == '/sockjs/websocket':
+                await push_socket(printer, headers, reader, writer)
+                break
+            elif path == '/api/printer':
+                body = printer.api_printer()
+            elif path == '/api/job':
+                body = printer.api_job()
+            elif (path == '/api/login') and (method == 'POST'):
+                body = {'name': 'standin', 'session': 'standin'}
+            else:
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+                continue
+            body = json.dumps(body).encode('utf-8')
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n' % len(body))
+            writer.write(body)
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+def main(argv):
+    port = int(argv[0]) if len(argv) > 0 else 5081
+    printer = StandInPrinter()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(asyncio.start_server(lambda r, w: serve(printer, r, w), '127.0.0.1', port))
+    loop.run_forever()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,54 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+# Replays a recording made with OctoPrintRawDataRecorder through the logger
+# (into an in-memory database) and the cruncher (with Twitter switched off)
+# as fast as it will go and reports the throughput and the stage latencies.
+#
+# "C:\Python36\python" dmstl_replay.py raw_data.rec
+# "C:\Python36\python" dmstl_replay.py raw_data.rec realtime
+
+import dmstl
+import sys
+
+def main(argv):
+    if len(argv) < 1:
+        print('usage: dmstl_replay.py recording [realtime]')
+        return 2
+    scheduler = dmstl.ToolLogsScheduler()
+    dbi = dmstl.DatabaseInterfaceInMemory()
+    rdl = dmstl.OctoPrintRawDataLogger(dbi, dmstl.RedundantStrings(dbi))
+    cru = dmstl.OctoPrintRawDataCruncher(None, scheduler, credentials_loader=dmstl.TwitterCredentialsLoadNone())
+    try:
+        replay = dmstl.OctoPrintRawDataReplay(argv[0])
+        replay.run(realtime=('realtime' in argv[1:]))
+    finally:
+        cru.shutdown()
+        rdl.shutdown()
+    print('{0} samples in {1:.3f} s ({2:.0f} samples/s)'.format(replay.samples, replay.elapsed, replay.rate))
+    print('{0} rows logged'.format(len(dbi.tables.get('RAW_DATA', ()))))
+    print(dmstl.stage_summary())
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,84 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+# Runs the simulated OctoPrint fleet (dmstl/opsim.py) on its own or measures
+# how long the collectors take to poll a fleet of a given size.  At a five
+# second cadence a cycle that takes longer than five seconds falls behind.
+#
+# "C:\Python36\python" dmstl_simulator.py serve 2000
+# "C:\Python36\python" dmstl_simulator.py threads 500 1000 2000
+# "C:\Python36\python" dmstl_simulator.py async 1000 5000 10000
+
+import collections
+import dmstl
+import dmstl.opsim
+import multiprocessing
+import sys
+import time
+
+Port = 5080
+Period = 5.0
+
+def measure(kind, count, cycles=5):
+    if kind == 'async':
+        rdc = dmstl.opsim.simulated_collectors(dmstl.OctoPrintAsyncRawDataCollectors, count, port=Port)
+    else:
+        rdc = dmstl.opsim.simulated_collectors(dmstl.OctoPrintRawDataCollectors, count, port=Port, max_workers=min(count, 256))
+    outcomes = collections.Counter()
+    try:
+        rdc.get_fresh_data()  # warm up
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        for i1 in range(cycles):
+            for c1, collected in rdc._collect():
+                exception = collected._first_exception
+                outcomes[exception.__class__.__name__ if exception is not None else collected._http_status] += 1
+        wall = (time.perf_counter() - wall) / cycles
+        cpu = (time.process_time() - cpu) / cycles
+    finally:
+        rdc.shutdown()
+    print('{0:6d} printers  {1:7.3f} s wall/cycle  {2:7.3f} s cpu/cycle  {3}  {4}'.format(
+            count, wall, cpu, 'ok' if wall <= Period else 'FALLS BEHIND',
+            ' '.join('{0}={1}'.format(k1, v1) for k1, v1 in sorted(outcomes.items(), key=str))))
+
+def main(argv):
+    if len(argv) < 2:
+        print('usage: dmstl_simulator.py serve|threads|async count...')
+        return 2
+    kind = argv[0]
+    counts = [int(a) for a in argv[1:]]
+    if kind == 'serve':
+        dmstl.opsim.run_simulator(counts[0], port=Port)
+        return 0
+    server = multiprocessing.Process(target=dmstl.opsim.run_simulator, args=(max(counts),), kwargs={'port': Port}, daemon=True)
+    server.start()
+    time.sleep(1.0)
+    try:
+        for count in counts:
+            measure(kind, count)
+    finally:
+        server.terminate()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,101 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+# Responses recorded from an OctoPrint 1.3 server, and helpers that turn
+# them into samples as OctoPrintRawDataCollector would publish them.
+
+from dmstl.opraw import OctoPrintRawDataCollected, OctoPrintRawDataCollectorConfiguration
+from dmstl.oprecord import RecordedResponse
+import copy
+import json
+import threading
+
+PRINTER_BODY = b'{"sd": {"ready": false}, "state": {"flags": {"closedOrError": false, "error": false, "operational": true, "paused": false, "printing": true, "ready": false, "sdReady": false}, "text": "Printing"}, "temperature": {"bed": {"actual": 59.8, "offset": 0, "target": 60.0}, "tool0": {"actual": 209.6, "offset": 0, "target": 210.0}}}'
+
+JOB_BODY = b'{"job": {"averagePrintTime": null, "estimatedPrintTime": 5417.2, "filament": {"tool0": {"length": 4210.7, "volume": 10.1}}, "file": {"date": 1508354212, "name": "bracket.gcode", "origin": "local", "path": "bracket.gcode", "size": 1893020}, "lastPrintTime": null}, "progress": {"completion": 42.51, "filepos": 804718, "printTime": 2290, "printTimeLeft": 3112, "printTimeLeftOrigin": "estimate"}, "state": "Printing"}'
+
+def printer_json():
+    return json.loads(PRINTER_BODY.decode('utf-8'))
+
+def job_json():
+    return json.loads(JOB_BODY.decode('utf-8'))
+
+def body(document):
+    return json.dumps(document).encode('utf-8')
+
+def with_progress(completion, job=None):
+    # The job body with another completion.
+    document = copy.deepcopy(job if job is not None else job_json())
+    document['progress']['completion'] = completion
+    return document
+
+class Printer():
+    # Stands in for the collector that publishes a sample.
+    def __init__(self, id, name=None):
+        super().__init__()
+        self.id = id
+        self.name = name if name is not None else 'Printer {0}'.format(id)
+        self._previous = dict()
+    def remember(self, collected):
+        if (collected._first_exception is None) and (collected._http_status == 200):
+            self._previous = collected._contents
+        else:
+            self._previous = dict()
+    def sample(self, printer=PRINTER_BODY, job=JOB_BODY):
+        # A sample from the two bodies (bytes or documents), marked
+        # unchanged where they match what this printer last published.
+        collected = OctoPrintRawDataCollected()
+        for prefix, content in (('PRINTER', printer), ('JOB', job)):
+            if not isinstance(content, bytes):
+                content = body(content)
+            collected.set_request(prefix, RecordedResponse(200, content), self._previous)
+        return collected
+
+class FakeSession():
+    # Stands in for a requests.Session.  Each get takes the next item of
+    # script: a body (answered with a 200), an exception (raised) or an
+    # Event (waited on, then the body of the endpoint is answered).
+    def __init__(self, script=None):
+        super().__init__()
+        self.script = list(script) if script is not None else None
+        self.headers = dict()
+        self.gets = 0
+        self.closed = False
+    def mount(self, prefix, adapter):
+        pass
+    def get(self, url, timeout=None):
+        self.gets += 1
+        answer = JOB_BODY if url.endswith('/job') else PRINTER_BODY
+        step = self.script.pop(0) if self.script else answer
+        if isinstance(step, threading.Event):
+            step.wait(5.0)
+            step = answer
+        if isinstance(step, Exception):
+            raise step
+        return RecordedResponse(200, step)
+    def close(self):
+        self.closed = True
+
+def configuration(id):
+    # A printer as a row of PRINTERS would describe it.
+    return OctoPrintRawDataCollectorConfiguration((id, 'Printer {0}'.format(id), '10.0.0.{0}'.format(id), 'key', True))
@@ -0,0 +1,123 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import dmstl
+from dmstl.dispatch import QueuedSubscriber, OverloadPolicy
+from octoprint_samples import Printer, body, with_progress
+from pubsub import pub
+import threading
+import unittest
+
+class GatedDatabaseInterface(dmstl.DatabaseInterfaceInMemory):
+    # Holds the first insert until the gate is opened, so the logger's
+    # queue fills behind it.
+    def __init__(self):
+        super().__init__()
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+    def execute(self, query, args=None, raise_dup_entry=False):
+        if query.lower().startswith('insert into raw_data'):
+            self.entered.set()
+            self.gate.wait(5.0)
+        return super().execute(query, args, raise_dup_entry)
+
+def completions(logger, dbi):
+    names = [f1.field_name() for f1 in logger._schema.fields if f1.provides_sql_value()]
+    column = names.index('JOB_PROGRESS_COMPLETION')
+    return [row[column] for row in dbi.tables['RAW_DATA']]
+
+class CoalesceTest(unittest.TestCase):
+    def test_unchanged_sample_does_not_replace_queued_one(self):
+        dbi = GatedDatabaseInterface()
+        logger = dmstl.OctoPrintRawDataLogger(dbi, dmstl.RedundantStrings(dbi), queue_size=10, policy=OverloadPolicy.COALESCE)
+        try:
+            printer = Printer(1)
+            def publish(job):
+                collected = printer.sample(job=job)
+                printer.remember(collected)
+                pub.sendMessage('raw_data.octoprint', sender=printer, collected=collected)
+                return collected
+            publish(with_progress(10.0))
+            self.assertTrue(dbi.entered.wait(5.0))
+            # A changed sample waits in the queue; the next one is byte for
+            # byte the same and is coalesced into it.
+            a = with_progress(20.0)
+            publish(a)
+            b = publish(body(a))
+            self.assertTrue(b.unchanged)
+            dbi.gate.set()
+            logger._subscriber.join()
+        finally:
+            logger.shutdown()
+        self.assertEqual(logger._subscriber.coalesced, 1)
+        self.assertEqual(completions(logger, dbi), [10.0, 20.0])
+
+    def test_sample_after_a_discarded_one_is_handled(self):
+        # The discarded sample was the last changed one; the samples after
+        # it match it byte for byte, so they say they are unchanged.
+        dbi = GatedDatabaseInterface()
+        logger = dmstl.OctoPrintRawDataLogger(dbi, dmstl.RedundantStrings(dbi), queue_size=1, policy=OverloadPolicy.DROP_OLDEST)
+        try:
+            printer = Printer(1)
+            def publish(job):
+                collected = printer.sample(job=job)
+                printer.remember(collected)
+                pub.sendMessage('raw_data.octoprint', sender=printer, collected=collected)
+                return collected
+            publish(with_progress(10.0))
+            self.assertTrue(dbi.entered.wait(5.0))
+            a = with_progress(20.0)
+            publish(a)
+            self.assertTrue(publish(body(a)).unchanged)
+            self.assertTrue(publish(body(a)).unchanged)
+            dbi.gate.set()
+            logger._subscriber.join()
+        finally:
+            logger.shutdown()
+        self.assertEqual(logger._subscriber.dropped, 2)
+        self.assertEqual(completions(logger, dbi), [10.0, 20.0])
+
+    def test_batches_cannot_be_coalesced(self):
+        dbi = dmstl.DatabaseInterfaceInMemory()
+        with self.assertRaises(ValueError):
+            dmstl.OctoPrintRawDataLogger(dbi, dmstl.RedundantStrings(dbi), queue_size=10, batched=True, policy=OverloadPolicy.COALESCE)
+
+    def test_replaces_decides(self):
+        handled = list()
+        gate = threading.Event()
+        def listener(key, value, keep):
+            gate.wait(5.0)
+            handled.append(value)
+        queued = QueuedSubscriber(listener, 'test.coalesce', policy=OverloadPolicy.COALESCE,
+                coalesce=lambda key, value, keep: (key, None), replaces=lambda key, value, keep: not keep)
+        try:
+            for value, keep in ((1, False), (2, False), (3, True)):
+                pub.sendMessage('test.coalesce', key='k', value=value, keep=keep)
+            gate.set()
+            queued.join()
+        finally:
+            queued.shutdown()
+        self.assertEqual(handled, [1, 2])
+
+if __name__ == '__main__':
+    unittest.main()
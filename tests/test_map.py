@@ -0,0 +1,121 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import dmstl
+from dmstl.oplog import OctoPrintRawDataMaps
+from dmstl.rsb import RedundantStringsInMemory
+from octoprint_samples import printer_json, job_json
+import unittest
+
+class RecordingMaps(dmstl.JsonValueToDatabaseFieldMaps):
+    def __init__(self):
+        super().__init__('TEST')
+        self.reported = list()
+        self.add(dmstl.JsonValueToIntFieldMap('A'))
+        self.add(dmstl.JsonValueToIntFieldMap('B_C'))
+        self.add(dmstl.JsonValueToIntFieldMap('B_D_E'))
+    def unrecognized_path(self, path, value):
+        self.reported.append((path, value))
+
+def traverse(maps, left, node):
+    # The field maps' original walk over the whole object, which the
+    # compiled path tree has to agree with.
+    for key, value in node.items():
+        k2 = key.upper()
+        if left != '':
+            path = left + '_' + k2
+        else:
+            path = k2
+        if isinstance(value, dict):
+            traverse(maps, path, value)
+        else:
+            map = maps._by_json_path.get(path, None)
+            if map is None:
+                maps.unrecognized_path(path, value)
+            else:
+                map.extract_value(value)
+
+class FieldValuesTest(unittest.TestCase):
+    def legacy_row(self, maps, printer, job):
+        maps.reset()
+        maps.set_printer_id(7)
+        traverse(maps, 'PRINTER', printer)
+        traverse(maps, 'JOB', job)
+        return maps.generate_value_tuple()
+    def test_values_match_legacy_maps(self):
+        maps = OctoPrintRawDataMaps(RedundantStringsInMemory())
+        schema = maps.schema()
+        values = schema.new_values()
+        maps.set_printer_id(7, values)
+        values.update('PRINTER', printer_json())
+        values.update('JOB', job_json())
+        self.assertEqual(values.generate_value_tuple(), self.legacy_row(maps, printer_json(), job_json()))
+    def test_columns_match_legacy_maps(self):
+        maps = OctoPrintRawDataMaps(RedundantStringsInMemory())
+        schema = maps.schema()
+        columns = schema.new_columns()
+        printer = printer_json()
+        idle = printer_json()
+        idle['state']['text'] = 'Operational'
+        del idle['temperature']['tool0']
+        for p1 in (printer, idle):
+            columns.new_row()
+            maps.set_printer_id(7, columns)
+            columns.update('PRINTER', p1)
+            columns.update('JOB', job_json())
+        expected = [self.legacy_row(maps, p1, job_json()) for p1 in (printer, idle)]
+        self.assertEqual([tuple(r1) for r1 in columns.rows()], expected)
+
+class PathTreeTest(unittest.TestCase):
+    def setUp(self):
+        self.maps = RecordingMaps()
+        self.schema = self.maps.schema()
+    def walk(self, json):
+        values = self.schema.new_values()
+        values.update('', json)
+        return values
+    def test_missing_keys_are_skipped(self):
+        self.walk({'a': 1, 'b': {'c': 2, 'd': {'e': 3}}})
+        values = self.walk({'b': {'c': 4}})
+        self.assertEqual([values[i1] for i1 in range(len(self.schema))], [None, 4, None])
+        self.assertEqual(self.maps.reported, [])
+    def test_new_keys_are_learned(self):
+        self.walk({'a': 1})
+        values = self.walk({'a': 1, 'b': {'d': {'e': 3}, 'x': 5}})
+        self.assertEqual(values[2], 3)
+        self.assertEqual(self.maps.reported, [('B_X', 5)])
+    def test_unrecognized_paths_are_reported_every_time(self):
+        for i1 in range(3):
+            self.walk({'a': 1, 'z': i1})
+        self.assertEqual(self.maps.reported, [('Z', 0), ('Z', 1), ('Z', 2)])
+    def test_unrecognized_paths_are_reported_once(self):
+        self.maps.report_unrecognized = False
+        for i1 in range(3):
+            self.walk({'a': 1, 'z': i1})
+        self.assertEqual(self.maps.reported, [('Z', 0)])
+    def test_dict_valued_keys(self):
+        # A dict where a value is mapped and a value where a dict is
+        # expected are both reported, the dict's leaves one by one.
+        values = self.walk({'a': {'f': 1, 'g': {'h': 2}}, 'b': 3})
+        self.assertIsNone(values[0])
+        self.assertEqual(sorted(self.maps.reported), [('A_F', 1), ('A_G_H', 2), ('B', 3)])
@@ -0,0 +1,43 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+from dmstl.metrics import PrometheusText
+from dmstl.stats import Histogram
+import unittest
+
+class PrometheusTextTest(unittest.TestCase):
+    def test_families_are_contiguous(self):
+        text = PrometheusText()
+        for name in ('a', 'b'):
+            text.histogram('lateness_seconds', 'Lateness.', (('event', name),), Histogram())
+            text.sample('overruns_total', 'counter', 'Overruns.', (('event', name),), 0)
+        families = list()
+        for line in str(text).splitlines():
+            if line.startswith('# TYPE '):
+                families.append(line.split()[2])
+            elif not line.startswith('#'):
+                self.assertTrue(line.startswith(families[-1]), line)
+        self.assertEqual(families, ['lateness_seconds', 'overruns_total'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+from dmstl.opaio import OctoPrintAsyncRawDataCollector, OctoPrintAsyncRawDataCollectors
+from dmstl.opraw import OctoPrintRawDataCollectorConfiguration
+from octoprint_samples import PRINTER_BODY
+import asyncio
+import unittest
+
+def response(body):
+    return b'HTTP/1.1 200 OK\r\nContent-Length: ' + str(len(body)).encode('ascii') + b'\r\n\r\n' + body
+
+class AsyncCollectionTest(unittest.TestCase):
+    def setUp(self):
+        self.collectors = OctoPrintAsyncRawDataCollectors(None, deadline=2.0)
+        self.collectors._need_load = False
+        self.collectors._loop = asyncio.new_event_loop()
+        self.addCleanup(self.collectors.shutdown)
+    def serve(self, bodies):
+        # A printer on a local port answering /api/<verb> with bodies[verb].
+        async def handle(reader, writer):
+            while True:
+                line = await reader.readline()
+                if line == b'':
+                    break
+                verb = line.split()[1].rsplit(b'/', 1)[1].decode('ascii')
+                while (await reader.readline()) not in (b'\r\n', b''):
+                    pass
+                writer.write(response(bodies[verb]))
+            writer.close()
+        loop = self.collectors._loop
+        server = loop.run_until_complete(asyncio.start_server(handle, '127.0.0.1', 0))
+        def close():
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+        self.addCleanup(close)
+        return server.sockets[0].getsockname()[1]
+    def add_printer(self, id, port):
+        row = (id, 'Printer {0}'.format(id), '127.0.0.1:{0}'.format(port), 'key', True)
+        self.collectors.add_collector(OctoPrintAsyncRawDataCollector(OctoPrintRawDataCollectorConfiguration(row)))
+    def test_bad_json_is_kept_on_the_sample(self):
+        self.add_printer(1, self.serve({'printer': PRINTER_BODY, 'job': b'{"job": '}))
+        self.add_printer(2, self.serve({'printer': PRINTER_BODY, 'job': b'{}'}))
+        results = {c1.id: collected for c1, collected in self.collectors._collect()}
+        self.assertIsInstance(results[1]._exceptions['JOB'], ValueError)
+        self.assertIn('PRINTER', results[1]._jsons)
+        self.assertIsNone(results[2]._first_exception)
+        self.assertEqual(results[2]._jsons['JOB'], {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import dmstl
+from dmstl.opraw import OctoPrintRawDataBatch
+from octoprint_samples import Printer, with_progress
+import unittest
+
+class OctoPrintRawDataLoggerBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.dbi = dmstl.DatabaseInterfaceInMemory()
+        self.logger = dmstl.OctoPrintRawDataLogger(self.dbi, dmstl.RedundantStrings(self.dbi), batched=True)
+        self.printers = [Printer(1), Printer(2)]
+    def tearDown(self):
+        self.logger.shutdown()
+    def log_batch(self, cycle, jobs):
+        # Returns the number of rows the batch inserted.
+        before = len(self.dbi.tables.get('RAW_DATA', ()))
+        samples = list()
+        for p1, job in zip(self.printers, jobs):
+            collected = p1.sample(job=job)
+            p1.remember(collected)
+            samples.append((p1, collected))
+        self.logger.map_then_log_batch(None, OctoPrintRawDataBatch(cycle, samples))
+        return len(self.dbi.tables.get('RAW_DATA', ())) - before
+    def next_jobs(self, jobs):
+        # The same jobs five seconds later: different bytes, nothing the
+        # deadband cares about.
+        jobs = [with_progress(j1['progress']['completion'], j1) for j1 in jobs]
+        for j1 in jobs:
+            j1['progress']['printTime'] += 5
+        return jobs
+    def test_deadband_is_per_printer(self):
+        # Each printer's deadband has to remember its own sample, not the
+        # last one in the batch.
+        jobs = [with_progress(10.0), with_progress(90.0)]
+        self.assertEqual(self.log_batch(1, jobs), 2)
+        jobs = self.next_jobs(jobs)
+        self.assertEqual(self.log_batch(2, jobs), 0)
+    def test_only_changed_printers_are_inserted(self):
+        jobs = [with_progress(10.0), with_progress(90.0)]
+        self.assertEqual(self.log_batch(1, jobs), 2)
+        jobs = self.next_jobs(jobs)
+        jobs[1]['progress']['completion'] = 95.0
+        self.assertEqual(self.log_batch(2, jobs), 1)
+        self.assertEqual(self.dbi.tables['RAW_DATA'][-1][0], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,267 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+from dmstl.opraw import CircuitState, OctoPrintCircuitBreaker, OctoPrintRawDataCollector, OctoPrintRawDataCollectors, is_unreachable
+from octoprint_samples import PRINTER_BODY, JOB_BODY, FakeSession, configuration
+from unittest import mock
+import requests
+import threading
+import time
+import unittest
+
+class SessionsTest(unittest.TestCase):
+    # Every session the collectors open comes from self.sessions (a fresh
+    # FakeSession once it runs out).
+    def setUp(self):
+        self.sessions = list()
+        self.opened = list()
+        def new_session():
+            session = self.sessions.pop(0) if self.sessions else FakeSession()
+            self.opened.append(session)
+            return session
+        patcher = mock.patch.object(requests, 'Session', new_session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+class ConcurrentCollectionTest(SessionsTest):
+    def collectors(self, count, deadline):
+        collectors = OctoPrintRawDataCollectors(None, max_workers=4, deadline=deadline)
+        collectors._need_load = False
+        for id in range(1, count+1):
+            collectors.add_collector(OctoPrintRawDataCollector(configuration(id)))
+        self.addCleanup(collectors.shutdown)
+        return collectors
+    def test_straggler_times_out(self):
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+        self.sessions = [FakeSession(), FakeSession([gate])]
+        collectors = self.collectors(2, 0.2)
+        results = {c1.id: collected for c1, collected in collectors._collect_concurrently()}
+        self.assertIsNone(results[1]._first_exception)
+        self.assertEqual(results[1]._http_status, 200)
+        self.assertEqual(results[2]._first_exception.__class__.__name__, 'ReadTimeout')
+        # The straggler is not polled again while it is still answering.
+        results = {c1.id: collected for c1, collected in collectors._collect_concurrently()}
+        self.assertIsNone(results[1]._first_exception)
+        self.assertIn('previous cycle', str(results[2]._first_exception))
+        self.assertEqual(self.opened[1].gets, 1)
+        gate.set()
+        collectors._in_flight[2].result(5.0)
+        results = {c1.id: collected for c1, collected in collectors._collect_concurrently()}
+        self.assertIsNone(results[2]._first_exception)
+    def test_every_printer_is_answered_once(self):
+        collectors = self.collectors(6, 2.0)
+        results = collectors._collect_concurrently()
+        self.assertEqual(sorted(c1.id for c1, collected in results), [1, 2, 3, 4, 5, 6])
+        self.assertTrue(all(collected._first_exception is None for c1, collected in results))
+
+class ReconnectTest(SessionsTest):
+    def setUp(self):
+        super().setUp()
+        self.collector = OctoPrintRawDataCollector(configuration(1))
+        self.addCleanup(self.collector.shutdown)
+    def test_dropped_connection_is_retried_once(self):
+        # The kept-alive connection was dropped by the printer between polls.
+        self.sessions = [FakeSession([PRINTER_BODY, JOB_BODY, requests.exceptions.ConnectionError()])]
+        self.assertIsNone(self.collector.collect()._first_exception)
+        collected = self.collector.collect()
+        self.assertIsNone(collected._first_exception)
+        self.assertEqual(len(self.opened), 2)
+        self.assertTrue(self.opened[0].closed)
+        self.assertEqual(self.opened[1].gets, 2)
+    def test_new_connection_is_not_retried(self):
+        self.sessions = [FakeSession([requests.exceptions.ConnectionError()])]
+        collected = self.collector.collect()
+        self.assertIsInstance(collected._first_exception, requests.exceptions.ConnectionError)
+        self.assertEqual(len(self.opened), 1)
+        self.assertTrue(self.opened[0].closed)
+    def test_timeout_is_not_retried(self):
+        self.sessions = [FakeSession([PRINTER_BODY, JOB_BODY, requests.exceptions.ReadTimeout()])]
+        self.collector.collect()
+        collected = self.collector.collect()
+        self.assertIsInstance(collected._exceptions['PRINTER'], requests.exceptions.ReadTimeout)
+        self.assertEqual(len(self.opened), 1)
+        self.assertEqual(self.opened[0].gets, 4)
+
+class FingerprintTest(SessionsTest):
+    def setUp(self):
+        super().setUp()
+        self.collector = OctoPrintRawDataCollector(configuration(1))
+        self.addCleanup(self.collector.shutdown)
+    def published(self, script=None):
+        if script is not None:
+            self.sessions.append(FakeSession(script))
+            self.collector._reset_session()
+        collected = self.collector.collect()
+        self.collector.remember(collected)
+        return collected
+    def test_same_bytes_are_unchanged(self):
+        first = self.published()
+        self.assertFalse(first.unchanged)
+        second = self.published()
+        self.assertTrue(second.unchanged)
+        # The document is not decoded again.
+        self.assertIs(second._jsons['JOB'], first._jsons['JOB'])
+    def test_one_changed_response_is_enough(self):
+        self.published()
+        collected = self.published([PRINTER_BODY, JOB_BODY.replace(b'42.51', b'43.0')])
+        self.assertFalse(collected.unchanged)
+        self.assertEqual(collected._unchanged, {'PRINTER'})
+        self.assertEqual(collected._jsons['JOB']['progress']['completion'], 43.0)
+    def test_error_is_not_remembered(self):
+        self.published()
+        failed = self.published([PRINTER_BODY, requests.exceptions.ReadTimeout()])
+        self.assertFalse(failed.unchanged)
+        self.assertFalse(self.published().unchanged)
+    def test_only_published_samples_are_remembered(self):
+        self.published()
+        self.collector.collect()
+        self.assertTrue(self.published().unchanged)
+        # A poll that missed the deadline was published as a timeout.
+        self.collector.remember(self.collector.timed_out('Missed.'))
+        self.assertFalse(self.published().unchanged)
+
+class Clock():
+    def __init__(self):
+        super().__init__()
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = OctoPrintCircuitBreaker('Printer 1', timefunc=self.clock)
+    def fail(self, times=1):
+        for i1 in range(times):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.failure(ConnectionError())
+    def test_opens_after_threshold(self):
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CircuitState.CLOSED)
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitState.OPEN)
+        self.assertFalse(self.breaker.allow())
+    def test_backs_off_exponentially(self):
+        self.fail(3)
+        delays = list()
+        for i1 in range(9):
+            opened = self.clock.now
+            while not self.breaker.allow():
+                self.clock.now += 1.0
+            delays.append(self.clock.now - opened)
+            self.assertEqual(self.breaker.state, CircuitState.HALF_OPEN)
+            self.breaker.failure(ConnectionError())
+        self.assertEqual(delays, [5.0, 10.0, 20.0, 40.0, 80.0, 160.0, 300.0, 300.0, 300.0])
+    def test_half_open_lets_one_probe_through(self):
+        self.fail(3)
+        self.clock.now += 5.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure(ConnectionError())
+        self.assertEqual(self.breaker.state, CircuitState.OPEN)
+        self.assertFalse(self.breaker.allow())
+    def test_success_resets(self):
+        self.fail(3)
+        self.clock.now += 5.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.success()
+        self.assertEqual(self.breaker.state, CircuitState.CLOSED)
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CircuitState.CLOSED)
+        self.fail()
+        # Back to the first delay.
+        self.clock.now += 5.0
+        self.assertTrue(self.breaker.allow())
+
+class UnreachableTest(SessionsTest):
+    def test_what_is_unreachable(self):
+        self.assertTrue(is_unreachable(requests.exceptions.ConnectTimeout()))
+        self.assertTrue(is_unreachable(requests.exceptions.ConnectionError()))
+        self.assertFalse(is_unreachable(requests.exceptions.ReadTimeout()))
+        self.assertFalse(is_unreachable(ValueError()))
+    def test_polls_are_skipped_while_open(self):
+        clock = Clock()
+        collector = OctoPrintRawDataCollector(configuration(1))
+        collector._breaker = OctoPrintCircuitBreaker(collector.name, timefunc=clock)
+        self.addCleanup(collector.shutdown)
+        refused = lambda: FakeSession([requests.exceptions.ConnectionError()])
+        self.sessions = [refused(), refused(), refused()]
+        for i1 in range(3):
+            collector.collect()
+        self.assertEqual([s1.gets for s1 in self.opened], [1, 1, 1])
+        collected = collector.collect()
+        self.assertEqual(len(self.opened), 3)
+        self.assertIsInstance(collected._first_exception, requests.exceptions.ConnectionError)
+        # Once the delay has passed one probe goes out, and answers.
+        clock.now += 5.0
+        collected = collector.collect()
+        self.assertIsNone(collected._first_exception)
+        self.assertEqual(collector._breaker.state, CircuitState.CLOSED)
+
+class ReloadTest(SessionsTest):
+    def setUp(self):
+        super().setUp()
+        self.rows = [configuration(id).row for id in (1, 2, 3)]
+        rows = lambda: self.rows
+        class Collectors(OctoPrintRawDataCollectors):
+            def _load_collectors_from_memory(self, method):
+                for row in rows():
+                    method(row)
+        self.collectors = Collectors(None, max_workers=2)
+        self.addCleanup(self.collectors.shutdown)
+    def by_id(self):
+        return {c1.id: c1 for c1 in self.collectors}
+    def test_unchanged_collectors_are_kept(self):
+        before = self.by_id()
+        before[1]._breaker.failure(ConnectionError())
+        self.rows[1] = (2, 'Printer 2', '10.0.0.20', 'key', True)
+        del self.rows[2]
+        self.rows.append(configuration(4).row)
+        self.collectors.reload()
+        after = self.by_id()
+        self.assertEqual(sorted(after), [1, 2, 4])
+        self.assertIs(after[1], before[1])
+        self.assertEqual(after[1]._breaker._failures, 1)
+        self.assertIsNot(after[2], before[2])
+        self.assertEqual(after[2].configuration.ip_address, '10.0.0.20')
+    def test_retired_collector_outlives_its_poll(self):
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+        self.sessions = [FakeSession([gate])]
+        polled = self.by_id()[1]
+        self.collectors._polled = {1: polled}
+        self.collectors._poll(1)
+        del self.rows[0]
+        self.collectors.reload()
+        self.assertNotIn(1, self.by_id())
+        self.assertFalse(self.opened[0].closed)
+        gate.set()
+        self.collectors._in_flight[1].result(5.0)
+        # The future's callbacks run just after its result is set.
+        give_up = time.monotonic() + 5.0
+        while (not self.opened[0].closed) and (time.monotonic() < give_up):
+            time.sleep(0.001)
+        self.assertTrue(self.opened[0].closed)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import dmstl
+from dmstl.errors import ConnectTimeout
+from dmstl.opraw import OctoPrintRawDataCollected
+from octoprint_samples import Printer, body, printer_json, with_progress
+from pubsub import pub
+import os
+import shutil
+import tempfile
+import unittest
+
+class Pipeline():
+    # The logger (into an in-memory database) and the cruncher (off
+    # Twitter), with the state transitions the cruncher announces.
+    def __init__(self):
+        super().__init__()
+        self.dbi = dmstl.DatabaseInterfaceInMemory()
+        self.states = list()
+        pub.subscribe(self.state, 'state.octoprint')
+        self.rdl = dmstl.OctoPrintRawDataLogger(self.dbi, dmstl.RedundantStrings(self.dbi))
+        self.cru = dmstl.OctoPrintRawDataCruncher(None, dmstl.ToolLogsScheduler(), credentials_loader=dmstl.TwitterCredentialsLoadNone())
+    def state(self, id, network_state, device_state):
+        self.states.append((id, network_state.name, device_state.name))
+    def shutdown(self):
+        # Directly subscribed listeners stay subscribed (pubsub holds them
+        # weakly) until they are dropped.
+        self.cru.shutdown()
+        self.rdl.shutdown()
+        del self.cru, self.rdl
+        pub.unsubscribe(self.state, 'state.octoprint')
+        self.rows = self.dbi.tables.get('RAW_DATA', [])
+
+class RecordReplayTest(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        self.path = os.path.join(folder, 'raw_data.rec')
+    def publish(self, printer, collected):
+        printer.remember(collected)
+        pub.sendMessage('raw_data.octoprint', sender=printer, collected=collected)
+    def record(self):
+        pipeline = Pipeline()
+        recorder = dmstl.OctoPrintRawDataRecorder(self.path)
+        try:
+            printers = [Printer(1), Printer(2)]
+            idle = printer_json()
+            idle['state']['text'] = 'Operational'
+            for completion in (10.0, 10.0, 20.0, 100.0):
+                for p1 in printers:
+                    self.publish(p1, p1.sample(job=body(with_progress(completion))))
+            self.publish(printers[0], printers[0].sample(printer=idle))
+            offline = OctoPrintRawDataCollected()
+            offline.set_exception('PRINTER', ConnectTimeout(), quiet=True)
+            self.publish(printers[1], offline)
+            self.publish(printers[1], printers[1].sample())
+        finally:
+            recorder.close()
+            pipeline.shutdown()
+        self.assertEqual(recorder.records, 11)
+        return pipeline
+    def test_replay_matches_recording(self):
+        recorded = self.record()
+        replayed = Pipeline()
+        try:
+            replay = dmstl.OctoPrintRawDataReplay(self.path)
+            self.assertEqual(replay.run(), 11)
+        finally:
+            replayed.shutdown()
+        self.assertGreater(len(recorded.rows), 0)
+        self.assertEqual(replayed.rows, recorded.rows)
+        self.assertEqual(replayed.states, recorded.states)
+        self.assertIn((1, 'GOOD', 'IDLE'), replayed.states)
+        self.assertIn((2, 'OFFLINE', 'BUSY'), replayed.states)
+
+if __name__ == '__main__':
+    unittest.main()
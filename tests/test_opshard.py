@@ -0,0 +1,144 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+from dmstl.opraw import OctoPrintRawDataCollector, OctoPrintRawDataCollectorConfiguration
+from dmstl.opshard import OctoPrintShard, OctoPrintShardedRawDataCollectors, SharedRingBuffer, _shard_worker
+from octoprint_samples import FakeSession, configuration, job_json, printer_json
+from unittest import mock
+import queue
+import requests
+import threading
+import unittest
+
+class SharedRingBufferTest(unittest.TestCase):
+    def test_wraps_around(self):
+        ring = SharedRingBuffer(64)
+        for i1 in range(20):
+            payload = bytes([i1]) * (i1 % 7 + 10)
+            self.assertTrue(ring.put(payload))
+            self.assertEqual(ring.get(), payload)
+        self.assertIsNone(ring.get())
+    def test_full(self):
+        ring = SharedRingBuffer(64)
+        self.assertFalse(ring.put(b'x' * 61))
+        self.assertTrue(ring.put(b'a' * 30))
+        self.assertFalse(ring.put(b'b' * 30, timeout=0.0))
+        self.assertEqual(ring.get(), b'a' * 30)
+        self.assertTrue(ring.put(b'b' * 30, timeout=0.0))
+        self.assertEqual(ring.get(), b'b' * 30)
+
+class ShardWorkerTest(unittest.TestCase):
+    # The worker runs on a thread here, with fake sessions; the parent's
+    # side of the shard decodes what it sends back.
+    def setUp(self):
+        self.opened = list()
+        def new_session():
+            self.opened.append(FakeSession())
+            return self.opened[-1]
+        patcher = mock.patch.object(requests, 'Session', new_session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.control = queue.Queue()
+        self.done = queue.Queue()
+        self.shard = OctoPrintShard(0, self.done, 1 << 16, 2)
+        self.shard.ring = SharedRingBuffer(1 << 16)
+        self.worker = threading.Thread(target=_shard_worker, args=(0, self.control, self.done, self.shard.ring, 2), daemon=True)
+        self.worker.start()
+        self.addCleanup(self.stop)
+    def stop(self):
+        self.control.put(None)
+        self.worker.join(5.0)
+    def collect(self, cycle):
+        self.control.put(('collect', cycle))
+        self.assertEqual(self.done.get(timeout=5.0), (0, cycle))
+        results = dict()
+        while True:
+            record = self.shard.ring.get()
+            if record is None:
+                return results
+            id, collected = self.shard.decode(record)
+            results[id] = collected
+    def test_samples_come_back(self):
+        self.control.put(('printers', [configuration(1).row, configuration(2).row]))
+        first = self.collect(1)
+        self.assertEqual(sorted(first), [1, 2])
+        self.assertFalse(first[1].unchanged)
+        self.assertEqual(first[1]._jsons, {'PRINTER': printer_json(), 'JOB': job_json()})
+        # Unchanged responses come back as their prefixes only.
+        second = self.collect(2)
+        self.assertTrue(second[1].unchanged)
+        self.assertEqual(second[1]._jsons, first[1]._jsons)
+    def test_changed_printer_is_replaced(self):
+        self.control.put(('printers', [configuration(1).row, configuration(2).row]))
+        self.collect(1)
+        self.assertEqual(len(self.opened), 2)
+        moved = (2, 'Printer 2', '10.0.0.20', 'key', True)
+        self.control.put(('printers', [configuration(1).row, moved]))
+        results = self.collect(2)
+        self.assertEqual(sorted(results), [1, 2])
+        self.assertEqual(len(self.opened), 3)
+        self.assertTrue(self.opened[1].closed)
+        self.assertFalse(self.opened[0].closed)
+
+class Control():
+    def __init__(self):
+        super().__init__()
+        self.sent = list()
+    def put(self, message):
+        self.sent.append(message)
+
+class RebalanceTest(unittest.TestCase):
+    def setUp(self):
+        self.collectors = OctoPrintShardedRawDataCollectors(None, workers=3)
+        self.collectors._need_load = False
+        self.collectors._shards = [OctoPrintShard(i1, None, 0, 1) for i1 in range(3)]
+        for shard in self.collectors._shards:
+            shard.control = Control()
+        for id in range(1, 8):
+            self.add(configuration(id).row)
+    def add(self, row):
+        self.collectors.add_collector(OctoPrintRawDataCollector(OctoPrintRawDataCollectorConfiguration(row)))
+    def sent(self):
+        rv = [shard.control.sent for shard in self.collectors._shards]
+        for shard in self.collectors._shards:
+            shard.control = Control()
+        return rv
+    def test_balanced(self):
+        self.collectors._rebalance()
+        sent = self.sent()
+        self.assertEqual(sorted(len(s1[0][1]) for s1 in sent), [2, 2, 3])
+        self.assertEqual(sorted(row[0] for s1 in sent for row in s1[0][1]), list(range(1, 8)))
+        self.collectors._rebalance()
+        self.assertEqual(self.sent(), [[], [], []])
+    def test_changed_in_place_is_resent(self):
+        self.collectors._rebalance()
+        self.sent()
+        self.add((4, 'Printer 4', '10.0.0.40', 'key', True))
+        self.collectors._rebalance()
+        sent = self.sent()
+        self.assertEqual(sum(len(s1) for s1 in sent), 1)
+        rows = [row for s1 in sent for message in s1 for row in message[1]]
+        self.assertIn((4, 'Printer 4', '10.0.0.40', 'key', True), rows)
+
+if __name__ == '__main__':
+    unittest.main()
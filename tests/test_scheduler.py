@@ -0,0 +1,135 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+from dmstl.scheduler import ToolLogsScheduler, DispatchingToolLogsScheduler, OverrunPolicy
+import concurrent.futures
+import threading
+import time
+import unittest
+
+class Clock():
+    # The scheduler's timefunc and delayfunc; sleeping moves time on.
+    def __init__(self):
+        super().__init__()
+        self.now = 1000.0
+    def time(self):
+        return self.now
+    def sleep(self, delay):
+        self.now += max(0.0, delay)
+
+class OverrunPolicyTest(unittest.TestCase):
+    # A job every 10 seconds whose second run takes 25.
+    Durations = (1, 25, 1, 1, 1)
+    def run_job(self, policy):
+        clock = Clock()
+        scheduler = ToolLogsScheduler(clock.time, clock.sleep)
+        started = list()
+        def action():
+            started.append(clock.now)
+            clock.now += self.Durations[len(started)-1]
+            if len(started) == len(self.Durations):
+                scheduler.stop(event)
+        event = scheduler.every(10, 1, action, policy=policy)
+        scheduler.run()
+        return started, event.action.__self__.statistics
+    def test_drift(self):
+        started, stats = self.run_job(OverrunPolicy.DRIFT)
+        self.assertEqual(started, [1001, 1012, 1047, 1058, 1069])
+        self.assertEqual(stats.overruns, 1)
+    def test_skip(self):
+        started, stats = self.run_job(OverrunPolicy.SKIP)
+        self.assertEqual(started, [1001, 1011, 1041, 1051, 1061])
+        self.assertEqual((stats.overruns, stats.skipped), (1, 2))
+    def test_catch_up(self):
+        started, stats = self.run_job(OverrunPolicy.CATCH_UP)
+        self.assertEqual(started, [1001, 1011, 1036, 1037, 1041])
+        self.assertEqual(stats.overruns, 2)
+    def test_coalesce(self):
+        started, stats = self.run_job(OverrunPolicy.COALESCE)
+        self.assertEqual(started, [1001, 1011, 1036, 1041, 1051])
+        self.assertEqual((stats.overruns, stats.coalesced), (1, 1))
+    def test_statistics(self):
+        started, stats = self.run_job(OverrunPolicy.SKIP)
+        self.assertEqual(stats.runs, 5)
+        self.assertEqual(stats.duration.sum, 29)
+        self.assertEqual(stats.lateness.max, 0)
+
+class InlineExecutor():
+    # Runs what is submitted right away, on the scheduling thread.
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        future.set_result(fn(*args))
+        return future
+    def shutdown(self, wait=True):
+        pass
+
+class DispatchingSchedulerTest(unittest.TestCase):
+    def test_uses_the_schedulers_clock(self):
+        clock = Clock()
+        scheduler = DispatchingToolLogsScheduler(InlineExecutor(), timefunc=clock.time)
+        scheduler.delayfunc = clock.sleep
+        runs = list()
+        def action():
+            runs.append(clock.now)
+            clock.now += 3
+            if len(runs) == 3:
+                scheduler.stop(event)
+        event = scheduler.every(10, 1, action)
+        scheduler.run()
+        stats = event.action.__self__.statistics
+        self.assertEqual(runs, [1001, 1011, 1021])
+        self.assertEqual((stats.runs, stats.duration.sum), (3, 9))
+    def test_skips_while_in_flight(self):
+        clock = Clock()
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+        scheduler = DispatchingToolLogsScheduler(max_workers=1, timefunc=clock.time)
+        self.addCleanup(scheduler.shutdown)
+        scheduler.delayfunc = clock.sleep
+        def action():
+            gate.wait(5.0)
+        event = scheduler.every(10, 1, action)
+        scheduler.enterabs(1035, 2, lambda: scheduler.stop(event))
+        scheduler.run()
+        stats = event.action.__self__.statistics
+        self.assertEqual(stats.skipped, 3)
+        gate.set()
+    def test_entered_event_is_not_slept_through(self):
+        # run() worked out a long delay, then another thread entered an event
+        # that is due now before run() waited; that notify found no waiter.
+        scheduler = DispatchingToolLogsScheduler(InlineExecutor())
+        scheduler.enterabs(scheduler.timefunc(), 1, lambda: None)
+        began = time.monotonic()
+        scheduler._wait(5.0)
+        self.assertLess(time.monotonic() - began, 1.0)
+    def test_enter_wakes_the_wait(self):
+        scheduler = DispatchingToolLogsScheduler(InlineExecutor())
+        timer = threading.Timer(0.05, lambda: scheduler.enter(0, 1, lambda: None))
+        timer.start()
+        began = time.monotonic()
+        scheduler._wait(5.0)
+        timer.join()
+        self.assertLess(time.monotonic() - began, 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
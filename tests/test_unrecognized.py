@@ -0,0 +1,54 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import dmstl.unrecognized
+from dmstl.oplog import OctoPrintRawDataMaps
+from dmstl.rsb import RedundantStringsInMemory
+from dmstl.unrecognized import log_unrecognized_summary, reset_unrecognized_paths, unrecognized_paths
+from octoprint_samples import printer_json
+import logging
+import unittest
+
+class UnrecognizedPathsTest(unittest.TestCase):
+    def setUp(self):
+        reset_unrecognized_paths()
+        logging.getLogger('dmstl.unrecognized').disabled = True
+        self.schema = OctoPrintRawDataMaps(RedundantStringsInMemory()).schema()
+    def tearDown(self):
+        logging.getLogger('dmstl.unrecognized').disabled = False
+        reset_unrecognized_paths()
+    def walk(self, times):
+        printer = printer_json()
+        printer['sd']['files'] = 3
+        for i1 in range(times):
+            self.schema.new_values().update('PRINTER', printer)
+    def test_every_sample_is_counted(self):
+        self.walk(5)
+        self.assertEqual(unrecognized_paths(), {'PRINTER_SD_FILES': 5})
+    def test_summary_follows_the_count(self):
+        self.walk(2)
+        log_unrecognized_summary()
+        self.assertEqual(dmstl.unrecognized._reported, 2)
+        self.walk(3)
+        log_unrecognized_summary()
+        self.assertEqual(dmstl.unrecognized._reported, 5)
@@ -0,0 +1,91 @@
+#
+# Copyright (c) 2017 by Rowdy Dog Software
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+from dmstl.oplog import OctoPrintRawDataMaps
+from dmstl.opsim import VirtualPrinter
+from dmstl.rsb import RedundantStringsInMemory
+import unittest
+try:
+    import numpy
+    from dmstl.vectorize import RawColumns, convert_column
+except ImportError:
+    numpy = None
+
+def samples(count):
+    # Bodies from virtual printers in all sorts of states.
+    rv = list()
+    for number in range(1, count+1):
+        printer = VirtualPrinter(number, timefunc=lambda number=number: number * 97.0)
+        rv.append((printer.printer_body(), printer.job_body()))
+    return rv
+
+def scalar(field_map, value):
+    # (value, null, invalid) as the field map converts one value; an int
+    # column holds 64 bits.
+    if value is None:
+        return (None, True, False)
+    try:
+        value = field_map.convert(value)
+    except (TypeError, ValueError, OverflowError):
+        return (None, True, True)
+    if (field_map.column_typecode() == 'q') and (value is not None) and not (-(1 << 63) <= value < (1 << 63)):
+        return (None, True, True)
+    return (value, value is None, False)
+
+@unittest.skipIf(numpy is None, 'needs NumPy')
+class ConvertColumnTest(unittest.TestCase):
+    def setUp(self):
+        self.maps = OctoPrintRawDataMaps(RedundantStringsInMemory())
+        self.schema = self.maps.schema()
+    def check(self, field_map, raw):
+        column = convert_column(field_map, raw)
+        for i1, v1 in enumerate(raw):
+            value, null, invalid = scalar(field_map, v1)
+            got = (column.nulls[i1], column.invalid[i1])
+            self.assertEqual(got, (null, invalid), (field_map.field_name(), v1))
+            if null:
+                self.assertFalse(column.values[i1])
+            elif value != value:
+                self.assertTrue(numpy.isnan(column.values[i1]))
+            else:
+                self.assertEqual(column.values[i1], value, (field_map.field_name(), v1))
+    def test_samples_match_scalar_conversion(self):
+        raw = RawColumns(self.schema)
+        for printer, job in samples(300):
+            raw.new_row()
+            self.maps.set_printer_id(7, raw)
+            raw.update('PRINTER', printer)
+            raw.update('JOB', job)
+        for f1, c1 in zip(self.schema.fields, raw._columns):
+            self.check(f1, c1)
+    def test_odd_values_match_scalar_conversion(self):
+        odd = [None, 0, 1, -1, True, False, 2.5, -2.5, 1e300, float('nan'), float('inf'),
+                '12', '1.5', 'abc', '', 1 << 62, 1 << 70, -(1 << 70), [1], {'a': 1}]
+        for f1 in self.schema.fields:
+            for start in range(len(odd)):
+                # Each value in a column of its own and among the others.
+                self.check(f1, odd[start:start+1])
+            self.check(f1, odd)
+
+if __name__ == '__main__':
+    unittest.main()